@@ -0,0 +1,727 @@
+"""Headless benchmarks against the simulated desktop.
+
+    python bench.py            # all scenarios
+    python bench.py drag       # just one
+"""
+import contextlib
+import ctypes
+import sys
+import time
+import types
+
+import ghost_core as ghost
+
+class ManualClock:
+    """Stands in for Tk's after(): callbacks run when advance() passes their due time."""
+    def __init__(self):
+        self.now_ms = 0.0
+        self.timers = []
+
+    def after(self, ms, fn):
+        self.timers.append((self.now_ms + ms, fn))
+
+    def advance(self, to_ms):
+        while True:
+            due = [t for t in self.timers if t[0] <= to_ms]
+            if not due: break
+            first = min(due, key=lambda t: t[0])
+            self.timers.remove(first)
+            self.now_ms = first[0]
+            first[1]()
+        self.now_ms = to_ms
+
+def _fresh_desktop(count=200, **kw):
+    ghost.restore_all()
+    sim = ghost.set_backend(ghost.SimulatedDesktop(count=count, **kw))
+    ghost.enable_instrumentation()
+    return sim
+
+def _drag_values(events):
+    # 100% -> 10% and back, like a pointer sweeping the slider
+    half = events // 2
+    down = [round(100 - 90 * i / max(1, half - 1)) for i in range(half)]
+    return down + down[::-1][: events - half]
+
+def bench_drag(events=400, duration_ms=1000.0):
+    """Backend calls for a scripted slider drag: direct per-event apply vs the coalescing pipeline."""
+    values = _drag_values(events)
+    step_ms = duration_ms / events
+
+    _fresh_desktop()
+    hwnd = ghost.get_visible_windows()[0][0]
+    ghost.set_window_alpha(hwnd, 100)
+    with ghost.count_calls() as before:
+        t0 = time.perf_counter()
+        for v in values:
+            ghost.set_window_alpha(hwnd, v)
+        before_s = time.perf_counter() - t0
+
+    _fresh_desktop()
+    hwnd = ghost.get_visible_windows()[0][0]
+    ghost.set_window_alpha(hwnd, 100)
+    clock = ManualClock()
+    commits = []
+    pipeline = ghost.AlphaPipeline(clock.after, on_commit=commits.append)
+    with ghost.count_calls() as after:
+        t0 = time.perf_counter()
+        for i, v in enumerate(values):
+            clock.advance(i * step_ms)
+            pipeline.request(hwnd, v)
+        clock.advance(duration_ms + ghost.FRAME_MS)
+        after_s = time.perf_counter() - t0
+
+    print(f"drag: {events} slider events over {duration_ms:.0f} ms")
+    print(f"  direct   : {sum(before.values()):5d} backend calls {before}  ({before_s * 1000:.2f} ms)")
+    print(f"  pipelined: {sum(after.values()):5d} backend calls {after}  ({after_s * 1000:.2f} ms, {len(commits)} label updates)")
+
+def _legacy_get_visible_windows():
+    """get_visible_windows as it used to be, for comparison: a fresh callback prototype and closure per call,
+    a fresh title buffer per window, a list literal for the junk filter. CFUNCTYPE stands in for WINFUNCTYPE
+    off Windows, and the callback is invoked once per window the way EnumWindows would."""
+    b = ghost.backend
+    proto = getattr(ctypes, "WINFUNCTYPE", ctypes.CFUNCTYPE)(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+    wins = []
+
+    @proto
+    def enum_proc(hwnd, lParam):
+        if not b.is_window_visible(hwnd): return 1
+        length = b.get_window_text_length(hwnd)
+        if length > 0:
+            buff = ctypes.create_unicode_buffer(length + 1)
+            buff.value = b.get_window_text(hwnd, length)
+            title = buff.value
+            if title not in ["Program Manager", "Settings", "Microsoft Text Input Application"]:
+                wins.append((hwnd, title))
+        return 1
+
+    for hwnd in b.enum_windows():
+        enum_proc(hwnd, 0)
+    return sorted(wins, key=lambda x: x[1].lower())
+
+def _best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+# Foreign-function stand-ins: every export is a bare function pointer (no argtypes, like a fresh windll
+# attribute) onto a ctypes callback, so the backends under test pay real ctypes marshalling per call
+_STUB_PROTO = getattr(ctypes, "WINFUNCTYPE", ctypes.CFUNCTYPE)
+
+class _StubDll:
+    def __init__(self, exports):
+        self._thunks = [] # keep the callbacks alive
+        self.calls = 0 # every export call, for calls-per-window
+        for name, (restype, argtypes, fn) in exports.items():
+            thunk = _STUB_PROTO(restype, *argtypes)(self._counted(fn))
+            self._thunks.append(thunk)
+            ptr = _STUB_PROTO(restype)(ctypes.cast(thunk, ctypes.c_void_p).value)
+            ptr.argtypes = None
+            setattr(self, name, ptr)
+
+    def _counted(self, fn):
+        def call(*args):
+            self.calls += 1
+            return fn(*args)
+        return call
+
+    def __getattr__(self, name):
+        # Exports the enumeration never calls: enough to take argtypes/restype
+        fn = types.SimpleNamespace()
+        setattr(self, name, fn)
+        return fn
+
+def _stub_user32(sim):
+    """user32 over a simulated desktop: EnumWindows, visibility and the three title reads."""
+    wins = sim.windows
+    i, p = ctypes.c_int, ctypes.c_void_p
+
+    def write(buf, n, text):
+        text = text[:max(0, n - 1)]
+        (ctypes.c_wchar * n).from_address(buf).value = text
+        return len(text)
+
+    def enum_windows(proc, lparam):
+        visit = ghost.WNDENUMPROC(proc)
+        for hwnd in list(wins):
+            if not visit(hwnd, lparam or 0): break
+        return 1
+
+    def title(hwnd):
+        w = wins.get(hwnd or 0)
+        return w.title if w is not None else ""
+
+    def send_message_timeout(hwnd, msg, wparam, lparam, flags, timeout, copied):
+        ctypes.c_size_t.from_address(copied).value = write(lparam, wparam, title(hwnd))
+        return 1
+
+    return _StubDll({
+        "EnumWindows": (i, (p, p), enum_windows),
+        "IsWindowVisible": (i, (p,), lambda hwnd: 1 if wins.get(hwnd or 0, None) and wins[hwnd].visible else 0),
+        "GetWindowTextLengthW": (i, (p,), lambda hwnd: len(title(hwnd))),
+        "GetWindowTextW": (i, (p, p, i), lambda hwnd, buf, n: write(buf, n, title(hwnd))),
+        "InternalGetWindowText": (i, (p, p, i), lambda hwnd, buf, n: write(buf, n, title(hwnd))),
+        "SendMessageTimeoutW": (p, (p, ctypes.c_uint, ctypes.c_size_t, p, ctypes.c_uint, ctypes.c_uint, p),
+                                send_message_timeout),
+    })
+
+class _StubWindll:
+    """A fresh DLL per attribute access, so the argtypes one backend sets don't leak into another."""
+    def __init__(self, sim):
+        self.sim = sim
+
+    @property
+    def user32(self): return _stub_user32(self.sim)
+
+    @property
+    def kernel32(self): return _StubDll({})
+
+@contextlib.contextmanager
+def _stubbed_win32(sim):
+    """Lets Win32Backend be built (and run) anywhere, with user32 answering from `sim`."""
+    saved_dll, saved_proto = getattr(ctypes, "windll", None), ghost.WNDENUMPROC
+    ctypes.windll = _StubWindll(sim)
+    if ghost.WNDENUMPROC is None: ghost.WNDENUMPROC = ctypes.CFUNCTYPE(ghost.BOOL, ghost.HWND, ghost.LPARAM)
+    try:
+        yield
+    finally:
+        ghost.WNDENUMPROC = saved_proto
+        if saved_dll is None: del ctypes.windll
+        else: ctypes.windll = saved_dll
+
+class _BaselineWin32Backend(ghost.WindowBackend):
+    """Win32Backend's enumeration path as it was before it was made allocation-free (py.py at the parent of
+    the user-009 commit): a prototype and closure per enumeration, a c_void_p per call, a buffer per title."""
+    def __init__(self):
+        self.u32 = ctypes.windll.user32
+
+    def enum_windows(self):
+        hwnds = []
+
+        @_STUB_PROTO(ghost.BOOL, ghost.HWND, ctypes.c_void_p)
+        def enum_proc(hwnd, lParam):
+            hwnds.append(hwnd)
+            return 1
+
+        self.u32.EnumWindows(enum_proc, 0)
+        return hwnds
+
+    def is_window_visible(self, hwnd):
+        return self.u32.IsWindowVisible(ctypes.c_void_p(hwnd))
+
+    def get_window_text_length(self, hwnd):
+        return self.u32.GetWindowTextLengthW(ctypes.c_void_p(hwnd))
+
+    def get_window_text(self, hwnd, length):
+        buff = ctypes.create_unicode_buffer(length + 1)
+        self.u32.GetWindowTextW(ctypes.c_void_p(hwnd), buff, length + 1)
+        return buff.value
+
+def _baseline_get_visible_windows(b):
+    """get_visible_windows and visible_title from the same baseline."""
+    wins = []
+    for hwnd in b.enum_windows():
+        if not b.is_window_visible(hwnd): continue
+        length = b.get_window_text_length(hwnd)
+        if length <= 0: continue
+        title = b.get_window_text(hwnd, length)
+        if title and title not in ghost.JUNK_TITLES:
+            wins.append((hwnd, title))
+    return sorted(wins, key=lambda x: x[1].lower())
+
+def bench_enum(sizes=(1000, 5000, 10000)):
+    """Per-window cost of Win32Backend enumeration, before and after, over a stubbed user32."""
+    print("enum: per-window cost of get_visible_windows (best of 5, Win32Backend over a stubbed user32)")
+    for n in sizes:
+        ghost.restore_all()
+        ghost.disable_instrumentation()
+        sim = ghost.SimulatedDesktop(count=n)
+        with _stubbed_win32(sim):
+            baseline = _BaselineWin32Backend()
+            engine = ghost.set_backend(ghost.Win32Backend())
+            listed = ghost.get_visible_windows()
+            assert listed and listed == _baseline_get_visible_windows(baseline)
+            baseline.u32.calls = engine.u32.calls = 0
+            before = _best_of(lambda: _baseline_get_visible_windows(baseline))
+            after = _best_of(ghost.get_visible_windows)
+            calls_before, calls_after = baseline.u32.calls / 5 / n, engine.u32.calls / 5 / n
+        ghost.set_backend(sim)
+        print(f"  {n:>6} windows: baseline {before / n * 1e6:6.2f} us/window ({calls_before:.2f} calls)   "
+              f"Win32Backend {after / n * 1e6:6.2f} us/window ({calls_after:.2f} calls)")
+
+def bench_hung(count=500, hung=5, hang_s=0.5):
+    """Enumeration latency when some apps have stopped pumping messages."""
+    print(f"hung: {count} windows, {hung} hung for {hang_s * 1000:.0f} ms per message")
+    ghost.restore_all()
+    ghost.disable_instrumentation()
+    sim = ghost.set_backend(ghost.SimulatedDesktop(count=count, hung=hung, hang_s=hang_s))
+    t0 = time.perf_counter()
+    _legacy_get_visible_windows()
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ghost.get_visible_windows()
+    engine = time.perf_counter() - t0
+    print(f"  GetWindowTextW        : {legacy * 1000:8.1f} ms per enumeration")
+    print(f"  InternalGetWindowText : {engine * 1000:8.1f} ms per enumeration")
+
+    # Forced fresh reads: each hung window costs one timeout, then is skipped until retry_s passes
+    stuck = [h for h, w in sim.windows.items() if w.hung]
+    fetcher = ghost.TitleFetcher(timeout_ms=50)
+    for attempt in ("first", "second"):
+        t0 = time.perf_counter()
+        for h in stuck: fetcher.get(h, fresh=True)
+        print(f"  fresh reads, {attempt:6}: {(time.perf_counter() - t0) * 1000:8.1f} ms for {len(stuck)} hung windows")
+
+def _ghost_windows(sim, n):
+    hwnds = [h for h, w in sim.windows.items() if w.visible][:n]
+    for h in hwnds: ghost.set_window_alpha(h, 60)
+    return hwnds
+
+def bench_ctrl(count=50, latency_s=0.002, hung=1, hang_s=0.25):
+    """CTRL down/up across many ghosted windows: one-by-one on the UI thread vs the fan-out pool."""
+    import threading
+    print(f"ctrl: {count} ghosted windows, {latency_s * 1000:.0f} ms per cross-process call, {hung} hung for {hang_s * 1000:.0f} ms")
+    for label, n_hung in (("healthy", 0), ("one hung", hung)):
+        sim = _fresh_desktop(count=count * 2, latency_s=latency_s, hang_s=hang_s)
+        ghost.disable_instrumentation()
+        hwnds = _ghost_windows(sim, count)
+        for h in hwnds[:n_hung]: sim.windows[h].hung = True
+
+        t0 = time.perf_counter()
+        for enable in (True, False):
+            for h in ghost.tracked_windows(exclude=ghost.STATE_LOCKED):
+                ghost.set_passthrough_for_hwnd(h, enable=enable)
+        serial = (time.perf_counter() - t0) / 2
+
+        done = threading.Event()
+        fanout = ghost.PassthroughFanout(on_report=lambda r: done.set())
+        ui_block, last = [], []
+        for enable in (True, False):
+            done.clear()
+            t0 = time.perf_counter()
+            fanout.apply(enable, started_at=t0)
+            ui_block.append(time.perf_counter() - t0)
+            done.wait()
+            last.append(fanout.last_report.latency_ms)
+        fanout.shutdown()
+        ok = all(bool(sim.windows[h].ex_style & ghost.WS_EX_TRANSPARENT) is False for h in hwnds)
+        print(f"  {label:9}: serial {serial * 1000:7.1f} ms on the UI thread | fan-out: UI thread {max(ui_block) * 1000:5.2f} ms, "
+              f"last window after {max(last):6.1f} ms{'' if ok else '  (STATE MISMATCH)'}")
+    ghost.restore_all()
+
+def bench_fade(count=100, duration_ms=500, targets=(20, 85)):
+    """count simultaneous fades: one frame clock and byte-skipping vs one timer per window writing every frame."""
+    print(f"fade: {count} simultaneous fades over {duration_ms} ms at {1000 // ghost.FRAME_MS} fps")
+    sim = _fresh_desktop(count=count * 2)
+    hwnds = _ghost_windows(sim, count)
+    frames = duration_ms // ghost.FRAME_MS
+    for to_pct in targets:
+        # Naive: every window owns an after() chain and writes on every frame
+        for h in hwnds: ghost.set_window_alpha(h, 100)
+        clock = ManualClock()
+        def step(h, i):
+            ghost.set_window_alpha(h, 100 + (to_pct - 100) * i / frames)
+            if i < frames: clock.after(ghost.FRAME_MS, lambda: step(h, i + 1))
+        for h in hwnds: clock.after(ghost.FRAME_MS, lambda h=h: step(h, 1))
+        with ghost.count_calls() as calls:
+            clock.advance(duration_ms + 100)
+        naive_calls = sum(calls.values())
+
+        for h in hwnds: ghost.set_window_alpha(h, 100)
+        clock = ManualClock()
+        anim = ghost.AlphaAnimator(clock.after, clock=lambda: clock.now_ms / 1000.0)
+        for h in hwnds: anim.fade(h, to_pct, duration_ms=duration_ms, easing="ease_in_out", from_0_100=100)
+        worst = 0.0
+        tick = anim.tick
+        def timed_tick():
+            nonlocal worst
+            t = time.perf_counter()
+            tick()
+            worst = max(worst, time.perf_counter() - t)
+        anim.tick = timed_tick
+        with ghost.count_calls() as calls:
+            clock.advance(duration_ms + 100)
+        engine_calls = sum(calls.values())
+        landed = all(sim.windows[h].alpha == ghost.alpha_byte(to_pct) for h in hwnds)
+
+        print(f"  100% -> {to_pct}%: per-window timers {naive_calls:5d} calls, {count} timers per frame | "
+              f"frame clock {engine_calls:5d} calls, 1 timer per frame, worst frame {worst * 1000:.2f} ms of {ghost.FRAME_MS}"
+              f"{'' if landed else '  (DID NOT LAND)'}")
+    ghost.restore_all()
+
+def _synthetic_rules(n, seed=0):
+    """n rules in a realistic mix: mostly exe/class, some narrowed by title, a few title-only regexes."""
+    import random
+    rng = random.Random(seed)
+    rules = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.45:
+            rules.append(ghost.Rule(exe=f"app{i}.exe", alpha=70))
+        elif roll < 0.75:
+            rules.append(ghost.Rule(exe=f"app{i}.exe", cls=f"Class{i % 50}", alpha=60, passthrough=True))
+        elif roll < 0.95:
+            rules.append(ghost.Rule(cls=f"Class{i}", title=f"^Project {i}\\b", alpha=50))
+        else:
+            rules.append(ghost.Rule(title=f"ticket-{i}\\d+", alpha=80))
+    # and the ones that actually fire on the simulated desktop, at the end so every earlier table is probed
+    rules.append(ghost.Rule(exe="slack.exe", cls="Chrome_WidgetWin_1", alpha=70, passthrough=True))
+    rules.append(ghost.Rule(title=" - MINGW64$", alpha=85))
+    return rules
+
+def bench_rules(n=1000, count=2000):
+    """Matching windows against n auto-apply rules: compiled tables vs trying each rule in order."""
+    sim = ghost.set_backend(ghost.SimulatedDesktop(count=count))
+    wins = [(w.exe, w.cls, w.title) for w in sim.windows.values() if w.visible and w.title]
+    ruleset = ghost.RuleSet(_synthetic_rules(n))
+
+    def linear(exe, cls, title):
+        exe = exe.lower()
+        for r in ruleset.rules:
+            if (r.exe is None or r.exe == exe) and (r.cls is None or r.cls == cls) and \
+                    (r.title_re is None or r.title_re.search(title)):
+                return r
+        return None
+
+    assert all(linear(*w) is ruleset.match(*w) for w in wins)
+    hits = sum(ruleset.match(*w) is not None for w in wins)
+    t_lin = _best_of(lambda: [linear(*w) for w in wins], repeat=3)
+    t_cmp = _best_of(lambda: [ruleset.match(*w) for w in wins])
+    print(f"rules: {len(ruleset.rules)} rules x {len(wins)} windows ({hits} matched)")
+    print(f"  rule by rule: {t_lin / len(wins) * 1e6:8.2f} us/window")
+    print(f"  compiled    : {t_cmp / len(wins) * 1e6:8.2f} us/window")
+
+def bench_journal(entries=10000, windows=200, ticks=400):
+    """Crash journal: replay speed, and disk writes for a slider drag."""
+    import os
+    import tempfile
+    import random
+    rng = random.Random(0)
+    recs = bytearray(ghost.JOURNAL_MAGIC)
+    live = []
+    for i in range(entries):
+        if not live or rng.random() < 0.05:
+            h = 0x10000 + i
+            live.append(h)
+            recs += ghost._JREC.pack(ghost.J_ADOPT, 0, 0, 1000 + i % 50, h, 0x100)
+        elif rng.random() < 0.02:
+            recs += ghost._JREC.pack(ghost.J_FORGET, 0, 0, 0, live.pop(rng.randrange(len(live))), 0)
+        else:
+            recs += ghost._JREC.pack(ghost.J_STATE, rng.randrange(256), 4, 0, rng.choice(live), 0)
+    data = bytes(recs)
+    t = _best_of(lambda: ghost.replay_journal(data))
+    print(f"journal: replay {entries} records ({len(data) // 1024} KiB): {t * 1000:.2f} ms, "
+          f"{len(ghost.replay_journal(data))} windows live")
+
+    sim = _fresh_desktop(count=windows)
+    hwnd = next(h for h, w in sim.windows.items() if w.visible)
+    path = os.path.join(tempfile.mkdtemp(), "journal.bin")
+    ghost.open_journal(path)
+    t0 = time.perf_counter()
+    for i in range(ticks):
+        ghost.set_window_alpha(hwnd, 100 - i % 90)
+    spent = time.perf_counter() - t0
+    time.sleep(ghost.journal.flush_ms / 1000.0 * 3)
+    print(f"  {ticks}-tick slider drag: {ghost.journal.flushes} fsync(s), {os.path.getsize(path)} bytes on disk, "
+          f"{spent / ticks * 1e6:.1f} us per tick on the caller")
+    ghost.restore_all()
+    ghost.close_journal()
+
+def bench_cli(repeat=10):
+    """Cold start of the headless CLI, interpreter launch included (best of repeat), against the simulated desktop."""
+    import os
+    import subprocess
+    import tempfile
+    env = dict(os.environ, GHOST_BACKEND="sim", APPDATA=tempfile.mkdtemp())
+    here = os.path.dirname(os.path.abspath(__file__))
+    cli = os.path.join(here, "ghost_cli.py")
+
+    def cold(*args):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, *args], env=env, cwd=here, stdout=subprocess.DEVNULL, check=False)
+            best = min(best, time.perf_counter() - t0)
+        return best * 1000
+
+    gui_free = subprocess.run([sys.executable, "-c", "import ghost_cli, sys; print(any(m.split('.')[0] in "
+                               "('tkinter', 'customtkinter') for m in sys.modules))"],
+                              env=env, cwd=here, capture_output=True, text=True).stdout.strip() == "False"
+    print(f"cli: cold start, best of {repeat} (GUI modules loaded: {'no' if gui_free else 'YES'})")
+    print(f"  python -c pass            : {cold('-c', 'pass'):6.1f} ms")
+    print(f"  ghost_cli --list          : {cold(cli, '--list'):6.1f} ms")
+    print(f"  ghost_cli --hwnd --alpha  : {cold(cli, '--hwnd', '0x1001c', '--alpha', '60'):6.1f} ms")
+    print(f"  ghost_cli --restore-all   : {cold(cli, '--restore-all'):6.1f} ms")
+
+def bench_instance(repeat=10):
+    """Second launch while an instance is running: forward argv over the control channel vs doing the work locally."""
+    import json
+    import os
+    import subprocess
+    import tempfile
+    import ghost_cli
+    appdata = tempfile.mkdtemp()
+    env = dict(os.environ, GHOST_BACKEND="sim", APPDATA=appdata)
+    here = os.path.dirname(os.path.abspath(__file__))
+    args = ["--hwnd", "0x1001c", "--alpha", "60"]
+
+    def cold(script):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(here, script), *args], env=env, cwd=here,
+                           stdout=subprocess.DEVNULL, check=False)
+            best = min(best, time.perf_counter() - t0)
+        return best * 1000
+
+    local = cold("ghost_cli.py")
+
+    # Stand-in for the running GUI: this process holds the lock and serves "args" the way App does, minus Tk
+    ghost.APP_DIR = os.path.join(appdata, "GhostWindow")
+    lock = ghost.InstanceLock()
+    assert lock.acquire()
+
+    def run_args(arg):
+        out, err = [], []
+        code = ghost_cli.run(ghost_cli.build_parser().parse_args(json.loads(arg)), out.append, err.append)
+        return json.dumps({"exit": code, "output": out, "errors": err})
+
+    server = ghost.ControlServer({"args": run_args})
+    server.start()
+    try:
+        forwarded_cli, forwarded_gui = cold("ghost_cli.py"), cold("py.py")
+        line = "args " + json.dumps(args)
+        ghost.send_commands([line])
+        t0 = time.perf_counter()
+        for _ in range(200):
+            ghost.send_commands([line])
+        round_trip = (time.perf_counter() - t0) / 200 * 1000
+    finally:
+        server.stop()
+        lock.release()
+    print(f"instance: second launch, interpreter start included (best of {repeat})")
+    print(f"  ghost_cli, no instance running  : {local:6.1f} ms")
+    print(f"  ghost_cli, forwarded            : {forwarded_cli:6.1f} ms")
+    print(f"  py.py, forwarded (no Tk import) : {forwarded_gui:6.1f} ms")
+    print(f"  connect + command + reply       : {round_trip:6.2f} ms")
+
+def bench_control(total=20000, windows=50):
+    """Control-channel throughput: total window commands sent one per round trip, in batches, and pipelined."""
+    import os
+    import tempfile
+    sim = _fresh_desktop(count=windows * 2)
+    ghost.disable_instrumentation()
+    hwnds = [h for h, w in sim.windows.items() if w.visible][:windows]
+    commands = []
+    for i in range(total):
+        h = hwnds[i % windows]
+        commands.append(f"set_alpha {h:#x} {20 + i % 80}" if i % 4 else f"set_passthrough {h:#x} {'on' if i % 8 else 'off'}")
+    tmp = tempfile.mkdtemp()
+    address = os.path.join(tmp, "control.sock")
+    ghost.open_journal(os.path.join(tmp, "journal.bin")) # every command also goes through the crash journal, as in the app
+    server = ghost.ControlServer(dict(ghost.WINDOW_COMMANDS), address=address)
+    server.start()
+    print(f"control: {total} set_alpha / set_passthrough commands over {windows} windows, Unix socket, journal on")
+    try:
+        with ghost.ControlClient(address) as client:
+            def run(label, batch_size, depth):
+                n = total if batch_size > 1 else total // 10 # one per round trip is slow enough to sample
+                batches = [commands[i:i + batch_size] for i in range(0, n, batch_size)]
+                t0 = time.perf_counter()
+                replies = client.pipeline(batches, depth=depth)
+                elapsed = time.perf_counter() - t0
+                failed = sum(not r.startswith("ok") for batch in replies for r in batch)
+                print(f"  {label:<28}: {n / elapsed:9,.0f} commands/s  {len(batches) / elapsed:8,.0f} round trips/s"
+                      + (f"  ({failed} failed)" if failed else ""))
+
+            run("1 per round trip", 1, 1)
+            run("batches of 50", 50, 1)
+            run("batches of 50, pipelined", 50, 4)
+            run("batches of 1000", 1000, 1)
+            run("batches of 1000, pipelined", 1000, 4)
+    finally:
+        server.stop()
+        ghost.restore_all()
+        ghost.close_journal()
+
+def bench_state(entries=10000, repeat=50):
+    """modified_windows at entries windows: the old five-key dicts vs WindowState slots + flag bits."""
+    import tracemalloc
+
+    def as_dict(i):
+        return {"orig_ex": 0x100, "ex": 0x80100, "alpha": 153, "passthrough": i % 3 == 0,
+                "is_topmost": True, "passthrough_locked": i % 5 == 0}
+
+    def as_state(i):
+        flags = ghost.STATE_TOPMOST | (ghost.STATE_PASSTHROUGH if i % 3 == 0 else 0) | (ghost.STATE_LOCKED if i % 5 == 0 else 0)
+        return ghost.WindowState(0x100, 0x80100, 153, flags)
+
+    def measure(make):
+        tracemalloc.start()
+        table = {0x10000 + 4 * i: make(i) for i in range(entries)}
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return table, size
+
+    dicts, dict_bytes = measure(as_dict)
+    states, state_bytes = measure(as_state)
+
+    def best(fn):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return min(times) / entries * 1e9
+
+    old_unlocked = best(lambda: [h for h, info in list(dicts.items()) if not info.get("passthrough_locked")])
+    saved, ghost.modified_windows = ghost.modified_windows, states
+    try:
+        new_unlocked = best(lambda: ghost.tracked_windows(exclude=ghost.STATE_LOCKED))
+        new_mixed = best(lambda: ghost.tracked_windows(require=ghost.STATE_PASSTHROUGH, exclude=ghost.STATE_LOCKED))
+    finally:
+        ghost.modified_windows = saved
+    old_mixed = best(lambda: [h for h, info in list(dicts.items())
+                              if info.get("passthrough") and not info.get("passthrough_locked")])
+    print(f"state: {entries} tracked windows")
+    print(f"  memory          : dicts {dict_bytes / entries:5.0f} B/window | WindowState {state_bytes / entries:5.0f} B/window")
+    print(f"  unlocked        : dicts {old_unlocked:5.1f} ns/window | mask {new_unlocked:5.1f} ns/window")
+    print(f"  passthrough only: dicts {old_mixed:5.1f} ns/window | mask {new_mixed:5.1f} ns/window")
+
+def bench_evict(cycles=200, per_cycle=5, reuse_every=3):
+    """A long session: windows get ghosted, then closed, some handles reused by new windows of other processes.
+    Tracked entries and CTRL fan-out work with no eviction, with the WinEvent hook, and with only the sweep."""
+    print(f"evict: {cycles} cycles of {per_cycle} windows ghosted then closed, every {reuse_every}rd handle reused")
+    for label in ("none", "hook", "sweep"):
+        sim = _fresh_desktop(count=50)
+        ghost.disable_instrumentation()
+        watcher = ghost.watch_window_events() if label == "hook" else None
+        live = [h for h, w in sim.windows.items() if w.visible][:10]
+        for h in live: ghost.set_window_alpha(h, 60) # long-lived ghosted windows, open all session
+        reused = []
+        for c in range(cycles):
+            opened = [sim.add_window(f"Temp {c}.{i}", exe="temp.exe") for i in range(per_cycle)]
+            for h in opened: ghost.set_window_alpha(h, 50)
+            for i, h in enumerate(opened):
+                sim.close_window(h)
+                if (c * per_cycle + i) % reuse_every == 0:
+                    reused.append(sim.add_window(f"Unrelated {c}.{i}", exe=f"other{c}.exe", hwnd=h))
+            if label == "sweep" and c % 20 == 19: ghost.sweep_dead_windows() # stands in for the periodic timer
+        entries = len(ghost.modified_windows)
+        fanout = ghost.PassthroughFanout()
+        fanout.apply(True)
+        fanout.shutdown() # waits for the writes
+        moves = fanout.last_report.windows
+        touched = [h for h in reused if sim.windows[h].ex_style & ghost.WS_EX_TRANSPARENT]
+        fanout = ghost.PassthroughFanout()
+        fanout.apply(False)
+        fanout.shutdown()
+        t0 = time.perf_counter()
+        swept = ghost.sweep_dead_windows()
+        sweep_us = (time.perf_counter() - t0) * 1e6
+        wrong = sum(1 for h in reused if sim.windows[h].alpha != 255 or sim.windows[h].ex_style & ghost.WS_EX_LAYERED)
+        if watcher: watcher.stop()
+        print(f"  {label:5}: {entries:5} tracked ({len(live)} alive) | CTRL down {moves:5} writes "
+              f"({len(touched)} onto reused handles) | final sweep {len(swept):4} in {sweep_us:7.0f} us"
+              f" | reused windows left styled: {wrong}")
+        ghost.restore_all()
+
+def bench_reconcile(count=20):
+    """Backend calls for everyday operations, by phase. Repeats of a state already reached should cost nothing."""
+    sim = _fresh_desktop(count=count * 3)
+    hwnds = [h for h, w in sim.windows.items() if w.visible][:count]
+    fanout = ghost.PassthroughFanout()
+
+    def ctrl(enable):
+        fanout.apply(enable)
+        fanout.pool.submit(lambda: None).result() # let the pool drain
+        time.sleep(0.01)
+
+    rules = ghost.RuleSet([ghost.Rule(None, None, None, 70, True)])
+
+    def rule():
+        for h in hwnds:
+            rules.apply(h, rules.rules[0])
+
+    phases = [
+        ("rule: 70% + locked click-through", rule),
+        ("same rule again", rule),
+        ("unlock click-through", lambda: [ghost.set_passthrough_for_hwnd(h, False) for h in hwnds]),
+        ("slider: 100 events, 40 distinct", lambda: [ghost.set_window_alpha(hwnds[0], 30 + i * 40 // 100)
+                                                     for i in range(100)]),
+        ("CTRL down/up x5", lambda: [ctrl(e) for _ in range(5) for e in (True, False)]),
+        ("script resends 60% x3", lambda: [ghost.set_window_alpha(h, 60) for _ in range(3) for h in hwnds]),
+        ("restore all", ghost.restore_all),
+    ]
+    print(f"reconcile: backend calls per phase, {count} windows")
+    total = 0
+    for label, run in phases:
+        with ghost.count_calls() as calls:
+            run()
+        n = sum(calls.values())
+        total += n
+        detail = ", ".join(f"{api} {k}" for api, k in sorted(calls.items(), key=lambda kv: -kv[1]))
+        print(f"  {label:<34}: {n:5}  {detail}")
+    print(f"  {'total':<34}: {total:5}")
+    fanout.shutdown()
+
+def bench_search(count=7000, limit=200, queries=("d", "do", "doc", "docu", "document 12", "chrome", "nt", "vsc")):
+    """Type-to-filter on a large desktop (target < 1 ms a keystroke), and a resync diffed in vs a rebuilt store."""
+    sim = ghost.set_backend(ghost.SimulatedDesktop(count=count))
+    inv = ghost.WindowInventory()
+    inv.seed()
+    print(f"search: {len(inv.store)} windows, limit {limit}")
+    for q in queries:
+        t = _best_of(lambda: inv.find(q, limit), repeat=20)
+        print(f"  {q!r:<14}: {t * 1e3:7.3f} ms  ({len(inv.find(q, limit))} shown)")
+    # A resync that finds a few windows renamed
+    for w in list(sim.windows.values())[:10]:
+        w.title += " *"
+    def rebuild(records):
+        store = ghost.WindowStore()
+        for rec in records: store.upsert(rec)
+    t_new = t_diff = float("inf")
+    for _ in range(5):
+        records = inv.collect()
+        t0 = time.perf_counter()
+        rebuild(records)
+        t_new = min(t_new, time.perf_counter() - t0)
+        records = inv.collect()
+        inv.begin_collect()
+        t0 = time.perf_counter()
+        inv.install(records)
+        t_diff = min(t_diff, time.perf_counter() - t0)
+    print(f"  resync, new store : {t_new * 1e3:7.2f} ms")
+    print(f"  resync, diffed in : {t_diff * 1e3:7.2f} ms")
+    inv.stop()
+
+SCENARIOS = {
+    "drag": bench_drag,
+    "enum": bench_enum,
+    "hung": bench_hung,
+    "ctrl": bench_ctrl,
+    "fade": bench_fade,
+    "rules": bench_rules,
+    "journal": bench_journal,
+    "cli": bench_cli,
+    "instance": bench_instance,
+    "control": bench_control,
+    "state": bench_state,
+    "evict": bench_evict,
+    "reconcile": bench_reconcile,
+    "search": bench_search,
+}
+
+def main(argv):
+    names = argv or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            print(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+            return 2
+        SCENARIOS[name]()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
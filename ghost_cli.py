@@ -0,0 +1,140 @@
+"""Command-line GhostWindow: script opacity and click-through without starting the GUI.
+
+    python ghost_cli.py --list
+    python ghost_cli.py --exe slack.exe --alpha 70 --passthrough
+    python ghost_cli.py --title "MINGW64$" --restore
+    python ghost_cli.py --restore-all
+    printf 'set_alpha 0x1001c 60\nset_passthrough 0x1001c on\n' | python ghost_cli.py --send
+
+Windows changed here stay changed after the command exits. They are recorded in the same journal as the
+GUI's, so the GUI (or --restore / --restore-all) can put them back later. If GhostWindow is already running,
+the arguments are handed to it instead. Only ghost_core is imported: no Tk, no window, no exit handlers.
+"""
+import argparse
+import sys
+
+import ghost_core as core
+
+def _parse_hwnd(text):
+    return int(text, 0)
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="ghost_cli", description="Make windows transparent / click-through from scripts.")
+    sel = p.add_argument_group("select windows (all given filters must match)")
+    sel.add_argument("--title", metavar="REGEX", help="title regex, searched anywhere")
+    sel.add_argument("--exe", metavar="NAME", help="process image name, e.g. slack.exe (case-insensitive)")
+    sel.add_argument("--class", dest="cls", metavar="CLASS", help="exact window class")
+    sel.add_argument("--hwnd", type=_parse_hwnd, action="append", metavar="HWND", help="window handle (repeatable)")
+    sel.add_argument("--first", action="store_true", help="only the topmost match in z-order")
+
+    act = p.add_argument_group("actions")
+    act.add_argument("--list", action="store_true", help="print the matching windows (all visible ones if no filter)")
+    act.add_argument("--alpha", type=int, metavar="PCT", help="opacity 0-100")
+    act.add_argument("--passthrough", action="store_true", default=None, help="lock click-through on")
+    act.add_argument("--no-passthrough", dest="passthrough", action="store_false", help="turn click-through off")
+    act.add_argument("--restore", action="store_true", help="put the matching windows back as they were")
+    act.add_argument("--restore-all", action="store_true", help="put back every window GhostWindow has changed")
+    act.add_argument("--send", action="store_true",
+                     help="send control commands from stdin, one per line, to the running GhostWindow as one batch "
+                          "(set_alpha HWND PCT, set_passthrough HWND on|off, restore HWND|all, list [modified])")
+    return p
+
+def select_windows(args):
+    """[WindowRecord] in z-order for the filters in args."""
+    if args.hwnd:
+        return [core.WindowRecord(h, core.titles.get(h), core.backend.get_class_name(h), core.backend.get_window_pid(h))
+                for h in args.hwnd]
+    exe = args.exe.lower() if args.exe else None
+    exe_of = {}
+
+    def where(rec):
+        if not rec.title or rec.title in core.JUNK_TITLES: return False
+        if exe is None: return True
+        if rec.pid not in exe_of: exe_of[rec.pid] = core.backend.get_process_exe(rec.pid).lower()
+        return exe_of[rec.pid] == exe
+
+    return list(core.iter_windows(args.title, args.cls, where=where, limit=1 if args.first else None))
+
+def check(args):
+    """Usage error message for parsed args, or None."""
+    if args.alpha is not None and not 0 <= args.alpha <= 100:
+        return "--alpha must be between 0 and 100"
+    changes = args.alpha is not None or args.passthrough is not None or args.restore
+    if args.send:
+        return None if not (changes or args.list or args.restore_all) else "--send takes its commands from stdin only"
+    if not (changes or args.list or args.restore_all):
+        return build_parser().format_usage().strip()
+    if changes and not (args.title or args.exe or args.cls or args.hwnd):
+        return "select windows with --title / --exe / --class / --hwnd first"
+    return None
+
+def run(args, out, err):
+    """Carry out checked args in this process; out/err take one line each. Returns the exit code.
+    The caller owns the journal (open before, close after)."""
+    if args.send:
+        err("--send talks to a running GhostWindow; run it with ghost_cli")
+        return 2
+    changes = args.alpha is not None or args.passthrough is not None or args.restore
+    if args.list:
+        for rec in select_windows(args):
+            exe = core.backend.get_process_exe(rec.pid)
+            out(f"{rec.hwnd:#010x}  {exe:<24} {rec.cls:<28} {rec.title}")
+        if not changes and not args.restore_all: return 0
+
+    if args.restore_all:
+        n = len(core.modified_windows)
+        core.restore_all()
+        out(f"restored {n} window(s)")
+        if not changes: return 0
+
+    targets = select_windows(args)
+    if not targets:
+        err("no matching window")
+        return 1
+    failed = 0
+    with core.batched_topmost(): # every target raised in one DeferWindowPos
+        for rec in targets:
+            if args.restore:
+                core.restore_window(rec.hwnd)
+                continue
+            ok = core.set_window_state(rec.hwnd, args.alpha, args.passthrough, mark_locked=True)
+            if not ok:
+                failed += 1
+                err(f"failed: {rec.hwnd:#x} {rec.title}")
+    verb = "restored" if args.restore else "updated"
+    out(f"{verb} {len(targets) - failed} of {len(targets)} window(s)")
+    return 1 if failed else 0
+
+def send(lines):
+    """--send: one batch to the running instance; replies go to stdout, failed commands make the exit code 1."""
+    lines = [line.strip() for line in lines if line.strip()]
+    replies = core.send_commands(lines)
+    if replies is None:
+        print("GhostWindow is not running", file=sys.stderr)
+        return 1
+    for reply in replies: print(reply)
+    return 1 if any(not reply.startswith("ok") for reply in replies) else 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+    problem = check(args)
+    if problem:
+        print(problem, file=sys.stderr)
+        return 2
+    if args.send: return send(sys.stdin)
+
+    # If GhostWindow is running it owns the windows: let it do the work instead of fighting over them
+    lock, reply = core.claim_instance(argv)
+    if lock is None: return core.forward_reply(reply)
+
+    # Take back whatever earlier runs (CLI or GUI) left modified, so restore has the original styles
+    core.open_journal(adopt=True, background=False)
+    try:
+        return run(args, print, lambda line: print(line, file=sys.stderr))
+    finally:
+        core.close_journal()
+        lock.release()
+
+if __name__ == "__main__":
+    sys.exit(main())
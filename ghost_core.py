@@ -0,0 +1,3109 @@
+"""GhostWindow core: window backends, state, journal, inventory, rules and input plumbing - no GUI.
+
+Importing this module has no side effects: no DLL is bound, no backend is chosen and no handler is
+installed until something asks for it. The GUI (py.py) and the CLI (ghost_cli.py) are both built on it.
+"""
+import bisect
+import ctypes
+import ctypes.wintypes as wt
+import signal
+import struct
+import atexit
+import heapq
+import json
+import operator
+import sys
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack, contextmanager
+from itertools import groupby
+from typing import Dict
+
+# -------------------------------------------------------------------------
+# BACKEND: WIN32 API & LOGIC
+# -------------------------------------------------------------------------
+
+class _LazyDll:
+    """Binds the DLL on first use instead of at import; each function is looked up once, then cached."""
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        fn = getattr(getattr(ctypes.windll, self._name), attr)
+        setattr(self, attr, fn)
+        return fn
+
+# Raw DLL handles: only the Win32 backend and the input threads touch these directly
+user32 = _LazyDll("user32") if hasattr(ctypes, "windll") else None
+kernel32 = _LazyDll("kernel32") if hasattr(ctypes, "windll") else None
+
+# Constants
+GWL_EXSTYLE = -20
+WS_EX_LAYERED = 0x00080000
+WS_EX_TRANSPARENT = 0x00000020
+WS_EX_TOPMOST = 0x00000008
+WS_EX_WINDOWEDGE = 0x00000100
+LWA_ALPHA = 0x00000002
+
+EVENT_OBJECT_CREATE = 0x8000
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+EVENT_OBJECT_REORDER = 0x8004
+EVENT_OBJECT_STATECHANGE = 0x800A
+EVENT_OBJECT_NAMECHANGE = 0x800C
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+CHILDID_SELF = 0
+GA_ROOT = 2
+WM_GETTEXT = 0x000D
+SMTO_ABORTIFHUNG = 0x0002
+SMTO_ERRORONEXIT = 0x0020
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+SWP_NOSIZE = 0x0001
+SWP_NOMOVE = 0x0002
+SWP_NOACTIVATE = 0x0010
+HWND_TOPMOST = -1
+HWND_NOTOPMOST = -2
+
+# Safe wintypes
+HWND = getattr(wt, "HWND", ctypes.c_void_p)
+DWORD = getattr(wt, "DWORD", ctypes.c_ulong)
+BOOL = getattr(wt, "BOOL", ctypes.c_int)
+WPARAM = getattr(wt, "WPARAM", ctypes.c_size_t)
+LPARAM = getattr(wt, "LPARAM", ctypes.c_ssize_t)
+LRESULT = LPARAM
+
+# -------------------------------------------------------------------------
+# WINDOW BACKENDS
+# -------------------------------------------------------------------------
+
+class WindowBackend:
+    """Every user32 call the app makes. Handles/styles are plain ints and failures come back as 0/False, as in Win32."""
+    def get_window_long(self, hwnd, index): raise NotImplementedError
+    def set_window_long(self, hwnd, index, value): raise NotImplementedError
+    def set_layered_attributes(self, hwnd, alpha_byte): raise NotImplementedError
+    def set_window_pos(self, hwnd, insert_after, flags): raise NotImplementedError
+    def defer_window_pos(self, moves): raise NotImplementedError # [(hwnd, insert_after, flags)] as one transaction
+    def enum_windows(self): raise NotImplementedError # top-level hwnds, z-order
+    def is_window_visible(self, hwnd): raise NotImplementedError
+    def is_top_level(self, hwnd): raise NotImplementedError
+    def get_window_text_length(self, hwnd): raise NotImplementedError
+    def get_window_text(self, hwnd, length): raise NotImplementedError
+    def internal_get_window_text(self, hwnd): raise NotImplementedError # cached title, never sends a message
+    def send_get_text(self, hwnd, timeout_ms): raise NotImplementedError # WM_GETTEXT with a timeout -> (ok, text)
+    def visible_titles(self, hwnds):
+        """[(hwnd, cached title)] for the visible, titled windows among hwnds, in order."""
+        out = []
+        for hwnd in hwnds:
+            if self.is_window_visible(hwnd):
+                title = self.internal_get_window_text(hwnd)
+                if title: out.append((hwnd, title))
+        return out
+    def get_class_name(self, hwnd): raise NotImplementedError
+    def get_window_pid(self, hwnd): raise NotImplementedError
+    def get_window_rect(self, hwnd): raise NotImplementedError # (left, top, right, bottom)
+    def get_process_exe(self, pid): raise NotImplementedError # image file name, "" if unknown
+    def get_async_key_state(self, vk): raise NotImplementedError
+    def hook_win_events(self, event_min, event_max, callback): raise NotImplementedError # -> handle with stop(), or None
+
+# Bound once: a new WINFUNCTYPE per enumeration costs a prototype class, a closure and a thunk every time
+WNDENUMPROC = ctypes.WINFUNCTYPE(BOOL, HWND, LPARAM) if hasattr(ctypes, "WINFUNCTYPE") else None
+
+class Win32Backend(WindowBackend):
+    """The real thing: thin ctypes wrappers over user32."""
+    def __init__(self):
+        self.u32 = u = ctypes.windll.user32
+        # Prototypes once, so hot calls take plain ints instead of allocating c_void_p wrappers
+        for fn, args in ((u.GetWindowLongW, [HWND, ctypes.c_int]),
+                         (u.SetWindowLongW, [HWND, ctypes.c_int, ctypes.c_long]),
+                         (u.SetLayeredWindowAttributes, [HWND, DWORD, ctypes.c_ubyte, DWORD]),
+                         (u.SetWindowPos, [HWND, HWND, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint]),
+                         (u.IsWindowVisible, [HWND]),
+                         (u.GetWindowTextLengthW, [HWND]),
+                         (u.GetWindowTextW, [HWND, ctypes.c_wchar_p, ctypes.c_int]),
+                         (u.InternalGetWindowText, [HWND, ctypes.c_wchar_p, ctypes.c_int]),
+                         (u.SendMessageTimeoutW, [HWND, ctypes.c_uint, WPARAM, LPARAM, ctypes.c_uint, ctypes.c_uint,
+                                                  ctypes.POINTER(ctypes.c_size_t)]),
+                         (u.GetAncestor, [HWND, ctypes.c_uint]),
+                         (u.GetClassNameW, [HWND, ctypes.c_wchar_p, ctypes.c_int]),
+                         (u.GetWindowThreadProcessId, [HWND, ctypes.POINTER(DWORD)]),
+                         (u.GetWindowRect, [HWND, ctypes.POINTER(wt.RECT)]),
+                         (u.EnumWindows, [WNDENUMPROC, LPARAM])):
+            fn.argtypes = args
+        u.GetAncestor.restype = HWND
+        u.SendMessageTimeoutW.restype = LRESULT
+        k = ctypes.windll.kernel32
+        k.OpenProcess.restype = ctypes.c_void_p
+        k.OpenProcess.argtypes = [DWORD, BOOL, DWORD]
+        k.QueryFullProcessImageNameW.argtypes = [ctypes.c_void_p, DWORD, ctypes.c_wchar_p, ctypes.POINTER(DWORD)]
+        k.CloseHandle.argtypes = [ctypes.c_void_p]
+        self.k32 = k
+
+        # Enumeration scratch space is per thread (UI, inventory events and workers can all enumerate)
+        self._tls = threading.local()
+        self._enum_proc = WNDENUMPROC(self._collect)
+
+    def _scratch(self):
+        tls = self._tls
+        if not hasattr(tls, "hwnds"):
+            tls.hwnds = []
+            tls.title_buf = ctypes.create_unicode_buffer(256)
+        return tls
+
+    def _collect(self, hwnd, lParam):
+        self._tls.hwnds.append(hwnd)
+        return 1
+
+    def get_window_long(self, hwnd, index):
+        return self.u32.GetWindowLongW(hwnd, index)
+
+    def set_window_long(self, hwnd, index, value):
+        return self.u32.SetWindowLongW(hwnd, index, value)
+
+    def set_layered_attributes(self, hwnd, alpha_byte):
+        return self.u32.SetLayeredWindowAttributes(hwnd, 0, alpha_byte, LWA_ALPHA)
+
+    def set_window_pos(self, hwnd, insert_after, flags):
+        return self.u32.SetWindowPos(hwnd, insert_after, 0, 0, 0, 0, flags)
+
+    def defer_window_pos(self, moves):
+        u = self.u32
+        u.BeginDeferWindowPos.restype = ctypes.c_void_p
+        u.DeferWindowPos.restype = ctypes.c_void_p
+        u.DeferWindowPos.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+                                     ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint]
+        u.EndDeferWindowPos.argtypes = [ctypes.c_void_p]
+        hdwp = u.BeginDeferWindowPos(len(moves))
+        for hwnd, insert_after, flags in moves:
+            if not hdwp: return 0 # DeferWindowPos already freed the structure
+            hdwp = u.DeferWindowPos(hdwp, hwnd, insert_after, 0, 0, 0, 0, flags)
+        return u.EndDeferWindowPos(hdwp) if hdwp else 0
+
+    def enum_windows(self):
+        tls = self._scratch()
+        tls.hwnds.clear()
+        self.u32.EnumWindows(self._enum_proc, 0)
+        return tls.hwnds[:]
+
+    def is_window_visible(self, hwnd):
+        return self.u32.IsWindowVisible(hwnd)
+
+    def is_top_level(self, hwnd):
+        return (self.u32.GetAncestor(hwnd, GA_ROOT) or 0) == hwnd
+
+    def get_window_text_length(self, hwnd):
+        return self.u32.GetWindowTextLengthW(hwnd)
+
+    def _title_buf(self, chars):
+        tls = self._scratch()
+        buf = tls.title_buf
+        if chars > len(buf):
+            # Grow in powers of two so a few long titles don't cause repeated reallocation
+            size = len(buf)
+            while size < chars: size *= 2
+            buf = tls.title_buf = ctypes.create_unicode_buffer(size)
+        return buf
+
+    def get_window_text(self, hwnd, length):
+        buf = self._title_buf(length + 1)
+        n = self.u32.GetWindowTextW(hwnd, buf, length + 1)
+        return buf[:n] # decode exactly what was copied, never the whole buffer
+
+    def internal_get_window_text(self, hwnd):
+        buf = self._title_buf(0)
+        n = self.u32.InternalGetWindowText(hwnd, buf, len(buf))
+        if n >= len(buf) - 1: # possibly truncated: once more with room to spare
+            buf = self._title_buf(len(buf) * 4)
+            n = self.u32.InternalGetWindowText(hwnd, buf, len(buf))
+        return buf[:n]
+
+    def visible_titles(self, hwnds):
+        # The enumeration's inner loop: two calls per window and no Python frame in between
+        u = self.u32
+        is_visible, get_text = u.IsWindowVisible, u.InternalGetWindowText
+        buf = self._title_buf(0)
+        size = len(buf)
+        out = []
+        append = out.append
+        for hwnd in hwnds:
+            if not is_visible(hwnd): continue
+            n = get_text(hwnd, buf, size)
+            if n >= size - 1:
+                append((hwnd, self.internal_get_window_text(hwnd))) # long title: let the pool grow
+                buf = self._title_buf(0)
+                size = len(buf)
+            elif n:
+                append((hwnd, buf[:n]))
+        return out
+
+    def send_get_text(self, hwnd, timeout_ms):
+        buf = self._title_buf(0)
+        copied = ctypes.c_size_t(0)
+        ok = self.u32.SendMessageTimeoutW(hwnd, WM_GETTEXT, len(buf), ctypes.addressof(buf),
+                                          SMTO_ABORTIFHUNG | SMTO_ERRORONEXIT, timeout_ms, ctypes.byref(copied))
+        if not ok: return False, ""
+        return True, buf[:min(copied.value, len(buf) - 1)]
+
+    def get_class_name(self, hwnd):
+        buf = self._scratch().title_buf # class names are at most 256 chars, the pool never shrinks below that
+        n = self.u32.GetClassNameW(hwnd, buf, 256)
+        return buf[:n]
+
+    def get_window_pid(self, hwnd):
+        pid = DWORD(0)
+        self.u32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        return pid.value
+
+    def get_window_rect(self, hwnd):
+        r = wt.RECT()
+        if not self.u32.GetWindowRect(hwnd, ctypes.byref(r)): return (0, 0, 0, 0)
+        return (r.left, r.top, r.right, r.bottom)
+
+    def get_process_exe(self, pid):
+        handle = self.k32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle: return "" # elevated / protected process
+        try:
+            buf = ctypes.create_unicode_buffer(1024)
+            size = DWORD(len(buf))
+            if not self.k32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)): return ""
+            return os.path.basename(buf.value)
+        finally:
+            self.k32.CloseHandle(handle)
+
+    def get_async_key_state(self, vk):
+        return self.u32.GetAsyncKeyState(vk)
+
+    def hook_win_events(self, event_min, event_max, callback):
+        watcher = WinEventThread(event_min, event_max, callback)
+        return watcher if watcher.start_and_wait() else None
+
+class SimWindow:
+    __slots__ = ("hwnd", "title", "cls", "pid", "exe", "visible", "rect", "ex_style", "alpha", "topmost", "hung", "denied")
+
+    def __init__(self, hwnd, title, cls, pid, exe, visible=True, rect=(0, 0, 800, 600)):
+        self.hwnd = hwnd
+        self.title = title
+        self.cls = cls
+        self.pid = pid
+        self.exe = exe
+        self.visible = visible
+        self.rect = rect
+        self.ex_style = WS_EX_WINDOWEDGE # what most real top-level windows start with
+        self.alpha = 255
+        self.topmost = False
+        self.hung = False # message-based calls block for hang_s
+        self.denied = False # writes fail as if blocked by UIPI
+
+_SIM_APPS = [("chrome.exe", "Chrome_WidgetWin_1", "Google Chrome"), ("Code.exe", "Chrome_WidgetWin_1", "Visual Studio Code"),
+             ("explorer.exe", "CabinetWClass", "File Explorer"), ("notepad.exe", "Notepad", "Notepad"),
+             ("slack.exe", "Chrome_WidgetWin_1", "Slack"), ("WINWORD.EXE", "OpusApp", "Word"),
+             ("mintty.exe", "mintty", "MINGW64"), ("vlc.exe", "Qt5QWindowIcon", "VLC media player")]
+
+class SimulatedDesktop(WindowBackend):
+    """In-memory desktop for headless profiling and load tests. Every call costs latency_s; hung windows block
+    text/style/z-order calls for hang_s, access-denied windows refuse style/alpha/z-order writes."""
+    def __init__(self, count=200, latency_s=0.0, hung=0, denied=0, hang_s=0.5, seed=0):
+        self.latency_s = latency_s
+        self.hang_s = hang_s
+        self.windows: Dict[int, SimWindow] = {} # insertion order doubles as z-order
+        self.keys_down = set()
+        self.event_hooks = []
+        self.pids: Dict[str, int] = {} # exe -> pid, one process per exe like most desktop apps
+        self._next_hwnd = 0x10010
+        self._rng = random.Random(seed)
+
+        for i in range(count):
+            exe, cls, app = self._rng.choice(_SIM_APPS)
+            # A realistic share of invisible and untitled top-level windows
+            roll = self._rng.random()
+            # ... and of windows sharing a title ("New Tab - Google Chrome")
+            title = "" if roll < 0.2 else (f"New Tab - {app}" if roll > 0.9 else f"Document {i} - {app}")
+            self.add_window(title, cls=cls, exe=exe, visible=roll > 0.3 or roll < 0.1)
+
+        candidates = [h for h, w in self.windows.items() if w.visible and w.title]
+        for h in self._rng.sample(candidates, min(hung, len(candidates))):
+            self.windows[h].hung = True
+        for h in self._rng.sample(candidates, min(denied, len(candidates))):
+            self.windows[h].denied = True
+
+    # --- desktop manipulation (the "other apps") ---
+    def add_window(self, title, cls="SimWindowClass", exe="sim.exe", pid=None, visible=True, hwnd=None):
+        """hwnd= reuses a closed window's handle, as Windows does once its slot comes round again."""
+        if hwnd is None or hwnd in self.windows:
+            hwnd = self._next_hwnd
+            self._next_hwnd += 4
+        if pid is None:
+            pid = self.pids.setdefault(exe, 1000 + 4 * len(self.pids))
+        x, y = (hwnd // 4) % 40 * 20, (hwnd // 4) % 30 * 20
+        self.windows[hwnd] = SimWindow(hwnd, title, cls, pid, exe, visible, (x, y, x + 800, y + 600))
+        self.emit(EVENT_OBJECT_CREATE, hwnd)
+        if visible: self.emit(EVENT_OBJECT_SHOW, hwnd)
+        return hwnd
+
+    def close_window(self, hwnd):
+        if self.windows.pop(hwnd, None) is not None:
+            self.emit(EVENT_OBJECT_DESTROY, hwnd)
+
+    def show_window(self, hwnd, visible=True):
+        if hwnd in self.windows:
+            self.windows[hwnd].visible = visible
+            self.emit(EVENT_OBJECT_SHOW if visible else EVENT_OBJECT_HIDE, hwnd)
+
+    def set_title(self, hwnd, title):
+        if hwnd in self.windows:
+            self.windows[hwnd].title = title
+            self.emit(EVENT_OBJECT_NAMECHANGE, hwnd)
+
+    def external_set_style(self, hwnd, ex_style):
+        """Another process changing the window's extended style behind our back."""
+        if hwnd in self.windows:
+            self.windows[hwnd].ex_style = ex_style & ~WS_EX_TOPMOST
+            self.emit(EVENT_OBJECT_STATECHANGE, hwnd)
+
+    def emit(self, event, hwnd, id_object=0, id_child=0):
+        # Delivered synchronously on the caller's thread
+        for hook in list(self.event_hooks):
+            if hook.event_min <= event <= hook.event_max:
+                hook.callback(event, hwnd, id_object, id_child)
+
+    # --- cost model ---
+    def _call(self, hwnd=None, sends_message=False):
+        if self.latency_s: _spin(self.latency_s)
+        w = self.windows.get(hwnd)
+        if w is not None and sends_message and w.hung:
+            _spin(self.hang_s)
+        return w
+
+    # --- WindowBackend ---
+    def get_window_long(self, hwnd, index):
+        w = self._call(hwnd)
+        if w is None or index != GWL_EXSTYLE: return 0
+        return w.ex_style | (WS_EX_TOPMOST if w.topmost else 0) # mirrors the z-band, as in Win32
+
+    def set_window_long(self, hwnd, index, value):
+        w = self._call(hwnd, sends_message=True) # WM_STYLECHANGING/ED go to the owning thread
+        if w is None or w.denied or index != GWL_EXSTYLE: return 0
+        prev = w.ex_style | (WS_EX_TOPMOST if w.topmost else 0)
+        if prev & ~value & WS_EX_LAYERED: w.alpha = 255 # the layered attributes go with the style
+        w.ex_style = value & ~WS_EX_TOPMOST # can't be set through SetWindowLong
+        return prev
+
+    def set_layered_attributes(self, hwnd, alpha_byte):
+        w = self._call(hwnd)
+        if w is None or w.denied or not (w.ex_style & WS_EX_LAYERED): return 0
+        w.alpha = alpha_byte & 0xFF
+        return 1
+
+    def set_window_pos(self, hwnd, insert_after, flags):
+        w = self._call(hwnd, sends_message=True)
+        if w is None or w.denied: return 0
+        if insert_after == HWND_TOPMOST: w.topmost = True
+        elif insert_after == HWND_NOTOPMOST: w.topmost = False
+        return 1
+
+    def defer_window_pos(self, moves):
+        # One z-order recalculation for the batch; any denied window fails the whole transaction, as in Win32
+        self._call()
+        targets = [(self.windows.get(h), after) for h, after, _flags in moves]
+        if any(w is None or w.denied for w, _ in targets): return 0
+        for w, after in targets:
+            if w.hung: _spin(self.hang_s)
+            if after == HWND_TOPMOST: w.topmost = True
+            elif after == HWND_NOTOPMOST: w.topmost = False
+        return 1
+
+    def enum_windows(self):
+        self._call()
+        return list(self.windows)
+
+    def is_window_visible(self, hwnd):
+        w = self._call(hwnd)
+        return 1 if w is not None and w.visible else 0
+
+    def is_top_level(self, hwnd):
+        return self._call(hwnd) is not None
+
+    def get_window_text_length(self, hwnd):
+        w = self._call(hwnd, sends_message=True)
+        return len(w.title) if w is not None else 0
+
+    def get_window_text(self, hwnd, length):
+        w = self._call(hwnd, sends_message=True)
+        return w.title[:length] if w is not None else ""
+
+    def internal_get_window_text(self, hwnd):
+        w = self._call(hwnd) # served from the window manager's copy: hung or not, no wait
+        return w.title if w is not None else ""
+
+    def send_get_text(self, hwnd, timeout_ms):
+        if self.latency_s: _spin(self.latency_s)
+        w = self.windows.get(hwnd)
+        if w is None: return False, ""
+        if w.hung:
+            _spin(min(self.hang_s, timeout_ms / 1000.0))
+            if self.hang_s * 1000.0 >= timeout_ms: return False, ""
+        return True, w.title
+
+    def get_class_name(self, hwnd):
+        w = self._call(hwnd)
+        return w.cls if w is not None else ""
+
+    def get_window_pid(self, hwnd):
+        w = self._call(hwnd)
+        return w.pid if w is not None else 0
+
+    def get_window_rect(self, hwnd):
+        w = self._call(hwnd)
+        return w.rect if w is not None else (0, 0, 0, 0)
+
+    def get_process_exe(self, pid):
+        self._call()
+        for exe, p in self.pids.items():
+            if p == pid: return exe
+        return ""
+
+    def get_async_key_state(self, vk):
+        self._call()
+        return 0x8000 if vk in self.keys_down else 0
+
+    def hook_win_events(self, event_min, event_max, callback):
+        self._call()
+        hook = _SimEventHook(self, event_min, event_max, callback)
+        self.event_hooks.append(hook)
+        return hook
+
+class _SimEventHook:
+    def __init__(self, desktop, event_min, event_max, callback):
+        self.desktop = desktop
+        self.event_min = event_min
+        self.event_max = event_max
+        self.callback = callback
+
+    def stop(self):
+        if self in self.desktop.event_hooks:
+            self.desktop.event_hooks.remove(self)
+
+def _spin(seconds):
+    # time.sleep() can't do sub-millisecond waits reliably; spin for those
+    if seconds >= 0.002:
+        time.sleep(seconds)
+        return
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def _default_backend():
+    if os.environ.get("GHOST_BACKEND", "").lower() == "sim" or not hasattr(ctypes, "windll"):
+        return SimulatedDesktop()
+    return Win32Backend()
+
+class _DefaultBackend:
+    """Stands in for the backend until its first use, so importing the module binds nothing."""
+    def __getattr__(self, name):
+        return getattr(resolve_backend(), name)
+
+backend: WindowBackend = _DefaultBackend()
+
+def resolve_backend():
+    """The real backend, choosing the default now if nobody has set one."""
+    if isinstance(backend, _DefaultBackend): set_backend(_default_backend())
+    return backend
+
+def set_backend(new_backend):
+    """Swap the backend (e.g. a SimulatedDesktop for benchmarks). Call before any window is modified."""
+    global backend
+    backend = InstrumentedBackend(new_backend) if isinstance(backend, InstrumentedBackend) else new_backend
+    return backend
+
+# -------------------------------------------------------------------------
+# INSTRUMENTATION
+# -------------------------------------------------------------------------
+
+# backend method -> the user32 entry point it costs
+API_NAMES = {
+    "get_window_long": "GetWindowLongW",
+    "set_window_long": "SetWindowLongW",
+    "set_layered_attributes": "SetLayeredWindowAttributes",
+    "set_window_pos": "SetWindowPos",
+    "defer_window_pos": "EndDeferWindowPos",
+    "enum_windows": "EnumWindows",
+    "is_window_visible": "IsWindowVisible",
+    "is_top_level": "GetAncestor",
+    "get_window_text_length": "GetWindowTextLengthW",
+    "get_window_text": "GetWindowTextW",
+    "internal_get_window_text": "InternalGetWindowText",
+    "send_get_text": "SendMessageTimeoutW",
+    "get_class_name": "GetClassNameW",
+    "get_window_pid": "GetWindowThreadProcessId",
+    "get_window_rect": "GetWindowRect",
+    "get_process_exe": "QueryFullProcessImageNameW",
+    "get_async_key_state": "GetAsyncKeyState",
+    "hook_win_events": "SetWinEventHook",
+}
+# Calls whose first argument is not an hwnd
+_NO_HWND = {"enum_windows", "get_async_key_state", "get_process_exe", "hook_win_events", "defer_window_pos"}
+# Calls where 0 unambiguously means failure (SetWindowLong returns the previous style, which may be 0)
+_FAILS_ON_ZERO = {"set_layered_attributes", "set_window_pos", "defer_window_pos"}
+
+class CallStat:
+    __slots__ = ("count", "total", "max", "failures")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.failures = 0
+
+    def as_dict(self):
+        return {"count": self.count, "total_s": self.total, "max_s": self.max, "failures": self.failures}
+
+class InstrumentedBackend(WindowBackend):
+    """Wraps a backend and records count / cumulative time / max time / failures per API and per hwnd.
+    Only installed by enable_instrumentation(), so the plain path pays nothing."""
+    def __init__(self, inner):
+        self.inner = inner
+        self.by_api: Dict[str, CallStat] = {}
+        self.by_hwnd: Dict[int, Dict[str, CallStat]] = {}
+        self._lock = threading.Lock()
+        for method, api in API_NAMES.items():
+            if hasattr(inner, method):
+                setattr(self, method, self._wrap(method, api, getattr(inner, method)))
+
+    def __getattr__(self, name):
+        # Non-API helpers (SimulatedDesktop.add_window, ...) pass straight through
+        return getattr(self.inner, name)
+
+    def _wrap(self, method, api, fn):
+        takes_hwnd = method not in _NO_HWND
+        fails_on_zero = method in _FAILS_ON_ZERO
+        clock = time.perf_counter
+
+        def call(*args):
+            t0 = clock()
+            failed = True
+            try:
+                result = fn(*args)
+                failed = fails_on_zero and not result
+                return result
+            finally:
+                self._record(api, args[0] if takes_hwnd and args else None, clock() - t0, failed)
+        return call
+
+    def _record(self, api, hwnd, dt, failed):
+        with self._lock:
+            stats = [self.by_api.get(api) or self.by_api.setdefault(api, CallStat())]
+            if hwnd is not None:
+                per = self.by_hwnd.setdefault(hwnd, {})
+                stats.append(per.get(api) or per.setdefault(api, CallStat()))
+            for st in stats:
+                st.count += 1
+                st.total += dt
+                if dt > st.max: st.max = dt
+                if failed: st.failures += 1
+
+    def reset(self):
+        with self._lock:
+            self.by_api.clear()
+            self.by_hwnd.clear()
+
+def enable_instrumentation():
+    global backend
+    if not isinstance(backend, InstrumentedBackend):
+        backend = InstrumentedBackend(resolve_backend())
+    return backend
+
+def disable_instrumentation():
+    global backend
+    if isinstance(backend, InstrumentedBackend):
+        backend = backend.inner
+
+def api_stats():
+    """{"apis": {name: stat}, "hwnds": {hwnd: {name: stat}}} - empty if instrumentation is off."""
+    if not isinstance(backend, InstrumentedBackend):
+        return {"apis": {}, "hwnds": {}}
+    with backend._lock:
+        return {
+            "apis": {api: st.as_dict() for api, st in backend.by_api.items()},
+            "hwnds": {h: {api: st.as_dict() for api, st in per.items()} for h, per in backend.by_hwnd.items()},
+        }
+
+def reset_api_stats():
+    if isinstance(backend, InstrumentedBackend):
+        backend.reset()
+
+@contextmanager
+def count_calls():
+    """with count_calls() as calls: ... -> calls is {api: n} for the calls made inside the block."""
+    enable_instrumentation()
+    before = {api: st["count"] for api, st in api_stats()["apis"].items()}
+    calls = {}
+    try:
+        yield calls
+    finally:
+        for api, st in api_stats()["apis"].items():
+            n = st["count"] - before.get(api, 0)
+            if n: calls[api] = n
+
+def format_api_stats(top_hwnds=10):
+    stats = api_stats()
+    lines = [f"{'API':<28}{'calls':>9}{'fail':>7}{'total ms':>11}{'max ms':>9}"]
+    for api, st in sorted(stats["apis"].items(), key=lambda kv: -kv[1]["total_s"]):
+        lines.append(f"{api:<28}{st['count']:>9}{st['failures']:>7}{st['total_s'] * 1000:>11.2f}{st['max_s'] * 1000:>9.2f}")
+    busiest = sorted(stats["hwnds"].items(), key=lambda kv: -sum(st["count"] for st in kv[1].values()))
+    for h, per in busiest[:top_hwnds]:
+        calls = ", ".join(f"{api}={st['count']}" for api, st in sorted(per.items()))
+        lines.append(f"  hwnd {h:#x}: {calls}")
+    return "\n".join(lines)
+
+def dump_api_stats():
+    """GHOST_TRACE=1 dumps to stderr on exit, any other value is taken as a file path."""
+    target = os.environ.get("GHOST_TRACE")
+    if not target or not isinstance(backend, InstrumentedBackend): return
+    report = format_api_stats()
+    try:
+        if target == "1":
+            sys.stderr.write(report + "\n")
+        else:
+            with open(target, "a", encoding="utf-8") as f:
+                f.write(report + "\n")
+    except Exception:
+        pass
+
+
+# State Storage
+# Per-window flags; the same bits go into the journal, so they must not be renumbered
+STATE_PASSTHROUGH = 1 # WS_EX_TRANSPARENT is (meant to be) on
+STATE_LOCKED = 2 # click-through locked on by the user; CTRL doesn't touch it
+STATE_TOPMOST = 4 # we put it in the topmost band
+STATE_ALPHA_KNOWN = 8 # alpha is what the window really has (we set it, and nothing has disturbed it since)
+
+class WindowState:
+    """What we know about one window we've changed. ex is the last known GWL_EXSTYLE (None = unknown, re-read
+    on next use); flags is STATE_* bits, so "all unlocked windows" is one mask test per entry. pid is the owner
+    when we first touched it (0 = unknown): a handle that now belongs to another process is a different window."""
+    __slots__ = ("orig_ex", "ex", "alpha", "flags", "pid")
+
+    def __init__(self, orig_ex, ex=None, alpha=255, flags=0, pid=0):
+        self.orig_ex = orig_ex
+        self.ex = ex
+        self.alpha = alpha
+        self.flags = flags
+        self.pid = pid
+
+    def set_flag(self, mask, on):
+        self.flags = self.flags | mask if on else self.flags & ~mask
+
+    @property
+    def passthrough(self):
+        return bool(self.flags & STATE_PASSTHROUGH)
+
+    @property
+    def passthrough_locked(self):
+        return bool(self.flags & STATE_LOCKED)
+
+    @property
+    def is_topmost(self):
+        return bool(self.flags & STATE_TOPMOST)
+
+# hwnd (int) -> WindowState
+modified_windows: Dict[int, WindowState] = {}
+# Held by whatever adds, changes or drops entries (here and in desired): the Tk thread, control connections,
+# WinEvent callbacks and the sweep all do. Only for bookkeeping and calls that can't block (style reads, pids):
+# a write to another process's window waits on that window's thread, so it goes out with the lock released.
+state_lock = threading.RLock()
+# hwnd -> lock serializing our writes to that window; taken before state_lock, never while holding it
+_window_locks: Dict[int, threading.RLock] = {}
+
+def window_lock(hwnd_int):
+    """The lock for writing to one window. A hung window holds up writes to itself, and nothing else."""
+    with state_lock:
+        lock = _window_locks.get(hwnd_int)
+        if lock is None: lock = _window_locks[hwnd_int] = threading.RLock()
+        return lock
+
+def tracked_windows(require=0, exclude=0):
+    """hwnds in modified_windows whose flags have every require bit and no exclude bit."""
+    want = require | exclude
+    for _attempt in range(3):
+        try:
+            # Straight over the live dict: copying it first costs more than the test itself
+            return [h for h, st in modified_windows.items() if st.flags & want == require]
+        except RuntimeError:
+            pass # another thread added or dropped a window mid-scan
+    return [h for h, st in list(modified_windows.items()) if st.flags & want == require]
+
+def safe_GetWindowLongPtr(hwnd_int, index=GWL_EXSTYLE):
+    try:
+        return backend.get_window_long(hwnd_int, index)
+    except:
+        return 0
+
+def safe_SetWindowLongPtr(hwnd_int, index, new_value):
+    try:
+        return backend.set_window_long(hwnd_int, index, new_value)
+    except:
+        return 0
+
+def track_window(hwnd_int):
+    """Entry for hwnd in modified_windows, created (with its original style) on first touch."""
+    info = modified_windows.get(hwnd_int)
+    if info is None:
+        orig = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
+        try:
+            pid = backend.get_window_pid(hwnd_int)
+        except Exception:
+            pid = 0
+        info = modified_windows[hwnd_int] = WindowState(orig, orig, pid=pid)
+        if journal is not None: journal.adopt(hwnd_int, orig, pid)
+    elif journal is not None:
+        journal.touch(hwnd_int) # callers are about to change it
+    return info
+
+# --- Extended style cache ---
+def cached_ex_style(hwnd_int):
+    info = modified_windows.get(hwnd_int)
+    if info is None:
+        return safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
+    if info.ex is None:
+        info.ex = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
+    return info.ex
+
+def write_ex_style(hwnd_int, new_ex):
+    """SetWindowLong only if the cached style differs. Keeps the cache in step with our own writes.
+    Call with the window's lock: the write itself goes out without state_lock."""
+    with state_lock:
+        info = track_window(hwnd_int)
+        if info.ex == new_ex: return
+    prev = safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, new_ex)
+    with state_lock:
+        # 0 is both "failed" and a legal previous style; don't trust the cache in that case
+        if modified_windows.get(hwnd_int) is info: info.ex = new_ex if prev else None
+
+def invalidate_style(hwnd_int=None):
+    targets = [hwnd_int] if hwnd_int is not None else list(modified_windows)
+    for h in targets:
+        info = modified_windows.get(h)
+        if info:
+            info.ex = None
+            info.flags &= ~STATE_ALPHA_KNOWN # whatever changed the style may have reset the opacity too
+
+def revalidate_styles(hwnds=None):
+    """Re-read the real style of tracked windows now; returns the hwnds whose cache was stale."""
+    stale = []
+    for h in (hwnds if hwnds is not None else list(modified_windows)):
+        info = modified_windows.get(h)
+        if not info: continue
+        actual = safe_GetWindowLongPtr(h, GWL_EXSTYLE)
+        if info.ex is not None and (info.ex ^ actual) & ~WS_EX_TOPMOST:
+            stale.append(h)
+        info.ex = actual
+    return stale
+
+# --- Dead and reused handles ---
+# Called with the hwnd after an entry is dropped because its window is gone (on whichever thread noticed)
+eviction_listeners = []
+DEAD_SWEEP_MS = 60_000 # backstop for destroys the WinEvent hook missed (or no hook at all)
+
+def _alive(hwnd_int, entry):
+    # A dead hwnd (pid 0) or one reused by another process is not ours to touch
+    try:
+        pid = backend.get_window_pid(hwnd_int)
+    except Exception:
+        return False
+    return bool(pid) and (not entry.pid or pid == entry.pid)
+
+def evict_window(hwnd_int, state=None):
+    """Forget a window that no longer exists. Nothing is restored: the handle may already name someone else's window.
+    state= only evicts if that is still the entry (it was judged dead without the lock held)."""
+    with state_lock:
+        info = modified_windows.get(hwnd_int)
+        if info is None or (state is not None and info is not state): return False
+        del modified_windows[hwnd_int]
+        desired.pop(hwnd_int, None)
+        _window_locks.pop(hwnd_int, None) # a reused handle is a new window
+        zorder.forget(hwnd_int)
+        if journal is not None: journal.forget(hwnd_int)
+    # Outside the lock: listeners hand off to other threads and must not wait on anyone who wants it
+    for fn in list(eviction_listeners):
+        try:
+            fn(hwnd_int)
+        except Exception:
+            pass
+    return True
+
+def sweep_dead_windows():
+    """Evict every tracked window that was destroyed or whose handle now belongs to another process.
+    One GetWindowThreadProcessId per window: it returns 0 for a dead handle, so it doubles as IsWindow.
+    The checks run unlocked; each eviction re-checks under the lock that the entry is still the one judged."""
+    dead = [(h, st) for h, st in list(modified_windows.items()) if not _alive(h, st)]
+    return [h for h, st in dead if evict_window(h, st)]
+
+# --- Z-order ---
+Z_FLAGS = SWP_NOMOVE | SWP_NOSIZE | SWP_NOACTIVATE
+
+class ZOrderManager:
+    """Only re-asserts HWND_TOPMOST when our tracked state says it's missing or a reorder event put it in doubt,
+    and groups multi-window changes into one DeferWindowPos transaction."""
+    def __init__(self):
+        self.suspect = set() # hwnds a reorder event may have knocked out of the topmost band
+
+    def on_reorder(self, hwnd):
+        # Top-level reorders are reported against the container, so anything we track could be affected
+        with state_lock:
+            self.suspect.update([hwnd] if hwnd in modified_windows else modified_windows)
+
+    def needs_topmost(self, hwnd_int):
+        # Under state_lock (the style read doesn't send a message, so it can't hang)
+        info = modified_windows.get(hwnd_int)
+        if info is None or not info.flags & STATE_TOPMOST: return True
+        if hwnd_int not in self.suspect: return False
+        # One style read is far cheaper than a SetWindowPos (z-order recalculation + DWM repaint)
+        self.suspect.discard(hwnd_int)
+        if safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE) & WS_EX_TOPMOST: return False
+        info.flags &= ~STATE_TOPMOST
+        return True
+
+    def ensure_topmost(self, hwnd_int):
+        with state_lock:
+            if not self.needs_topmost(hwnd_int): return True
+        try:
+            ok = bool(backend.set_window_pos(hwnd_int, HWND_TOPMOST, Z_FLAGS))
+        except:
+            ok = False
+        with state_lock:
+            info = modified_windows.get(hwnd_int)
+            if ok and info is not None:
+                info.flags |= STATE_TOPMOST
+                if journal is not None: journal.touch(hwnd_int)
+        return ok
+
+    def apply(self, moves):
+        """moves: [(hwnd, topmost_bool)] -> one DeferWindowPos transaction, one-by-one if that's refused.
+        The calls go out without state_lock; only windows still tracked afterwards are marked."""
+        with state_lock:
+            moves = [(h, top) for h, top in moves if h in modified_windows]
+        if not moves: return
+        batch = [(h, HWND_TOPMOST if top else HWND_NOTOPMOST, Z_FLAGS) for h, top in moves]
+        try:
+            ok = len(batch) > 1 and backend.defer_window_pos(batch)
+        except:
+            ok = False
+        for h, top in moves:
+            if not ok:
+                try:
+                    if not backend.set_window_pos(h, HWND_TOPMOST if top else HWND_NOTOPMOST, Z_FLAGS): continue
+                except:
+                    continue
+            with state_lock:
+                info = modified_windows.get(h)
+                if info is None: continue # restored or evicted while the call was out
+                info.set_flag(STATE_TOPMOST, top)
+                self.suspect.discard(h)
+                if journal is not None: journal.touch(h)
+
+    def forget(self, hwnd_int):
+        self.suspect.discard(hwnd_int)
+
+zorder = ZOrderManager()
+
+def set_topmost_many(hwnds, topmost=True):
+    """Topmost on (or off) for many windows in one DeferWindowPos; windows already there are left out."""
+    hwnds = list(dict.fromkeys(hwnds))
+    with state_lock:
+        if topmost:
+            moves = [(h, True) for h in hwnds if zorder.needs_topmost(h)]
+        else:
+            moves = [(h, False) for h in hwnds if h in modified_windows and modified_windows[h].flags & STATE_TOPMOST]
+    zorder.apply(moves)
+
+_topmost_batch = threading.local()
+
+@contextmanager
+def batched_topmost():
+    """Inside the block, reconcile() queues HWND_TOPMOST instead of one SetWindowPos per window; the queue goes
+    out through set_topmost_many() on exit. Per thread, and nested blocks join the outermost one."""
+    if getattr(_topmost_batch, "hwnds", None) is not None:
+        yield
+        return
+    _topmost_batch.hwnds = []
+    try:
+        yield
+    finally:
+        hwnds, _topmost_batch.hwnds = _topmost_batch.hwnds, None
+        if hwnds: set_topmost_many(hwnds)
+
+def _on_window_event(event, hwnd, id_object, id_child):
+    # Runs on the WinEvent thread
+    if event == EVENT_OBJECT_REORDER:
+        zorder.on_reorder(hwnd)
+    # Only whole-window events for windows we track matter for the style cache
+    elif id_object == OBJID_WINDOW and id_child == CHILDID_SELF and hwnd in modified_windows:
+        if event == EVENT_OBJECT_DESTROY:
+            evict_window(hwnd)
+        elif event == EVENT_OBJECT_STATECHANGE: # never focus/selection: those say nothing about the style
+            invalidate_style(hwnd)
+
+class _HookGroup:
+    def __init__(self, hooks):
+        self.hooks = hooks
+
+    def stop(self):
+        for hook in self.hooks: hook.stop()
+
+def watch_window_events():
+    """Keep the style cache and z-order tracking honest when other processes touch our windows, and drop
+    windows as they are destroyed. Returns a handle with stop(), or None."""
+    hooks = []
+    # One hook per event: any range between them would also deliver every focus and selection change on the desktop
+    for event in (EVENT_OBJECT_DESTROY, EVENT_OBJECT_REORDER, EVENT_OBJECT_STATECHANGE):
+        try:
+            hook = backend.hook_win_events(event, event, _on_window_event)
+        except Exception:
+            hook = None
+        if hook is not None: hooks.append(hook)
+    return _HookGroup(hooks) if hooks else None
+
+def alpha_byte(alpha_0_100):
+    """The byte SetLayeredWindowAttributes actually gets for an opacity percentage."""
+    return int(max(0, min(100, int(alpha_0_100))) * 255 / 100)
+
+# --- Desired state ---
+class DesiredState:
+    """What the user asked for one window. flags are STATE_PASSTHROUGH / STATE_LOCKED / STATE_TOPMOST, and only
+    the bits in mask are asked for: a window we only made translucent keeps whatever click-through it had.
+    alpha is a byte, None = opacity never set (its layering is left alone)."""
+    __slots__ = ("alpha", "flags", "mask")
+
+    def __init__(self):
+        self.alpha = None
+        self.flags = 0
+        self.mask = 0
+
+    def want(self, bit, on):
+        self.mask |= bit
+        self.flags = self.flags | bit if on else self.flags & ~bit
+
+# hwnd (int) -> DesiredState; modified_windows is what we last saw, this is what we're steering it to
+desired: Dict[int, DesiredState] = {}
+
+def desire(hwnd_int, alpha=None, passthrough=None, locked=None, topmost=None):
+    """Record intent for hwnd (None = unchanged). Nothing touches the window until reconcile()."""
+    d = desired.get(hwnd_int)
+    if d is None: d = desired[hwnd_int] = DesiredState()
+    if alpha is not None: d.alpha = alpha
+    if passthrough is not None: d.want(STATE_PASSTHROUGH, passthrough)
+    if locked is not None: d.want(STATE_LOCKED, locked)
+    if topmost is not None: d.want(STATE_TOPMOST, topmost)
+    return d
+
+def reconcile(hwnd_int):
+    """Bring hwnd to its desired state with only the calls that change something: one SetWindowLong for
+    all style bits together, SetLayeredWindowAttributes only for a new alpha (or a freshly layered window),
+    SetWindowPos only when it isn't known to be topmost. Returns False if a needed write failed."""
+    with window_lock(hwnd_int):
+        return _reconcile(hwnd_int)
+
+def _reconcile(hwnd_int):
+    # With the window's lock: plan under state_lock, write without it, then record what landed
+    with state_lock:
+        d = desired.get(hwnd_int)
+        if d is None: return True
+        info = track_window(hwnd_int)
+        cur = cached_ex_style(hwnd_int)
+        want = cur | WS_EX_LAYERED if d.alpha is not None else cur
+        if d.mask & STATE_PASSTHROUGH:
+            want = want | WS_EX_TRANSPARENT if d.flags & STATE_PASSTHROUGH else want & ~WS_EX_TRANSPARENT
+        # A window that just became layered starts fully opaque, whatever we last set
+        alpha = d.alpha if d.alpha is not None and (d.alpha != info.alpha or not info.flags & STATE_ALPHA_KNOWN
+                                                    or want & ~cur & WS_EX_LAYERED) else None
+        # Passthrough and locked are kept as asked (the CTRL fan-out and restore read them from here)
+        info.flags = info.flags & ~(d.mask & (STATE_PASSTHROUGH | STATE_LOCKED)) | (d.flags & d.mask & (STATE_PASSTHROUGH | STATE_LOCKED))
+        topmost = bool(d.flags & STATE_TOPMOST)
+
+    ok = True
+    if want != cur:
+        prev = safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, want)
+        ok = bool(prev) # 0: the write may have failed
+        with state_lock:
+            if modified_windows.get(hwnd_int) is info:
+                info.ex = want if prev else None
+                if want & ~cur & WS_EX_LAYERED: info.flags &= ~STATE_ALPHA_KNOWN
+
+    if alpha is not None:
+        try:
+            wrote = backend.set_layered_attributes(hwnd_int, alpha)
+        except Exception:
+            wrote = False
+        if wrote:
+            with state_lock:
+                if modified_windows.get(hwnd_int) is info:
+                    info.alpha = alpha
+                    info.flags |= STATE_ALPHA_KNOWN
+        else:
+            ok = False
+
+    # Keep it Topmost (no-op unless it's known or suspected to have dropped out)
+    if topmost:
+        batch = getattr(_topmost_batch, "hwnds", None)
+        if batch is not None: batch.append(hwnd_int)
+        else: zorder.ensure_topmost(hwnd_int)
+    return ok
+
+def set_window_alpha(hwnd_int, alpha_0_100):
+    if not hwnd_int: return False
+    with window_lock(hwnd_int):
+        with state_lock:
+            desire(hwnd_int, alpha=alpha_byte(alpha_0_100), topmost=True)
+        return _reconcile(hwnd_int)
+
+def set_passthrough_for_hwnd(hwnd_int, enable=True, mark_locked=False):
+    return set_window_state(hwnd_int, passthrough=enable, mark_locked=mark_locked)
+
+def set_window_state(hwnd_int, alpha_0_100=None, passthrough=None, mark_locked=False):
+    """Opacity and/or click-through in one reconcile, so both style bits go out in a single SetWindowLong."""
+    if not hwnd_int: return False
+    # Turning click-through on may lock it; turning it off always unlocks
+    locked = None if passthrough is None else (False if not passthrough else (True if mark_locked else None))
+    with window_lock(hwnd_int):
+        with state_lock:
+            if alpha_0_100 is None:
+                desire(hwnd_int, passthrough=passthrough, locked=locked)
+            else:
+                desire(hwnd_int, alpha=alpha_byte(alpha_0_100), passthrough=passthrough, locked=locked, topmost=True)
+        return _reconcile(hwnd_int)
+
+def _restore_style(hwnd_int, info):
+    try:
+        # Dropping WS_EX_LAYERED drops the opacity with it; only a window that was layered to begin with
+        # keeps the attribute, so only that one needs it set back
+        if info.orig_ex & WS_EX_LAYERED: backend.set_layered_attributes(hwnd_int, 255)
+        if info.ex != info.orig_ex: safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, info.orig_ex)
+    except:
+        pass
+
+def _drops_topmost(info):
+    # Only undo topmost we added; a window that started out topmost stays that way
+    return info.flags & STATE_TOPMOST and not (info.orig_ex & WS_EX_TOPMOST)
+
+def restore_window(hwnd_int):
+    with window_lock(hwnd_int):
+        _restore_window(hwnd_int)
+
+def _forget_restored(hwnd_int, info):
+    # Under state_lock, once the writes are out; skipped if the entry was replaced or evicted meanwhile
+    if modified_windows.get(hwnd_int) is not info: return
+    zorder.forget(hwnd_int)
+    del modified_windows[hwnd_int]
+    desired.pop(hwnd_int, None)
+    if journal is not None: journal.forget(hwnd_int)
+
+def _restore_window(hwnd_int):
+    with state_lock:
+        info = modified_windows.get(hwnd_int)
+    if info is None: return
+    if not _alive(hwnd_int, info):
+        evict_window(hwnd_int, info) # closed, or the handle went to a new window: its orig_ex isn't that one's
+        return
+    _restore_style(hwnd_int, info)
+    if _drops_topmost(info):
+        try:
+            backend.set_window_pos(hwnd_int, HWND_NOTOPMOST, Z_FLAGS)
+        except:
+            pass
+    with state_lock:
+        _forget_restored(hwnd_int, info)
+
+def restore_all():
+    sweep_dead_windows() # never write a stale orig_ex onto a window that merely inherited the handle
+    with state_lock:
+        infos = list(modified_windows.items())
+    # Each window's lock is held until its entry is gone, so a fan-out write can't land in between
+    with ExitStack() as held:
+        for h, info in infos:
+            held.enter_context(window_lock(h))
+            _restore_style(h, info)
+        # All z-order changes in one transaction
+        zorder.apply([(h, False) for h, info in infos if _drops_topmost(info)])
+        with state_lock:
+            for h, info in infos:
+                _forget_restored(h, info)
+            if journal is not None and not modified_windows: journal.reset() # nothing left to recover
+
+# Cleanup Hooks
+def signal_handler(signum, frame):
+    restore_all()
+    sys.exit(0)
+
+def install_exit_hooks(restore=True):
+    """For the process that owns the windows (the GUI): GHOST_TRACE stats on exit, and with restore=True,
+    put every window back on exit, SIGINT and SIGTERM. Never done at import."""
+    if os.environ.get("GHOST_TRACE"):
+        enable_instrumentation()
+    # Registered before restore_all so it runs after it (atexit is LIFO) and includes the restore calls
+    atexit.register(dump_api_stats)
+    if restore:
+        atexit.register(restore_all)
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+# -------------------------------------------------------------------------
+# JOURNAL
+# -------------------------------------------------------------------------
+
+APP_DIR = os.path.join(os.environ.get("APPDATA") or os.path.expanduser("~"), "GhostWindow")
+JOURNAL_PATH = os.path.join(APP_DIR, "journal.bin")
+
+JOURNAL_MAGIC = b"GWJ1"
+# kind, alpha, flags, pad, pid, hwnd, orig_ex - fixed size, so a torn tail is just a short last record
+_JREC = struct.Struct("<BBBxIQq")
+J_ADOPT, J_STATE, J_FORGET = 1, 2, 3
+JF_PASSTHROUGH, JF_LOCKED, JF_TOPMOST = STATE_PASSTHROUGH, STATE_LOCKED, STATE_TOPMOST # state flags, stored as is
+
+class JournalEntry:
+    __slots__ = ("pid", "orig_ex", "alpha", "flags")
+
+    def __init__(self, pid, orig_ex, alpha=255, flags=0):
+        self.pid = pid
+        self.orig_ex = orig_ex
+        self.alpha = alpha
+        self.flags = flags
+
+def replay_journal(data):
+    """bytes -> {hwnd: JournalEntry} of the windows still modified when the journal ends."""
+    if not data.startswith(JOURNAL_MAGIC): return {}
+    body = memoryview(data)[len(JOURNAL_MAGIC):]
+    body = body[:len(body) - len(body) % _JREC.size] # drop a torn last record
+    live: Dict[int, JournalEntry] = {}
+    for kind, alpha, flags, pid, hwnd, orig_ex in _JREC.iter_unpack(body):
+        if kind == J_STATE:
+            e = live.get(hwnd)
+            if e is not None:
+                e.alpha = alpha
+                e.flags = flags
+        elif kind == J_ADOPT:
+            live[hwnd] = JournalEntry(pid, orig_ex)
+        elif kind == J_FORGET:
+            live.pop(hwnd, None)
+    return live
+
+class Journal:
+    """Append-only record of modified_windows, so a crash or kill -9 can still be undone on the next start.
+
+    adopt()/forget() append a record; touch() only marks a window dirty, and its current alpha and flags are
+    written once per batch, however many slider ticks happened since. A flusher thread writes and fsyncs each
+    batch flush_ms after the first change, so the UI thread never waits on the disk. Without start(), flush()
+    is up to the caller. The file is compacted to one ADOPT + STATE per live window when it outgrows max_bytes."""
+    def __init__(self, path=JOURNAL_PATH, flush_ms=100, max_bytes=1 << 20):
+        self.path = path
+        self.flush_ms = flush_ms
+        self.max_bytes = max_bytes
+        self.pending = bytearray()
+        self.dirty = set()
+        self.lock = threading.Lock() # pending / dirty
+        self.io_lock = threading.Lock() # the file
+        self.wake = threading.Event()
+        self.thread = None
+        self.running = False
+        self.f = None
+        self.flushes = 0
+
+    def read(self):
+        """What the previous run left behind: {hwnd: JournalEntry}."""
+        try:
+            with open(self.path, "rb") as f:
+                return replay_journal(f.read())
+        except OSError:
+            return {}
+
+    def open(self):
+        """Start a fresh journal from the current modified_windows and append from there."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.io_lock:
+            self._compact()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="ghost-journal", daemon=True)
+        self.thread.start()
+
+    def adopt(self, hwnd_int, orig_ex, pid=None):
+        if pid is None:
+            try:
+                pid = backend.get_window_pid(hwnd_int)
+            except Exception:
+                pid = 0
+        with self.lock:
+            self.pending += _JREC.pack(J_ADOPT, 0, 0, pid, hwnd_int, orig_ex)
+            self.dirty.add(hwnd_int)
+        self.wake.set()
+
+    def touch(self, hwnd_int):
+        if hwnd_int in self.dirty: return # already in this batch
+        with self.lock:
+            self.dirty.add(hwnd_int)
+        self.wake.set()
+
+    def forget(self, hwnd_int):
+        with self.lock:
+            self.dirty.discard(hwnd_int)
+            self.pending += _JREC.pack(J_FORGET, 0, 0, 0, hwnd_int, 0)
+        self.wake.set()
+
+    def _take(self):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            out, self.pending = self.pending, bytearray()
+        for h in dirty:
+            info = modified_windows.get(h)
+            if info is not None:
+                out += _JREC.pack(J_STATE, info.alpha, info.flags, 0, h, 0)
+        return out
+
+    def flush(self):
+        """Write and fsync everything recorded so far."""
+        with self.io_lock:
+            if self.f is None: return
+            out = self._take()
+            if not out: return
+            try:
+                self.f.write(out)
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                self.flushes += 1
+                if self.f.tell() > self.max_bytes: self._compact()
+            except (OSError, ValueError):
+                pass # the journal is a safety net; never take the app down with it
+
+    def _compact(self):
+        self._rewrite({h: JournalEntry(info.pid, info.orig_ex, info.alpha, info.flags)
+                       for h, info in list(modified_windows.items())})
+
+    def reset(self):
+        with self.io_lock:
+            with self.lock:
+                self.pending = bytearray()
+                self.dirty = set()
+            self._rewrite({})
+
+    def _rewrite(self, entries):
+        """Replace the file with a snapshot of entries, atomically. Caller holds io_lock."""
+        out = bytearray(JOURNAL_MAGIC)
+        for h, e in entries.items():
+            pid = e.pid
+            if not pid:
+                try:
+                    pid = backend.get_window_pid(h)
+                except Exception:
+                    pid = 0
+            out += _JREC.pack(J_ADOPT, 0, 0, pid, h, e.orig_ex)
+            out += _JREC.pack(J_STATE, e.alpha, e.flags, 0, h, 0)
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(out)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.f is not None: self.f.close()
+            os.replace(tmp, self.path)
+            self.f = open(self.path, "ab")
+        except OSError:
+            pass
+
+    def _run(self):
+        while self.running:
+            self.wake.wait()
+            if not self.running: break
+            time.sleep(self.flush_ms / 1000.0) # let the batch fill: a slider drag becomes one STATE per window
+            self.wake.clear()
+            self.flush()
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        if self.thread is not None: self.thread.join(timeout=1.0)
+        self.flush()
+        with self.io_lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+journal = None # the open Journal, if any; state changes are recorded through it
+
+def recover_windows(left, adopt=True):
+    """Deal with what a crashed run left modified: adopt=True takes the windows back into modified_windows
+    as they are, adopt=False puts them back to their original style. Returns the hwnds handled."""
+    handled = []
+    with state_lock:
+        for h, e in left.items():
+            if h in modified_windows or not _alive(h, e): continue
+            if adopt: modified_windows[h] = WindowState(e.orig_ex, None, e.alpha, e.flags, e.pid)
+            handled.append(h)
+    if not adopt:
+        # The writes go out unlocked: a window hung since the crash mustn't hold up everyone else
+        for h in handled:
+            e = left[h]
+            info = WindowState(e.orig_ex, None, e.alpha, e.flags, e.pid)
+            _restore_style(h, info)
+            if _drops_topmost(info):
+                try:
+                    backend.set_window_pos(h, HWND_NOTOPMOST, Z_FLAGS)
+                except Exception:
+                    pass
+    return handled
+
+def open_journal(path=JOURNAL_PATH, adopt=True, background=True):
+    """Open the journal, recover whatever the last run left behind, and record from here on.
+    Returns the recovered hwnds."""
+    global journal
+    j = Journal(path)
+    handled = recover_windows(j.read(), adopt)
+    j.open() # the new journal starts as a snapshot of exactly what we hold now
+    journal = j
+    if background: j.start()
+    return handled
+
+def close_journal():
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
+
+# -------------------------------------------------------------------------
+# UTILS
+# -------------------------------------------------------------------------
+
+# Filter out common junk
+JUNK_TITLES = {"Program Manager", "Settings", "Microsoft Text Input Application"}
+
+class TitleFetcher:
+    """Window titles that can't hang the caller.
+
+    The default path is InternalGetWindowText: the window manager's copy of the title, no message sent, so a
+    hung app answers as fast as a healthy one. Only when a fresh value is needed (fresh=True) do we ask the
+    window itself, via SendMessageTimeoutW(WM_GETTEXT) with a bounded timeout. An empty cached title stays
+    empty: GetWindowText gives other processes' windows nothing more, and untitled windows aren't listed. Windows that time out are remembered and go straight to the cached title until
+    retry_s has passed, so N hung windows cost at most N timeouts per retry_s, not per enumeration."""
+    def __init__(self, timeout_ms=100, retry_s=30.0):
+        self.timeout_ms = timeout_ms
+        self.retry_s = retry_s
+        self.timed_out: Dict[int, float] = {} # hwnd -> monotonic time of the last timeout
+
+    def is_suspect(self, hwnd):
+        t = self.timed_out.get(hwnd)
+        if t is None: return False
+        if time.monotonic() - t < self.retry_s: return True
+        self.timed_out.pop(hwnd, None)
+        return False
+
+    def get(self, hwnd, fresh=False):
+        cached = backend.internal_get_window_text(hwnd)
+        if not fresh or self.is_suspect(hwnd):
+            return cached
+        ok, text = backend.send_get_text(hwnd, self.timeout_ms)
+        if not ok:
+            self.timed_out[hwnd] = time.monotonic()
+            return cached
+        self.timed_out.pop(hwnd, None)
+        return text
+
+    def forget(self, hwnd):
+        self.timed_out.pop(hwnd, None)
+
+titles = TitleFetcher()
+
+def visible_title(hwnd):
+    """Title of a window worth listing, or None (hidden, untitled or junk)."""
+    if not backend.is_window_visible(hwnd): return None
+    title = titles.get(hwnd)
+    return title if title and title not in JUNK_TITLES else None
+
+_ENUM_BATCH = 256 # windows between should_stop() checks: well under a millisecond
+
+def get_visible_windows(should_stop=None):
+    """Returns list of (hwnd, title) excluding system garbage.
+    should_stop() is checked between batches of windows; if it returns True the enumeration is abandoned (None)."""
+    hwnds = backend.enum_windows()
+    step = (len(hwnds) or 1) if should_stop is None else _ENUM_BATCH
+    wins = []
+    for i in range(0, len(hwnds), step):
+        if should_stop is not None and should_stop(): return None
+        wins += [(title.lower(), hwnd, title) for hwnd, title in backend.visible_titles(hwnds[i:i + step])
+                 if title not in JUNK_TITLES]
+    wins.sort()
+    return [(h, t) for _k, h, t in wins]
+
+WindowRecord = namedtuple("WindowRecord", "hwnd title cls pid")
+
+def iter_windows(title=None, cls=None, pid=None, where=None, visible_only=True, limit=None):
+    """Yields WindowRecords in z-order for windows matching every given filter.
+
+    One EnumWindows pass only snapshots the hwnds; the filters run lazily as the caller iterates, cheapest
+    first: pid and class are local lookups, the title comes from the hang-proof TitleFetcher, where(record)
+    runs last. The first match is yielded before later windows are looked at, and a caller that stops
+    early (or `limit` matches) never pays for the rest. title is a regex (str or compiled), searched anywhere."""
+    title_re = re.compile(title) if isinstance(title, str) else title
+    found = 0
+    for hwnd in backend.enum_windows():
+        if limit is not None and found >= limit: return
+        w_pid = backend.get_window_pid(hwnd) if pid is not None else None
+        if pid is not None and w_pid != pid: continue
+        w_cls = backend.get_class_name(hwnd) if cls is not None else None
+        if cls is not None and w_cls != cls: continue
+        if visible_only and not backend.is_window_visible(hwnd): continue
+
+        w_title = titles.get(hwnd)
+        if title_re is not None and not title_re.search(w_title): continue
+
+        record = WindowRecord(hwnd, w_title,
+                              w_cls if w_cls is not None else backend.get_class_name(hwnd),
+                              w_pid if w_pid is not None else backend.get_window_pid(hwnd))
+        if where is not None and not where(record): continue
+        found += 1
+        yield record
+
+def find_window(title=None, cls=None, pid=None, where=None, visible_only=True):
+    """First matching WindowRecord in z-order, or None."""
+    return next(iter_windows(title, cls, pid, where, visible_only, limit=1), None)
+
+# -------------------------------------------------------------------------
+# WINDOW INVENTORY
+# -------------------------------------------------------------------------
+
+def normalize_title(title):
+    return " ".join(title.casefold().split())
+
+class WindowInfo:
+    __slots__ = ("hwnd", "title", "cls", "pid", "exe", "visible", "rect", "display")
+
+    def __init__(self, hwnd, title, cls="", pid=0, exe="", visible=True, rect=(0, 0, 0, 0)):
+        self.hwnd = hwnd
+        self.title = title
+        self.cls = cls
+        self.pid = pid
+        self.exe = exe
+        self.visible = visible
+        self.rect = rect
+        self.display = title # unique name for the picker, assigned by WindowStore
+
+_NO_HWNDS = frozenset()
+
+_second = operator.itemgetter(1)
+
+def _smallest(k, items, key=None):
+    """sorted(items, key)[:k]; heapq only pays off when k is a small slice of the items."""
+    if k and k * 8 < len(items): return heapq.nsmallest(k, items, key=key)
+    return sorted(items, key=key)[:k] if k else sorted(items, key=key)
+
+class FuzzySearchIndex:
+    """Incremental index for type-to-filter over "title exe" text.
+
+    Trigrams answer substring queries, word prefixes answer 1-2 character queries, and n-grams of the
+    word initials answer acronyms ("vsc" -> Visual Studio Code). Multi-word queries AND their terms.
+    Candidate sets are intersected first, so only the survivors are scored, and a limited query whose best
+    tier alone fills the limit (texts starting with the query) is answered from that tier without scoring.
+    add/remove touch only the grams of one window, so the index follows the inventory without rebuilds."""
+    def __init__(self):
+        self.text: Dict[int, str] = {} # hwnd -> normalized searchable text
+        self.initials: Dict[int, str] = {}
+        self.grams = defaultdict(set) # trigram -> hwnds
+        self.prefixes = defaultdict(set) # 1-2 char word prefix -> hwnds
+        self.acronyms = defaultdict(set) # 1-3 char n-gram of the initials -> hwnds
+        self.starts = defaultdict(set) # 1-2 char prefix of the whole text -> hwnds
+        self.order: Dict[int, tuple] = {} # hwnd -> tie-break key (shorter text first)
+        self.ranked = [] # sorted order keys: walking it yields windows in tie-break order
+        self.by_text = [] # sorted (text, hwnd): the texts starting with a prefix are one bisect away
+
+    def __len__(self):
+        return len(self.text)
+
+    @staticmethod
+    def _keys(text, initials):
+        grams = {text[i:i + 3] for i in range(len(text) - 2)}
+        prefixes = {w[:n] for w in text.split() for n in (1, 2)}
+        acronyms = {initials[i:i + n] for n in (1, 2, 3) for i in range(len(initials) - n + 1)}
+        return grams, prefixes, acronyms, {text[:1], text[:2]}
+
+    def _indexes(self):
+        return self.grams, self.prefixes, self.acronyms, self.starts
+
+    def add(self, hwnd, title, exe=""):
+        text = normalize_title(f"{title} {exe}")
+        if self.text.get(hwnd) == text: return
+        self.remove(hwnd)
+        initials = "".join(w[0] for w in text.split())
+        self.text[hwnd] = text
+        self.initials[hwnd] = initials
+        self.order[hwnd] = key = (len(text), hwnd)
+        bisect.insort(self.ranked, key)
+        bisect.insort(self.by_text, (text, hwnd))
+        for index, keys in zip(self._indexes(), self._keys(text, initials)):
+            for k in keys:
+                index[k].add(hwnd)
+
+    def remove(self, hwnd):
+        text = self.text.pop(hwnd, None)
+        if text is None: return
+        initials = self.initials.pop(hwnd)
+        key = self.order.pop(hwnd)
+        for sorted_keys, k in ((self.ranked, key), (self.by_text, (text, hwnd))):
+            i = bisect.bisect_left(sorted_keys, k)
+            if i < len(sorted_keys) and sorted_keys[i] == k: del sorted_keys[i]
+        for index, keys in zip(self._indexes(), self._keys(text, initials)):
+            for k in keys:
+                bucket = index.get(k)
+                if bucket is not None:
+                    bucket.discard(hwnd)
+                    if not bucket: del index[k]
+
+    def _candidates(self, term):
+        if len(term) < 3:
+            return self.prefixes.get(term, _NO_HWNDS) | self.acronyms.get(term, _NO_HWNDS)
+        found, acronym = self._candidate_sets(term)
+        return found | acronym if acronym else found
+
+    def _candidate_sets(self, term):
+        # (possible substring hits, acronym hits) for a term of 3+ characters
+        sets = sorted((self.grams.get(term[i:i + 3], _NO_HWNDS) for i in range(len(term) - 2)), key=len)
+        found = sets[0].intersection(*sets[1:]) # may include trigram false positives; scoring drops them
+        return found, self.acronyms.get(term, _NO_HWNDS) if len(term) == 3 else _NO_HWNDS
+
+    def query(self, q, limit=None):
+        """Ranked hwnds matching every word of q: title start < word prefix < substring < acronym."""
+        terms = normalize_title(q).split()
+        if not terms: return []
+        if len(terms) == 1 and len(terms[0]) < 3:
+            return self._short_query(terms[0], limit)
+        if len(terms) == 1: return self._rank_one(terms[0], limit)
+        cands = None
+        for term in terms:
+            found = self._candidates(term)
+            cands = found if cands is None else cands & found
+            if not cands: return []
+
+        text, initials = self.text, self.initials
+        scored = []
+        for h in cands:
+            tx = text[h]
+            total = 0
+            for term in terms:
+                pos = tx.find(term)
+                if pos == 0:
+                    total += 0
+                elif pos > 0:
+                    total += (1000 if tx[pos - 1] == " " else 2000) + pos
+                elif term in initials[h]:
+                    total += 3000
+                else:
+                    break
+            else:
+                scored.append((total, len(tx), h))
+        ranked = _smallest(limit, scored)
+        return [h for _s, _n, h in ranked]
+
+    def _rank_one(self, term, limit):
+        # Texts starting with the term all score 0, so if there are enough of them they are the answer
+        if limit:
+            firsts = self._starting_with(term, limit)
+            if firsts is not None: return firsts
+        # Otherwise only substring hits need scoring (by position); acronym-only hits all tie, so they are
+        # taken in tie-break order like a short query
+        found, acronym = self._candidate_sets(term)
+        text = self.text
+        scored, rest = [], []
+        for h in found:
+            tx = text[h]
+            pos = tx.find(term)
+            if pos < 0: rest.append(h)
+            elif pos == 0: scored.append((0, len(tx), h))
+            else: scored.append(((1000 if tx[pos - 1] == " " else 2000) + pos, len(tx), h))
+        ranked = [h for _s, _n, h in _smallest(limit, scored)]
+        if limit and len(ranked) >= limit: return ranked
+        initials = self.initials
+        acronym = acronym.difference(found).union(h for h in rest if term in initials[h])
+        if not acronym: return ranked
+        if not limit: return ranked + sorted(acronym, key=self.order.__getitem__)
+        return ranked + self._first(acronym, limit - len(ranked))
+
+    def _starting_with(self, term, limit):
+        """The first `limit` texts starting with term in tie-break order, or None if there are fewer."""
+        by_text = self.by_text
+        i = bisect.bisect_left(by_text, (term,))
+        end = bisect.bisect_left(by_text, (term + "\uffff",), i)
+        if end - i < limit: return None
+        return self._first(set(map(_second, by_text[i:end])), limit)
+
+    def _first(self, hwnds, k):
+        """The k hwnds of a set that come first in tie-break order."""
+        # A dense set is found by walking the global order (about k * n / len(hwnds) steps); a sparse one
+        # is cheaper to sort
+        if 2 * len(hwnds) * len(hwnds) > k * len(self.ranked):
+            out = []
+            for _n, h in self.ranked:
+                if h in hwnds:
+                    out.append(h)
+                    if len(out) == k: break
+            return out
+        return _smallest(k, hwnds, self.order.__getitem__)
+
+    def _short_query(self, term, limit):
+        # The first keystroke matches most of the desktop: rank by tier with set operations and stop once
+        # `limit` is filled, instead of scoring every candidate in Python
+        out, seen = [], set()
+        for tier in (self.starts.get(term, _NO_HWNDS), self.prefixes.get(term, _NO_HWNDS), self.acronyms.get(term, _NO_HWNDS)):
+            tier = tier - seen
+            if not tier: continue
+            if limit:
+                out.extend(self._first(tier, limit - len(out)))
+                if len(out) >= limit: break
+            else:
+                out.extend(sorted(tier, key=self.order.__getitem__))
+            seen |= tier
+        return out
+
+class WindowStore:
+    """Window metadata keyed by hwnd, with secondary indexes by pid, exe, class and normalized title.
+
+    Display names are unique and stable: the first window with a title gets it plain, later ones get
+    "title (2)", "(3)"... and keep that name until they close or are renamed."""
+    def __init__(self):
+        self.records: Dict[int, WindowInfo] = {}
+        self.by_pid = defaultdict(set)
+        self.by_exe = defaultdict(set) # lowercased exe name
+        self.by_class = defaultdict(set)
+        self.by_title = defaultdict(set) # normalize_title()
+        self.by_display: Dict[str, int] = {}
+        self.search = FuzzySearchIndex()
+        self._sorted = [] # (title.lower(), hwnd)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, hwnd):
+        return hwnd in self.records
+
+    def get(self, hwnd):
+        return self.records.get(hwnd)
+
+    def display_name(self, hwnd):
+        rec = self.records.get(hwnd)
+        return rec.display if rec else None
+
+    def hwnd_for_display(self, name):
+        return self.by_display.get(name)
+
+    def windows_of_pid(self, pid):
+        return [self.records[h] for h in self.by_pid.get(pid, ())]
+
+    def windows_of_exe(self, exe):
+        return [self.records[h] for h in self.by_exe.get(exe.lower(), ())]
+
+    def windows_of_class(self, cls):
+        return [self.records[h] for h in self.by_class.get(cls, ())]
+
+    def windows_titled(self, title):
+        return [self.records[h] for h in self.by_title.get(normalize_title(title), ())]
+
+    def sorted_records(self):
+        return [self.records[h] for _k, h in self._sorted]
+
+    def upsert(self, rec):
+        """Insert or replace the record for rec.hwnd. Returns True if anything visible to the picker changed."""
+        old = self.records.get(rec.hwnd)
+        if old is not None:
+            if (old.title, old.cls, old.pid, old.exe, old.visible, old.rect) == (rec.title, rec.cls, rec.pid, rec.exe, rec.visible, rec.rect):
+                return False
+            if old.title == rec.title:
+                rec.display = old.display # keep the name the user already sees
+                self._unindex(old, keep_display=True)
+                self._index(rec, assign_display=False)
+                return True
+            self._unindex(old)
+        self._index(rec)
+        return True
+
+    def remove(self, hwnd):
+        rec = self.records.get(hwnd)
+        if rec is None: return False
+        self._unindex(rec)
+        self.search.remove(hwnd)
+        return True
+
+    def find(self, query, limit=None):
+        """Ranked WindowInfos for a type-to-filter query."""
+        return [self.records[h] for h in self.search.query(query, limit)]
+
+    def clear(self):
+        self.__init__()
+
+    def _index(self, rec, assign_display=True):
+        h = rec.hwnd
+        self.records[h] = rec
+        self.by_pid[rec.pid].add(h)
+        self.by_exe[rec.exe.lower()].add(h)
+        self.by_class[rec.cls].add(h)
+        self.by_title[normalize_title(rec.title)].add(h)
+        if assign_display:
+            name, n = rec.title, 2
+            while name in self.by_display:
+                name = f"{rec.title} ({n})"
+                n += 1
+            rec.display = name
+        self.by_display[rec.display] = h
+        bisect.insort(self._sorted, (rec.title.lower(), h))
+        self.search.add(h, rec.title, rec.exe) # no-op unless the searchable text changed
+
+    def _unindex(self, rec, keep_display=False):
+        h = rec.hwnd
+        del self.records[h]
+        for index, key in ((self.by_pid, rec.pid), (self.by_exe, rec.exe.lower()),
+                           (self.by_class, rec.cls), (self.by_title, normalize_title(rec.title))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(h)
+                if not bucket: del index[key]
+        if not keep_display and self.by_display.get(rec.display) == h:
+            del self.by_display[rec.display]
+        i = bisect.bisect_left(self._sorted, (rec.title.lower(), h))
+        if i < len(self._sorted) and self._sorted[i][1] == h:
+            del self._sorted[i]
+
+def _same_window(prev, rec):
+    return prev is not None and prev.pid == rec.pid and prev.title == rec.title
+
+class WindowInventory:
+    """Live WindowStore of listable top-level windows. Seeded by one enumeration, then kept current from
+    CREATE/DESTROY/SHOW/HIDE/NAMECHANGE WinEvents, so each change costs O(log n) + one window's queries."""
+    def __init__(self, on_change=None, on_window=None):
+        self.on_change = on_change # called (from the event thread) after each change
+        self.on_window = on_window # called with the WindowInfo of each new or renamed window
+        self.store = WindowStore()
+        self.version = 0
+        self._exe_by_pid: Dict[int, str] = {}
+        self._overrides = None # hwnd -> WindowInfo | None, events seen while a collect() is in flight
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.cached = False # True while the store holds a previous session's list, not yet reconciled
+
+    def start(self, seed=True):
+        """Hook the WinEvents; seed=False leaves the first enumeration to the caller (e.g. a worker thread)."""
+        if seed: self.seed()
+        for lo, hi in ((EVENT_OBJECT_CREATE, EVENT_OBJECT_HIDE), (EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_NAMECHANGE)):
+            try:
+                hook = backend.hook_win_events(lo, hi, self._on_event)
+            except Exception:
+                hook = None
+            if hook: self._hooks.append(hook)
+        return bool(self._hooks)
+
+    def stop(self):
+        for hook in self._hooks:
+            hook.stop()
+        self._hooks = []
+
+    @property
+    def live(self):
+        return bool(self._hooks)
+
+    def _exe_of(self, pid):
+        exe = self._exe_by_pid.get(pid)
+        if exe is None:
+            try:
+                exe = backend.get_process_exe(pid)
+            except Exception:
+                exe = ""
+            self._exe_by_pid[pid] = exe
+        return exe
+
+    def _record(self, hwnd, title):
+        pid = backend.get_window_pid(hwnd)
+        return WindowInfo(hwnd, title, backend.get_class_name(hwnd), pid, self._exe_of(pid),
+                          True, backend.get_window_rect(hwnd))
+
+    def seed(self):
+        """Full enumeration; the only O(all windows) path. Also the resync if events may have been missed."""
+        self.begin_collect()
+        self.install(self.collect())
+
+    def begin_collect(self):
+        # From here on, events are remembered so install() can replay them over the (older) snapshot
+        with self._lock:
+            self._overrides = {}
+
+    def collect(self, should_stop=None):
+        """Every cross-process call of a resync; safe on any thread. None if should_stop() cut it short."""
+        wins = get_visible_windows(should_stop)
+        if wins is None: return None
+        records = []
+        for h, t in wins:
+            if should_stop is not None and should_stop(): return None
+            records.append(self._record(h, t))
+        return records
+
+    def install_cached(self, records):
+        """Show a previous session's list until the first install(). Its hwnds are unverified: check before use."""
+        if not records: return
+        with self._lock:
+            if self.store.records: return # live data already arrived
+            for rec in records: self.store._index(rec)
+            self.cached = True
+            self.version += 1
+
+    def install(self, records):
+        """Diff a collect() result into the store: only windows that came, went or changed are re-indexed.
+        Pure Python, no window calls - fine on the UI thread."""
+        if records is None: return
+        store = self.store
+        with self._lock:
+            # A cached list is provisional: nothing in it has been reported, so every live window is new
+            provisional, self.cached = self.cached, False
+            live = {rec.hwnd: rec for rec in records}
+            for h in [h for h in store.records if h not in live]:
+                store.remove(h)
+            prev = {h: store.get(h) for h in live}
+            for h, old in prev.items():
+                # A reused handle is another window: it doesn't inherit the old one's display name
+                if old is not None and old.pid != live[h].pid: store.remove(h)
+            # Windows keeping their title go first, so they keep their names; the rest queue up behind them
+            for rec in sorted(records, key=lambda r: not _same_window(prev[r.hwnd], r)):
+                store.upsert(rec)
+            # Events that raced the enumeration are newer than it
+            for h, rec in (self._overrides or {}).items():
+                if rec is None:
+                    self.store.remove(h)
+                else:
+                    self.store.upsert(rec)
+            self._overrides = None
+            # pids not seen any more may be reused by another exe
+            live_pids = set(self.store.by_pid)
+            self._exe_by_pid = {p: e for p, e in self._exe_by_pid.items() if p in live_pids}
+            self.version += 1
+            # New = unknown hwnd, or a known hwnd now naming another process's window (reused) or retitled
+            fresh = [rec for rec in self.store.records.values()
+                     if provisional or not _same_window(prev.get(rec.hwnd), rec)]
+        self._changed()
+        for rec in fresh: self._appeared(rec)
+
+    def is_live(self, hwnd):
+        """For records that may come from the cache: the window still exists and belongs to the same process."""
+        rec = self.store.get(hwnd)
+        if rec is None: return False
+        if not self.cached: return True
+        try:
+            return backend.get_window_pid(hwnd) == rec.pid != 0
+        except Exception:
+            return False
+
+    def snapshot(self):
+        """(version, [WindowInfo] sorted by title)."""
+        with self._lock:
+            return self.version, self.store.sorted_records()
+
+    def find(self, query, limit=None):
+        """WindowStore.find under the inventory lock: the event thread changes the store while the UI types."""
+        with self._lock:
+            return self.store.find(query, limit)
+
+    def _on_event(self, event, hwnd, id_object, id_child):
+        if id_object != OBJID_WINDOW or id_child != CHILDID_SELF or not hwnd: return
+        if event in (EVENT_OBJECT_DESTROY, EVENT_OBJECT_HIDE):
+            if event == EVENT_OBJECT_DESTROY: titles.forget(hwnd)
+            changed = self._remove(hwnd)
+        elif event in (EVENT_OBJECT_CREATE, EVENT_OBJECT_SHOW, EVENT_OBJECT_NAMECHANGE):
+            changed = self.update(hwnd)
+        else:
+            return
+        if changed: self._changed()
+
+    def update(self, hwnd):
+        """Re-read one window. Returns True if the inventory changed."""
+        # Child controls raise the same events; only top-level windows are listed
+        if not backend.is_top_level(hwnd):
+            return self._remove(hwnd)
+        title = visible_title(hwnd)
+        if title is None:
+            return self._remove(hwnd)
+        rec = self._record(hwnd, title)
+        with self._lock:
+            if self._overrides is not None: self._overrides[hwnd] = rec
+            prev = self.store.get(hwnd)
+            # While the list is still cached, the first install reports every window
+            fresh = not self.cached and not _same_window(prev, rec)
+            if not self.store.upsert(rec): return False
+            self.version += 1
+        if fresh: self._appeared(rec)
+        return True
+
+    def _remove(self, hwnd):
+        with self._lock:
+            if self._overrides is not None: self._overrides[hwnd] = None
+            if not self.store.remove(hwnd): return False
+            self.version += 1
+        return True
+
+    def _appeared(self, rec):
+        if self.on_window:
+            try:
+                self.on_window(rec)
+            except Exception:
+                pass
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception:
+                pass
+
+WINDOW_CACHE_PATH = os.path.join(APP_DIR, "windows.json")
+
+def save_window_cache(records, path=WINDOW_CACHE_PATH):
+    """Persist the window list so the next start can show it before its first enumeration finishes."""
+    rows = [[r.hwnd, r.title, r.cls, r.pid, r.exe] for r in records]
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def load_window_cache(path=WINDOW_CACHE_PATH):
+    """[WindowInfo] from save_window_cache(), [] if missing or unreadable."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [WindowInfo(h, t, c, p, e) for h, t, c, p, e in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        return []
+
+# -------------------------------------------------------------------------
+# AUTO-APPLY RULES
+# -------------------------------------------------------------------------
+
+RULES_PATH = os.path.join(APP_DIR, "rules.json")
+
+class Rule:
+    """exe / class are exact (exe case-insensitive), title is a case-insensitive regex; None = any.
+    alpha is 0-100 or None to leave opacity alone; passthrough locks click-through on."""
+    __slots__ = ("exe", "cls", "title", "alpha", "passthrough", "index", "title_re")
+
+    def __init__(self, exe=None, cls=None, title=None, alpha=None, passthrough=False):
+        self.exe = exe.lower() if exe else None
+        self.cls = cls or None
+        self.title = title or None
+        self.alpha = alpha
+        self.passthrough = passthrough
+        self.index = 0 # position in the RuleSet: earlier rules win
+        self.title_re = re.compile(title, re.IGNORECASE) if title else None
+
+    def key(self):
+        return (self.exe, self.cls, self.title)
+
+    def to_dict(self):
+        d = {"exe": self.exe, "class": self.cls, "title": self.title, "alpha": self.alpha, "passthrough": self.passthrough}
+        return {k: v for k, v in d.items() if v not in (None, False)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d.get("exe"), d.get("class"), d.get("title"), d.get("alpha"), bool(d.get("passthrough")))
+
+    def __str__(self):
+        when = " ".join(f"{k}={v}" for k, v in (("exe", self.exe), ("class", self.cls), ("title", self.title)) if v)
+        then = ([f"alpha {self.alpha}"] if self.alpha is not None else []) + (["click-through"] if self.passthrough else [])
+        return f"{when or '*'} -> {', '.join(then) or 'nothing'}"
+
+def parse_rule(text):
+    """ "exe=slack.exe class=Chrome_WidgetWin_1 -> alpha 70, click-through" -> Rule. ValueError if malformed."""
+    when, sep, then = text.replace("\u2192", "->").partition("->")
+    if not sep: raise ValueError(f"missing '->' in rule {text!r}")
+    fields = {}
+    for part in when.split():
+        name, eq, value = part.partition("=")
+        if not eq or name.lower() not in ("exe", "class", "title"): raise ValueError(f"bad condition {part!r}")
+        fields[name.lower()] = value
+    alpha, passthrough = None, False
+    for action in filter(None, (a.strip().lower() for a in then.split(","))):
+        if action in ("click-through", "clickthrough", "passthrough"):
+            passthrough = True
+        elif action.startswith("alpha"):
+            alpha = int(action[5:].strip().rstrip("%"))
+            if not 0 <= alpha <= 100: raise ValueError(f"alpha out of range in {action!r}")
+        else:
+            raise ValueError(f"unknown action {action!r}")
+    return Rule(fields.get("exe"), fields.get("class"), fields.get("title"), alpha, passthrough)
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+def _literal_prefix(pattern):
+    """Leading literal text every match of pattern must contain, or "" if there's no such guarantee."""
+    if "|" in pattern: return "" # a top-level alternative may not start with it
+    body = pattern[1:] if pattern.startswith("^") else pattern
+    n = 0
+    while n < len(body) and body[n] not in _REGEX_META: n += 1
+    if n < len(body) and body[n] in "*?{": n -= 1 # the last literal is optional
+    return body[:max(n, 0)]
+
+def _trie_pattern(words):
+    """Regex matching any of words, with shared prefixes factored out: ab|ac -> a(?:b|c)."""
+    root = {}
+    for w in words:
+        node = root
+        for c in w: node = node.setdefault(c, {})
+        node[""] = None
+
+    def build(node):
+        alts = [re.escape(c) + build(sub) for c, sub in sorted(node.items()) if c]
+        if not alts: return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # A word ends here: the rest is optional. Any one word is enough, so the shortest is all we need
+        return "" if "" in node else body
+
+    return build(root)
+
+class RuleSet:
+    """Ordered rules compiled into dispatch tables, so matching a window costs a few dict lookups.
+
+    Rules with an exe and/or class go into a hash keyed (exe, class), (exe, None) or (None, class); a window
+    probes those three keys and only runs the title regexes of the rules found there. Rules that constrain
+    nothing but the title are the remainder: one search for the literals their patterns must contain rejects
+    most windows, and only a hit walks their regexes in order. The first matching rule (file order) wins."""
+    def __init__(self, rules=(), path=None):
+        self.path = path
+        self.rules = list(rules)
+        self.applied = set() # hwnds a rule has already been applied to
+        self._compile()
+
+    def _compile(self):
+        exact = defaultdict(list)
+        loose = []
+        for i, rule in enumerate(self.rules):
+            rule.index = i
+            if rule.exe or rule.cls:
+                exact[(rule.exe, rule.cls)].append(rule)
+            elif rule.title_re is not None:
+                loose.append(rule)
+        # Prefilter on the literal each title-only pattern must contain, as a trie so the regex engine tries one
+        # branch per character instead of every pattern at every position
+        prefixes = [_literal_prefix(r.title) for r in loose]
+        loose_any = re.compile(_trie_pattern(p.lower() for p in prefixes), re.IGNORECASE) if loose and all(prefixes) else None
+        self._tables = (dict(exact), loose, loose_any) # swapped in one assignment: match() may run on another thread
+
+    def match(self, exe, cls, title):
+        exact, loose, loose_any = self._tables
+        exe = exe.lower() if exe else None
+        best = None
+        for key in ((exe, cls), (exe, None), (None, cls)):
+            for rule in exact.get(key, ()):
+                if best is not None and rule.index > best.index: break
+                if rule.title_re is None or rule.title_re.search(title):
+                    best = rule
+                    break
+        if loose and (best is None or loose[0].index < best.index) and (loose_any is None or loose_any.search(title)):
+            for rule in loose:
+                if best is not None and rule.index > best.index: break
+                if rule.title_re.search(title):
+                    best = rule
+                    break
+        return best
+
+    def add(self, rule):
+        """Append, replacing any rule with the same conditions."""
+        self.rules = [r for r in self.rules if r.key() != rule.key()] + [rule]
+        self._compile()
+
+    def remove(self, rule):
+        self.rules = [r for r in self.rules if r.key() != rule.key()]
+        self._compile()
+
+    def apply(self, hwnd_int, rule):
+        """Through the same paths as the UI, so modified_windows and restore see no difference."""
+        self.applied.add(hwnd_int)
+        return set_window_state(hwnd_int, rule.alpha, True if rule.passthrough else None, mark_locked=True)
+
+    @classmethod
+    def load(cls, path=RULES_PATH):
+        """Missing or unreadable file = no rules; a bad entry is skipped, not fatal."""
+        rules = []
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        for d in entries if isinstance(entries, list) else []:
+            try:
+                rules.append(Rule.from_dict(d))
+            except (AttributeError, TypeError, re.error):
+                pass
+        return cls(rules, path)
+
+    def save(self, path=None):
+        path = path or self.path or RULES_PATH
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([r.to_dict() for r in self.rules], f, indent=2)
+        os.replace(tmp, path) # never leave a half-written rules file behind
+
+# -------------------------------------------------------------------------
+# BACKGROUND REFRESH
+# -------------------------------------------------------------------------
+
+class BackgroundRefresher:
+    """Runs job(should_stop) on a worker thread and hands the result to on_result on the UI thread, through a
+    queue drained by schedule() (Tk's after) only while work is in flight.
+
+    Refreshes supersede each other: request() bumps a generation, older workers see should_stop() turn True
+    and bail out between windows, and any result they still deliver is dropped. A worker stuck on a hung
+    window only delays its own thread."""
+    def __init__(self, schedule, job, on_result, on_idle=None, poll_ms=30):
+        self.schedule = schedule
+        self.job = job
+        self.on_result = on_result
+        self.on_idle = on_idle # UI thread, once nothing is in flight any more
+        self.poll_ms = poll_ms
+        self.generation = 0
+        self.in_flight = 0
+        self.results = queue.SimpleQueue()
+        self._polling = False
+
+    @property
+    def busy(self):
+        return self.in_flight > 0
+
+    def request(self):
+        self.generation += 1
+        gen = self.generation
+        self.in_flight += 1
+        threading.Thread(target=self._work, args=(gen,), name=f"GhostRefresh-{gen}", daemon=True).start()
+        if not self._polling:
+            self._polling = True
+            self.schedule(self.poll_ms, self._poll)
+        return gen
+
+    def cancel(self):
+        self.generation += 1 # in-flight work is now stale
+
+    def _work(self, gen):
+        result = None
+        try:
+            result = self.job(lambda: gen != self.generation)
+        except Exception:
+            pass
+        self.results.put((gen, result))
+
+    def _poll(self):
+        while True:
+            try:
+                gen, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.in_flight -= 1
+            if gen == self.generation and result is not None:
+                self.on_result(result)
+        if self.in_flight > 0:
+            self.schedule(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+            if self.on_idle: self.on_idle()
+
+# -------------------------------------------------------------------------
+# OPACITY PIPELINE
+# -------------------------------------------------------------------------
+
+FRAME_MS = 16 # ~60 Hz
+
+class AlphaPipeline:
+    """Coalesces opacity requests: only the latest alpha per hwnd survives, committed at most once per frame.
+    schedule(ms, fn) is Tk's after() in the app, anything with the same shape elsewhere."""
+    def __init__(self, schedule, on_commit=None, frame_ms=FRAME_MS):
+        self.schedule = schedule
+        self.on_commit = on_commit # called with [(hwnd, alpha_0_100, ok), ...] after each commit
+        self.frame_ms = frame_ms
+        self.pending: Dict[int, int] = {}
+        self.scheduled = False
+
+    def request(self, hwnd_int, alpha_0_100):
+        self.pending[hwnd_int] = alpha_0_100
+        if not self.scheduled:
+            self.scheduled = True
+            self.schedule(self.frame_ms, self.flush)
+
+    def cancel(self, hwnd_int=None):
+        """Drop pending requests (all, or one hwnd) - e.g. before restoring the window."""
+        if hwnd_int is None:
+            self.pending.clear()
+        else:
+            self.pending.pop(hwnd_int, None)
+
+    def flush(self):
+        self.scheduled = False
+        pending, self.pending = self.pending, {}
+        if not pending: return
+        results = [(h, a, set_window_alpha(h, a)) for h, a in pending.items()]
+        if self.on_commit: self.on_commit(results)
+
+# -------------------------------------------------------------------------
+# OPACITY ANIMATION
+# -------------------------------------------------------------------------
+
+EASING_STEPS = 256
+RESTORE_FADE_MS = 180
+
+def _easing_table(fn):
+    return tuple(fn(i / (EASING_STEPS - 1)) for i in range(EASING_STEPS))
+
+# Sampled once at import; a frame costs a multiply and an index per animation, never a pow()
+EASINGS = {
+    "linear": _easing_table(lambda t: t),
+    "ease_in": _easing_table(lambda t: t ** 3),
+    "ease_out": _easing_table(lambda t: 1 - (1 - t) ** 3),
+    "ease_in_out": _easing_table(lambda t: 4 * t ** 3 if t < 0.5 else 1 - (-2 * t + 2) ** 3 / 2),
+}
+
+class Fade:
+    __slots__ = ("hwnd", "start", "delta", "t0", "duration", "table", "last_byte", "on_done")
+
+    def __init__(self, hwnd, start, end, t0, duration, table, last_byte, on_done):
+        self.hwnd = hwnd
+        self.start = start
+        self.delta = end - start
+        self.t0 = t0
+        self.duration = duration
+        self.table = table
+        self.last_byte = last_byte
+        self.on_done = on_done
+
+class AlphaAnimator:
+    """Opacity fades on top of set_window_alpha, all driven by one frame clock.
+
+    There is a single pending schedule() no matter how many windows are fading, and none at all when idle.
+    Progress comes from clock(), not from counting frames, so a late frame jumps ahead instead of
+    stretching the fade. A frame only calls set_window_alpha for windows whose alpha byte actually changed,
+    which is what keeps long, shallow fades and large batches cheap."""
+    def __init__(self, schedule, frame_ms=FRAME_MS, clock=time.perf_counter):
+        self.schedule = schedule
+        self.frame_ms = frame_ms
+        self.clock = clock
+        self.fades: Dict[int, Fade] = {}
+        self.scheduled = False
+        self.frames = 0
+        self.writes = 0
+
+    def fade(self, hwnd_int, to_0_100, duration_ms=200, easing="ease_out", from_0_100=None, on_done=None):
+        """Start (or retarget) a fade. on_done(hwnd, ok) runs on the frame that lands it."""
+        if from_0_100 is None:
+            info = modified_windows.get(hwnd_int)
+            from_0_100 = info.alpha * 100 / 255 if info else 100
+        cur_byte = alpha_byte(from_0_100)
+        self.fades[hwnd_int] = Fade(hwnd_int, from_0_100, to_0_100, self.clock(), max(duration_ms, 1) / 1000.0,
+                                    EASINGS[easing], cur_byte, on_done)
+        if not self.scheduled:
+            self.scheduled = True
+            self.schedule(self.frame_ms, self.tick)
+
+    def cancel(self, hwnd_int=None):
+        """Stop fades where they are (all, or one hwnd); their on_done never runs."""
+        if hwnd_int is None:
+            self.fades.clear()
+        else:
+            self.fades.pop(hwnd_int, None)
+
+    def __contains__(self, hwnd_int):
+        return hwnd_int in self.fades
+
+    def tick(self):
+        self.scheduled = False
+        now = self.clock()
+        self.frames += 1
+        last = EASING_STEPS - 1
+        finished = []
+        for f in list(self.fades.values()):
+            p = (now - f.t0) / f.duration
+            done = p >= 1.0
+            value = f.start + f.delta * (1.0 if done else f.table[int(p * last)])
+            b = alpha_byte(value)
+            ok = True
+            if b != f.last_byte:
+                ok = set_window_alpha(f.hwnd, value)
+                self.writes += 1
+                f.last_byte = b
+            if done or not ok:
+                finished.append((f, ok))
+        for f, ok in finished:
+            if self.fades.get(f.hwnd) is f: del self.fades[f.hwnd]
+            if f.on_done: f.on_done(f.hwnd, ok)
+        if self.fades:
+            # Schedule relative to when this frame should have ended, not when the work finished
+            spent_ms = (self.clock() - now) * 1000
+            self.scheduled = True
+            self.schedule(max(1, int(self.frame_ms - spent_ms)), self.tick)
+
+# -------------------------------------------------------------------------
+# PASSTHROUGH FAN-OUT
+# -------------------------------------------------------------------------
+
+FanoutReport = namedtuple("FanoutReport", "enable windows writes failed latency_ms")
+
+class PassthroughFanout:
+    """Applies temporary click-through to many windows at once.
+
+    The plan is made up front on the caller's thread from cached state: which windows are affected, and the
+    exact ex-style each should end up with; windows already there cost nothing. The writes then go out from
+    a small pool. SetWindowLongPtr on another process's window waits for that window's thread to take
+    WM_STYLECHANGING/ED, so in parallel the slowest window sets the latency instead of the sum of them all.
+    Each window's write runs under its window_lock and reads the latest target, so a quick down/up cannot
+    leave a window in the older state however the pool schedules them. A window restored, replaced or
+    locked since the plan is left alone: the write never re-tracks it."""
+    def __init__(self, workers=8, on_report=None):
+        from concurrent.futures import ThreadPoolExecutor # ~10 ms to import; only the GUI ever fans out
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ghost-fanout")
+        self.on_report = on_report # called from a worker with a FanoutReport once the last window is done
+        self.target: Dict[int, tuple] = {} # hwnd -> (the WindowState planned for, target ex-style)
+        self.last_report = None
+        self.inflight = set() # futures not finished yet, for a bounded shutdown
+
+    def plan(self, enable):
+        """[(hwnd, target_ex)] for every unlocked modified window whose style must change."""
+        moves = []
+        with state_lock: # flags and desired move together with the UI's own changes
+            for h in tracked_windows(exclude=STATE_LOCKED):
+                info = modified_windows.get(h)
+                if info is None: continue
+                desire(h, passthrough=enable) # so a reconcile while CTRL is held doesn't undo it
+                info.set_flag(STATE_PASSTHROUGH, enable)
+                cur = cached_ex_style(h)
+                want = cur | WS_EX_TRANSPARENT if enable else cur & ~WS_EX_TRANSPARENT
+                # Publish the target before re-reading the cache: a worker finishing an older write either sees
+                # this target and carries on, or has already landed its write and we see that here
+                self.target[h] = (info, want)
+                if cached_ex_style(h) != want: moves.append((h, want))
+        return moves
+
+    def apply(self, enable, started_at=None):
+        """Plan and dispatch. Returns immediately, the writes all go out from the pool; started_at (perf_counter)
+        is the key edge that made the change, for the report."""
+        t0 = started_at if started_at is not None else time.perf_counter()
+        moves = self.plan(enable)
+        if not moves:
+            return self._report(FanoutReport(enable, 0, 0, 0, (time.perf_counter() - t0) * 1000))
+
+        state = {"left": len(moves), "failed": 0}
+        done_lock = threading.Lock()
+
+        def settle(h):
+            ok = self._settle(h)
+            with done_lock:
+                state["left"] -= 1
+                state["failed"] += not ok
+                if state["left"]: return
+            self._report(FanoutReport(enable, len(moves), len(moves), state["failed"], (time.perf_counter() - t0) * 1000))
+
+        for h, _want in moves:
+            fut = self.pool.submit(settle, h)
+            self.inflight.add(fut)
+            fut.add_done_callback(self.inflight.discard)
+
+    def _settle(self, h):
+        with window_lock(h):
+            try:
+                # Loop until the window matches the latest target, which may move while we write
+                while True:
+                    with state_lock:
+                        info, want = self.target.get(h, (None, None))
+                        if info is None or modified_windows.get(h) is not info or info.flags & STATE_LOCKED:
+                            return True # restored, replaced or locked since the plan
+                        if cached_ex_style(h) == want: return True
+                    # Not write_ex_style: that would track the window again if it had gone
+                    # Only WS_EX_TRANSPARENT changes: the layered attributes (the alpha) stay as they were
+                    ok = safe_SetWindowLongPtr(h, GWL_EXSTYLE, want)
+                    with state_lock:
+                        if modified_windows.get(h) is info: info.ex = want if ok else None
+                    if not ok: return False # 0: the write may have failed
+            except Exception:
+                return False
+
+    def _report(self, report):
+        self.last_report = report
+        if self.on_report: self.on_report(report)
+
+    def forget(self, hwnd_int):
+        # A worker still settling it finds the target gone and stops
+        self.target.pop(hwnd_int, None)
+
+    def shutdown(self, timeout=None):
+        """Stop taking work and wait for the writes already dispatched, at most timeout seconds (None = however
+        long). Returns False if some were still running: a hung window must not hold the caller (say, exit) hostage."""
+        from concurrent.futures import wait
+        self.pool.shutdown(wait=False)
+        _done, pending = wait(list(self.inflight), timeout=timeout)
+        return not pending
+
+# -------------------------------------------------------------------------
+# INPUT: LOW-LEVEL KEYBOARD HOOK
+# -------------------------------------------------------------------------
+
+WM_QUIT = 0x0012
+WM_KEYDOWN = 0x0100
+WM_KEYUP = 0x0101
+WM_SYSKEYDOWN = 0x0104
+WM_SYSKEYUP = 0x0105
+PM_NOREMOVE = 0x0000
+WH_KEYBOARD_LL = 13
+
+VK_CONTROL = 0x11
+VK_LCONTROL = 0xA2
+VK_RCONTROL = 0xA3
+VK_MENU = 0x12 # Alt
+VK_LMENU = 0xA4
+VK_RMENU = 0xA5
+VK_OEM_3 = 0xC0 # ` key
+
+# Event kinds delivered to the UI thread as (kind, vk)
+MOD_DOWN = "mod_down"
+MOD_UP = "mod_up"
+KEY_DOWN = "key_down"
+KEY_UP = "key_up"
+INVENTORY = "inventory" # window list changed, payload None
+FANOUT = "fanout" # CTRL click-through applied, payload FanoutReport
+RULE = "rule" # a new window matched an auto-apply rule, payload (hwnd, Rule)
+ARGS = "args" # a second launch forwarded its command line, payload [argv, threading.Event, result]
+CONTROL = "control" # a control-channel batch changed windows, payload number of commands
+EVICTED = "evicted" # a tracked window was destroyed or its handle reused, payload hwnd
+
+# logical modifier -> physical keys that hold it (the LL hook reports L/R, polling reports the generic code)
+MODIFIER_KEYS = {VK_CONTROL: (VK_CONTROL, VK_LCONTROL, VK_RCONTROL), VK_MENU: (VK_MENU, VK_LMENU, VK_RMENU)}
+_MODIFIER_OF = {vk: mod for mod, vks in MODIFIER_KEYS.items() for vk in vks}
+
+class KBDLLHOOKSTRUCT(ctypes.Structure):
+    _fields_ = [("vkCode", DWORD), ("scanCode", DWORD), ("flags", DWORD),
+                ("time", DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+class KeyEdgeDispatcher:
+    """Turns raw key reports into down/up edges, dropping auto-repeat. Pure Python, so it can be fed synthetically."""
+    def __init__(self, sink, watched=None):
+        self.sink = sink # called with (kind, vk)
+        self.watched = watched # logical vks of interest, None = all
+        self.raw_down = set()
+        self.edge_at: Dict[int, float] = {} # logical vk -> perf_counter() of its last edge, for latency reports
+
+    def _held(self, logical):
+        return any(vk in self.raw_down for vk in MODIFIER_KEYS.get(logical, (logical,)))
+
+    def feed(self, vk, is_down):
+        logical = _MODIFIER_OF.get(vk, vk)
+        if self.watched is not None and logical not in self.watched: return
+        before = self._held(logical)
+        if is_down:
+            self.raw_down.add(vk)
+        else:
+            self.raw_down.discard(vk)
+        after = self._held(logical)
+        if before == after: return # auto-repeat, or the other side of a L/R pair still held
+        self.edge_at[logical] = time.perf_counter()
+
+        if logical in MODIFIER_KEYS:
+            self.sink((MOD_DOWN if after else MOD_UP, logical))
+        else:
+            self.sink((KEY_DOWN if after else KEY_UP, logical))
+
+class CtrlHold:
+    """Whether Ctrl is held for temporary passthrough, from MOD_DOWN/MOD_UP edges. Alt during a Ctrl press makes
+    it the Ctrl+Alt+` chord (or AltGr): a shortcut, not a hold, so it stays off until both keys are up."""
+    def __init__(self):
+        self.keys_held = {VK_CONTROL: False, VK_MENU: False}
+        self.in_chord = False
+
+    def feed(self, kind, vk):
+        """The hold state after this edge, or None if it isn't a Ctrl or Alt edge."""
+        if kind not in (MOD_DOWN, MOD_UP) or vk not in self.keys_held: return None
+        self.keys_held[vk] = kind == MOD_DOWN
+        if self.keys_held[VK_MENU]: self.in_chord = True
+        elif not self.keys_held[VK_CONTROL]: self.in_chord = False
+        return self.keys_held[VK_CONTROL] and not self.in_chord
+
+class MessageLoopThread(threading.Thread):
+    """Daemon thread that runs setup() and then pumps its own Win32 message queue until stop()."""
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.thread_id = 0
+        self.ok = False
+        self._ready = threading.Event()
+
+    def setup(self): return True
+    def teardown(self): pass
+    def on_message(self, msg): pass
+
+    def run(self):
+        self.thread_id = kernel32.GetCurrentThreadId()
+        msg = wt.MSG()
+        # Force the queue to exist so PostThreadMessage works as soon as we report ready
+        user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_NOREMOVE)
+        try:
+            self.ok = bool(self.setup())
+        except Exception:
+            self.ok = False
+        self._ready.set()
+        if not self.ok: return
+
+        try:
+            while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                self.on_message(msg)
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+        finally:
+            self.teardown()
+
+    def start_and_wait(self, timeout=2.0):
+        if user32 is None: return False # not on Windows (simulated backend)
+        self.start()
+        self._ready.wait(timeout)
+        return self.ok
+
+    def stop(self):
+        if self.thread_id:
+            user32.PostThreadMessageW(self.thread_id, WM_QUIT, 0, 0)
+
+class LowLevelKeyboardHook(MessageLoopThread):
+    """WH_KEYBOARD_LL hook on its own message thread. Never swallows keys, only reports them to feed(vk, is_down).
+    feed runs inside the hook, so it must hand off and return at once: while it runs the whole desktop's input
+    waits, and past LowLevelHooksTimeout Windows silently removes the hook."""
+    def __init__(self, feed):
+        super().__init__("GhostKeyboardHook")
+        self.feed = feed
+        self.hook = None
+        self._proc = None # keep the callback alive as long as the hook
+
+    def setup(self):
+        HOOKPROC = ctypes.WINFUNCTYPE(LRESULT, ctypes.c_int, WPARAM, LPARAM)
+        user32.SetWindowsHookExW.argtypes = [ctypes.c_int, HOOKPROC, ctypes.c_void_p, DWORD]
+        user32.SetWindowsHookExW.restype = ctypes.c_void_p
+        user32.CallNextHookEx.argtypes = [ctypes.c_void_p, ctypes.c_int, WPARAM, LPARAM]
+        user32.CallNextHookEx.restype = LRESULT
+        kernel32.GetModuleHandleW.restype = ctypes.c_void_p
+
+        def proc(n_code, w_param, l_param):
+            if n_code >= 0:
+                try:
+                    kb = ctypes.cast(l_param, ctypes.POINTER(KBDLLHOOKSTRUCT)).contents
+                    if w_param in (WM_KEYDOWN, WM_SYSKEYDOWN):
+                        self.feed(kb.vkCode, True)
+                    elif w_param in (WM_KEYUP, WM_SYSKEYUP):
+                        self.feed(kb.vkCode, False)
+                except Exception:
+                    pass
+            return user32.CallNextHookEx(self.hook, n_code, w_param, l_param)
+
+        self._proc = HOOKPROC(proc)
+        self.hook = user32.SetWindowsHookExW(WH_KEYBOARD_LL, self._proc, kernel32.GetModuleHandleW(None), 0)
+        return bool(self.hook)
+
+    def teardown(self):
+        if self.hook:
+            user32.UnhookWindowsHookEx(ctypes.c_void_p(self.hook))
+            self.hook = None
+
+class SyntheticKeyboardHook:
+    """Stand-in for LowLevelKeyboardHook: same start/stop surface, keys are pushed by hand.
+    press() on a key already down is what the OS sends for auto-repeat."""
+    def __init__(self, feed):
+        self.feed = feed
+        self.ok = False
+
+    def start_and_wait(self, timeout=2.0):
+        self.ok = True
+        return True
+
+    def stop(self):
+        self.ok = False
+
+    def press(self, vk): self.feed(vk, True)
+    def release(self, vk): self.feed(vk, False)
+    def tap(self, vk):
+        self.press(vk)
+        self.release(vk)
+
+# -------------------------------------------------------------------------
+# EVENTS: WINEVENT HOOKS
+# -------------------------------------------------------------------------
+
+class WinEventThread(MessageLoopThread):
+    """Out-of-context SetWinEventHook on its own message thread; callback(event, hwnd, id_object, id_child)."""
+    def __init__(self, event_min, event_max, callback):
+        super().__init__("GhostWinEvents")
+        self.event_min = event_min
+        self.event_max = event_max
+        self.callback = callback
+        self.hook = None
+        self._proc = None
+
+    def setup(self):
+        WINEVENTPROC = ctypes.WINFUNCTYPE(None, ctypes.c_void_p, DWORD, HWND, ctypes.c_long, ctypes.c_long, DWORD, DWORD)
+        user32.SetWinEventHook.argtypes = [DWORD, DWORD, ctypes.c_void_p, WINEVENTPROC, DWORD, DWORD, DWORD]
+        user32.SetWinEventHook.restype = ctypes.c_void_p
+
+        def proc(hook, event, hwnd, id_object, id_child, thread_id, time_ms):
+            try:
+                self.callback(event, hwnd or 0, id_object, id_child)
+            except Exception:
+                pass
+
+        self._proc = WINEVENTPROC(proc)
+        self.hook = user32.SetWinEventHook(self.event_min, self.event_max, None, self._proc, 0, 0,
+                                           WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS)
+        return bool(self.hook)
+
+    def teardown(self):
+        if self.hook:
+            user32.UnhookWinEvent(ctypes.c_void_p(self.hook))
+            self.hook = None
+
+# -------------------------------------------------------------------------
+# INPUT: GLOBAL HOTKEYS
+# -------------------------------------------------------------------------
+
+WM_HOTKEY = 0x0312
+WM_APP = 0x8000
+HWND_MESSAGE = -3
+
+MOD_ALT = 0x0001
+MOD_CONTROL = 0x0002
+MOD_SHIFT = 0x0004
+MOD_WIN = 0x0008
+MOD_NOREPEAT = 0x4000
+
+HOTKEY = "hotkey" # event kind, delivered as (HOTKEY, hotkey_id)
+TOGGLE_HOTKEY = "Ctrl+Alt+`"
+
+_HOTKEY_MODS = {"ctrl": MOD_CONTROL, "control": MOD_CONTROL, "alt": MOD_ALT, "shift": MOD_SHIFT, "win": MOD_WIN}
+_HOTKEY_KEYS = {"`": VK_OEM_3, "space": 0x20, "tab": 0x09, "esc": 0x1B, "enter": 0x0D,
+                "pause": 0x13, "insert": 0x2D, "delete": 0x2E, "home": 0x24, "end": 0x23,
+                "+": 0xBB, "-": 0xBD}
+
+def parse_hotkey(combo):
+    """'Ctrl+Alt+`' / 'Win+Shift+T' -> (mods, vk). Raises ValueError on anything RegisterHotKey can't take."""
+    parts = [p.strip() for p in combo.split("+")]
+    # a literal '+' key leaves an empty last part
+    if len(parts) > 1 and parts[-1] == "" and parts[-2] == "":
+        parts = parts[:-2] + ["+"]
+    *mod_names, key = parts
+    mods = 0
+    for name in mod_names:
+        if name.lower() not in _HOTKEY_MODS:
+            raise ValueError(f"Unknown modifier {name!r} in {combo!r}")
+        mods |= _HOTKEY_MODS[name.lower()]
+
+    k = key.lower()
+    if k in _HOTKEY_KEYS:
+        vk = _HOTKEY_KEYS[k]
+    elif len(key) == 1 and key.isalnum():
+        vk = ord(key.upper())
+    elif k.startswith("f") and k[1:].isdigit() and 1 <= int(k[1:]) <= 24:
+        vk = 0x70 + int(k[1:]) - 1
+    else:
+        raise ValueError(f"Unknown key {key!r} in {combo!r}")
+    return mods, vk
+
+class Win32HotkeyPump(MessageLoopThread):
+    """Message-only window on a dedicated thread. RegisterHotKey has to run on the thread owning the window,
+    so register/unregister are marshalled onto it with a WM_APP wake-up."""
+    def __init__(self):
+        super().__init__("GhostHotkeys")
+        self.hwnd = None
+        self.on_hotkey = None
+        self._calls = queue.SimpleQueue()
+
+    def open(self, on_hotkey):
+        self.on_hotkey = on_hotkey
+        return self.start_and_wait()
+
+    def close(self):
+        self.stop()
+
+    def setup(self):
+        user32.CreateWindowExW.restype = ctypes.c_void_p
+        user32.CreateWindowExW.argtypes = [DWORD, ctypes.c_wchar_p, ctypes.c_wchar_p, DWORD,
+                                           ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                                           ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        self.hwnd = user32.CreateWindowExW(0, "STATIC", "GhostWindowHotkeys", 0, 0, 0, 0, 0,
+                                           ctypes.c_void_p(HWND_MESSAGE), None, None, None)
+        return bool(self.hwnd)
+
+    def teardown(self):
+        if self.hwnd:
+            user32.DestroyWindow(ctypes.c_void_p(self.hwnd))
+            self.hwnd = None
+
+    def on_message(self, msg):
+        if msg.message == WM_HOTKEY:
+            if self.on_hotkey: self.on_hotkey(int(msg.wParam))
+        elif msg.message == WM_APP and not msg.hWnd:
+            while True:
+                try:
+                    fn, box, done = self._calls.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    box.append(fn())
+                except Exception:
+                    box.append(False)
+                done.set()
+
+    def _call(self, fn, timeout=1.0):
+        if not self.ok: return False
+        box, done = [], threading.Event()
+        self._calls.put((fn, box, done))
+        user32.PostThreadMessageW(self.thread_id, WM_APP, 0, 0)
+        return box[0] if done.wait(timeout) else False
+
+    def register(self, hotkey_id, mods, vk):
+        return bool(self._call(lambda: user32.RegisterHotKey(ctypes.c_void_p(self.hwnd), hotkey_id, mods, vk)))
+
+    def unregister(self, hotkey_id):
+        return bool(self._call(lambda: user32.UnregisterHotKey(ctypes.c_void_p(self.hwnd), hotkey_id)))
+
+class FakeHotkeyPump:
+    """In-process stand-in for Win32HotkeyPump: press() plays the part of the OS posting WM_HOTKEY."""
+    def __init__(self):
+        self.on_hotkey = None
+        self.registered = {} # id -> (mods, vk) without MOD_NOREPEAT
+
+    def open(self, on_hotkey):
+        self.on_hotkey = on_hotkey
+        return True
+
+    def close(self):
+        self.registered.clear()
+
+    def register(self, hotkey_id, mods, vk):
+        combo = (mods & ~MOD_NOREPEAT, vk)
+        if combo in self.registered.values(): return False # ERROR_HOTKEY_ALREADY_REGISTERED
+        self.registered[hotkey_id] = combo
+        return True
+
+    def unregister(self, hotkey_id):
+        return self.registered.pop(hotkey_id, None) is not None
+
+    def press(self, combo):
+        mods, vk = parse_hotkey(combo)
+        for hotkey_id, registered in self.registered.items():
+            if registered == (mods, vk) and self.on_hotkey:
+                self.on_hotkey(hotkey_id)
+                return True
+        return False
+
+class HotkeyManager:
+    """Global hotkeys. Presses arrive on the pump thread and are handed to deliver((HOTKEY, id));
+    the UI thread then calls fire(id) to run the callback."""
+    def __init__(self, deliver, pump=None):
+        self.deliver = deliver
+        self.pump = pump if pump is not None else Win32HotkeyPump()
+        self.bindings = {} # id -> (combo, callback)
+        self.active = False
+        self._next_id = 1
+
+    def start(self):
+        self.active = self.pump.open(self._on_hotkey)
+        return self.active
+
+    def stop(self):
+        for hotkey_id in list(self.bindings):
+            self.unregister(hotkey_id)
+        self.pump.close()
+        self.active = False
+
+    def register(self, combo, callback):
+        """Returns the hotkey id, or None if the combo is taken or the pump isn't running."""
+        if not self.active: return None
+        mods, vk = parse_hotkey(combo)
+        hotkey_id = self._next_id
+        if not self.pump.register(hotkey_id, mods | MOD_NOREPEAT, vk): return None
+        self._next_id += 1
+        self.bindings[hotkey_id] = (combo, callback)
+        return hotkey_id
+
+    def unregister(self, combo_or_id):
+        for hotkey_id, (combo, _cb) in list(self.bindings.items()):
+            if combo_or_id in (hotkey_id, combo):
+                self.pump.unregister(hotkey_id)
+                del self.bindings[hotkey_id]
+                return True
+        return False
+
+    def _on_hotkey(self, hotkey_id):
+        if hotkey_id in self.bindings:
+            self.deliver((HOTKEY, hotkey_id))
+
+    def fire(self, hotkey_id):
+        binding = self.bindings.get(hotkey_id)
+        if binding: binding[1]()
+
+# -------------------------------------------------------------------------
+# SINGLE INSTANCE & CONTROL CHANNEL
+# -------------------------------------------------------------------------
+
+ERROR_ALREADY_EXISTS = 183
+INSTANCE_MUTEX = "Local\\GhostWindow"
+
+def control_address():
+    """Named pipe on Windows, a Unix socket in the per-user app dir elsewhere (tests, the simulated desktop)."""
+    if sys.platform == "win32":
+        return r"\\.\pipe\GhostWindow-" + (os.environ.get("USERNAME") or "user")
+    return os.path.join(APP_DIR, "control.sock")
+
+class InstanceLock:
+    """Held for the life of the one process that owns the windows: a named mutex on Windows, flock elsewhere."""
+    def __init__(self, name=INSTANCE_MUTEX, lock_path=None):
+        self.name = name
+        self.lock_path = lock_path or os.path.join(APP_DIR, "instance.lock")
+        self.handle = None
+
+    def acquire(self):
+        if self.handle is not None: return True
+        if sys.platform == "win32":
+            # ctypes.GetLastError() can be clobbered by calls ctypes itself makes after CreateMutexW returns;
+            # use_last_error has the value saved right after the call, per thread
+            k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            k32.CreateMutexW.restype = ctypes.c_void_p
+            k32.CreateMutexW.argtypes = [ctypes.c_void_p, BOOL, ctypes.c_wchar_p]
+            k32.CloseHandle.argtypes = [ctypes.c_void_p]
+            handle = k32.CreateMutexW(None, False, self.name)
+            if not handle: return False
+            if ctypes.get_last_error() == ERROR_ALREADY_EXISTS:
+                k32.CloseHandle(handle)
+                return False
+            self.handle = handle
+            return True
+        import fcntl
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        f = open(self.lock_path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.handle = f
+        return True
+
+    def release(self):
+        if self.handle is None: return
+        if sys.platform == "win32":
+            ctypes.windll.kernel32.CloseHandle(ctypes.c_void_p(self.handle))
+        else:
+            self.handle.close()
+        self.handle = None
+
+class ControlServer:
+    """Local control channel of the running instance (multiprocessing.connection, so AF_PIPE or AF_UNIX).
+
+    One message is a batch: newline-separated commands "<verb> <argument>", answered by one message with one
+    line per command, "ok [payload]" or "err <reason>". commands maps verb -> fn(argument) -> payload str;
+    each connection gets its own thread, and a command runs on it unless the fn hands off elsewhere.
+    Batches from different connections run one at a time, each as a whole, except for the verbs in waits: their
+    fn waits on another thread (the UI, say), so they run outside the batch and hold up no other connection.
+    on_batch(lines) follows each batch, and the reply goes out once its z-order changes have."""
+    def __init__(self, commands, address=None, on_batch=None, waits=()):
+        self.commands = commands
+        self.address = address or control_address()
+        self.on_batch = on_batch
+        self.waits = frozenset(waits)
+        self.listener = None
+        self.thread = None
+        self.batch_lock = threading.Lock()
+
+    def start(self):
+        from multiprocessing.connection import Listener # ~20 ms to import: only the instance that serves pays it
+        if sys.platform != "win32":
+            os.makedirs(os.path.dirname(self.address) or ".", exist_ok=True)
+            try:
+                os.unlink(self.address) # left over from a crash; we hold the instance lock, so it's ours
+            except OSError:
+                pass
+        try:
+            self.listener = Listener(self.address)
+        except OSError:
+            return False
+        self.thread = threading.Thread(target=self._accept_loop, name="ghost-control", daemon=True)
+        self.thread.start()
+        return True
+
+    def _accept_loop(self):
+        while self.listener is not None:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError):
+                if self.listener is None: return
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="ghost-control-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    batch = conn.recv_bytes().decode("utf-8")
+                except (OSError, EOFError):
+                    return
+                lines = [line for line in batch.split("\n") if line.strip()]
+                replies = []
+                for waits, run in groupby(lines, self._waits):
+                    if waits:
+                        replies += [self.run(line) for line in run]
+                        continue
+                    # A batch that touches many windows raises them all in one DeferWindowPos, on leaving the block
+                    with self.batch_lock, batched_topmost():
+                        replies += [self.run(line) for line in run]
+                if self.on_batch is not None: self.on_batch(lines)
+                try:
+                    conn.send_bytes("\n".join(replies).encode("utf-8"))
+                except OSError:
+                    return
+
+    def _waits(self, line):
+        return line.strip().partition(" ")[0] in self.waits
+
+    def run(self, line):
+        verb, _sep, arg = line.strip().partition(" ")
+        fn = self.commands.get(verb)
+        if fn is None: return f"err unknown command {verb!r}"
+        try:
+            payload = fn(arg)
+        except Exception as e:
+            return f"err {e}"
+        return f"ok {payload}" if payload else "ok"
+
+    def stop(self):
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            try:
+                listener.close()
+            except OSError:
+                pass
+        if sys.platform != "win32":
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+class ControlClient:
+    """Connection to the running instance's control channel. batch() is one round trip; pipeline() keeps up to
+    depth batches in flight, so the instance applies one while the next is on the wire."""
+    def __init__(self, address=None):
+        from multiprocessing.connection import Client
+        self.conn = Client(address or control_address()) # OSError if nothing is listening
+
+    def batch(self, lines):
+        """One message out, one back -> reply lines, in command order."""
+        return self.pipeline([lines])[0]
+
+    def pipeline(self, batches, depth=4):
+        """[[command]] -> [[reply]]. Replies are small, but bounding what's in flight keeps both socket buffers
+        from filling up at once (each side blocked on send, neither reading)."""
+        results, sent = [], 0
+        for lines in batches:
+            self.conn.send_bytes("\n".join(lines).encode("utf-8"))
+            sent += 1
+            if sent - len(results) >= depth: results.append(self._recv())
+        while len(results) < sent:
+            results.append(self._recv())
+        return results
+
+    def _recv(self):
+        reply = self.conn.recv_bytes().decode("utf-8")
+        return reply.split("\n") if reply else []
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def send_commands(lines, address=None):
+    """Send one batch to the running instance -> list of reply lines, or None if nothing is listening."""
+    try:
+        with ControlClient(address) as client:
+            return client.batch(lines)
+    except (OSError, EOFError):
+        return None
+
+def claim_instance(argv, timeout=3.0):
+    """(InstanceLock, None) if this process is now the instance; (None, reply) once argv went to the one running.
+
+    The running instance may still be starting (lock held, channel not open yet), and it may exit while we wait,
+    so keep trying both until one works."""
+    lock = InstanceLock()
+    deadline = time.monotonic() + timeout
+    while True:
+        if lock.acquire(): return lock, None
+        reply = send_commands(["args " + json.dumps(argv)])
+        if reply is not None: return None, reply[0] if reply else "err empty reply"
+        if time.monotonic() > deadline: return None, "err GhostWindow is running but not answering"
+        time.sleep(0.05)
+
+def forward_reply(reply):
+    """Print what the instance answered to an "args" command; returns the exit code to use."""
+    if not reply.startswith("ok "):
+        print(reply[4:] if reply.startswith("err ") else reply, file=sys.stderr)
+        return 1
+    result = json.loads(reply[3:])
+    for line in result.get("output", ()): print(line)
+    for line in result.get("errors", ()): print(line, file=sys.stderr)
+    return result.get("exit", 0)
+
+# --- Window commands for the control channel ---
+def _hwnd_arg(text):
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise ValueError(f"bad hwnd {text!r}") from None
+
+def _window_arg(arg):
+    hwnd, _sep, rest = arg.strip().partition(" ")
+    return _hwnd_arg(hwnd), rest.strip()
+
+def _cmd_set_alpha(arg):
+    hwnd, pct = _window_arg(arg)
+    if not pct.isdigit() or int(pct) > 100: raise ValueError(f"bad opacity {pct!r} (0-100)")
+    if not set_window_alpha(hwnd, int(pct)): raise OSError(f"{hwnd:#x}: SetLayeredWindowAttributes failed")
+    return ""
+
+def _cmd_set_passthrough(arg):
+    hwnd, state = _window_arg(arg)
+    if state not in ("on", "off"): raise ValueError(f"bad state {state!r} (on/off)")
+    enable = state == "on"
+    if not set_passthrough_for_hwnd(hwnd, enable=enable, mark_locked=enable): raise OSError(f"{hwnd:#x}: style change failed")
+    return ""
+
+def _cmd_restore(arg):
+    arg = arg.strip()
+    if arg == "all":
+        restore_all()
+    else:
+        restore_window(_hwnd_arg(arg))
+    return ""
+
+def _cmd_list(arg):
+    """"list" = visible windows, "list modified" = the ones we've changed; one JSON array either way."""
+    arg = arg.strip()
+    if arg == "modified":
+        return json.dumps([[h, round(info.alpha * 100 / 255), info.passthrough, info.passthrough_locked]
+                           for h, info in list(modified_windows.items())], separators=(",", ":"))
+    if arg: raise ValueError(f"bad list filter {arg!r} (modified)")
+    return json.dumps([[r.hwnd, r.pid, r.cls, r.title] for r in iter_windows() if r.title and r.title not in JUNK_TITLES],
+                      separators=(",", ":"), ensure_ascii=False)
+
+WINDOW_COMMANDS = {
+    "set_alpha": _cmd_set_alpha, # <hwnd> <0-100>
+    "set_passthrough": _cmd_set_passthrough, # <hwnd> on|off (on also locks it, like the switch)
+    "restore": _cmd_restore, # <hwnd> | all
+    "list": _cmd_list, # [modified]
+}
@@ -1,175 +1,117 @@
+import time
+STARTUP_T0 = time.perf_counter() # before the heavy imports, so the startup log accounts for them
+import sys
+
+if __name__ == "__main__":
+    # A second launch hands its arguments to the running GhostWindow and leaves before paying for Tk
+    from ghost_core import claim_instance, forward_reply
+    INSTANCE, _reply = claim_instance(sys.argv[1:])
+    if INSTANCE is None: sys.exit(forward_reply(_reply))
+
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
-import ctypes
-import ctypes.wintypes as wt
-import signal
-import atexit
-import sys
+import contextlib
+import io
+import json
+import logging
 import os
-from typing import Dict
-
-# -------------------------------------------------------------------------
-# BACKEND: WIN32 API & LOGIC
-# -------------------------------------------------------------------------
-
-user32 = ctypes.windll.user32
-kernel32 = ctypes.windll.kernel32
-
-# Constants
-GWL_EXSTYLE = -20
-WS_EX_LAYERED = 0x00080000
-WS_EX_TRANSPARENT = 0x00000020
-LWA_ALPHA = 0x00000002
-
-SWP_NOSIZE = 0x0001
-SWP_NOMOVE = 0x0002
-SWP_NOACTIVATE = 0x0010
-HWND_TOPMOST = ctypes.c_void_p(-1)
-HWND_NOTOPMOST = ctypes.c_void_p(-2)
+import queue
+import threading
 
-# Safe wintypes
-HWND = getattr(wt, "HWND", ctypes.c_void_p)
-DWORD = getattr(wt, "DWORD", ctypes.c_ulong)
-BOOL = getattr(wt, "BOOL", ctypes.c_int)
+import ghost_core
+from ghost_core import (AlphaAnimator, AlphaPipeline, BackgroundRefresher, ControlServer, CtrlHold, HotkeyManager,
+                        KeyEdgeDispatcher, LowLevelKeyboardHook, PassthroughFanout, Rule, RuleSet, WindowInventory,
+                        WindowStore,
+                        ARGS, CONTROL, DEAD_SWEEP_MS, EVICTED, FANOUT, HOTKEY, INVENTORY, KEY_DOWN,
+                        RESTORE_FADE_MS, RULE, TOGGLE_HOTKEY, VK_CONTROL, VK_MENU, VK_OEM_3, WINDOW_COMMANDS,
+                        batched_topmost, close_journal, eviction_listeners, install_exit_hooks, load_window_cache,
+                        modified_windows, open_journal, restore_all, restore_window, revalidate_styles,
+                        save_window_cache, set_passthrough_for_hwnd, sweep_dead_windows, watch_window_events)
 
-# State Storage
-# hwnd (int) -> {"orig_ex": int, "alpha": int, "passthrough": bool, "is_topmost": bool, "passthrough_locked": bool}
-modified_windows: Dict[int, Dict] = {}
+log = logging.getLogger("ghostwindow")
 
-def safe_GetWindowLongPtr(hwnd_int, index=GWL_EXSTYLE):
-    try:
-        return user32.GetWindowLongW(ctypes.c_void_p(hwnd_int), index)
-    except:
-        return 0
-
-def safe_SetWindowLongPtr(hwnd_int, index, new_value):
-    try:
-        return user32.SetWindowLongW(ctypes.c_void_p(hwnd_int), index, new_value)
-    except:
-        return 0
-
-def set_window_alpha(hwnd_int, alpha_0_100):
-    if not hwnd_int: return False
-    
-    if hwnd_int not in modified_windows:
-        orig = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
-        modified_windows[hwnd_int] = {"orig_ex": orig, "alpha": 255, "passthrough": False, "is_topmost": False, "passthrough_locked": False}
-
-    cur_ex = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
-    if not (cur_ex & WS_EX_LAYERED):
-        safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, cur_ex | WS_EX_LAYERED)
-
-    a_byte = int(max(0, min(100, int(alpha_0_100))) * 255 / 100)
-    try:
-        user32.SetLayeredWindowAttributes(ctypes.c_void_p(hwnd_int), 0, a_byte, LWA_ALPHA)
-    except:
-        return False
-        
-    modified_windows[hwnd_int]["alpha"] = a_byte
-
-    # Force Topmost
-    try:
-        user32.SetWindowPos(ctypes.c_void_p(hwnd_int), HWND_TOPMOST, 0, 0, 0, 0, SWP_NOMOVE | SWP_NOSIZE | SWP_NOACTIVATE)
-        modified_windows[hwnd_int]["is_topmost"] = True
-    except:
-        pass
-    return True
-
-def set_passthrough_for_hwnd(hwnd_int, enable=True, mark_locked=False):
-    try:
-        if hwnd_int not in modified_windows:
-            orig = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
-            modified_windows[hwnd_int] = {"orig_ex": orig, "alpha": 255, "passthrough": False, "is_topmost": False, "passthrough_locked": False}
-
-        cur_ex = safe_GetWindowLongPtr(hwnd_int, GWL_EXSTYLE)
-        
-        if enable:
-            if not (cur_ex & WS_EX_TRANSPARENT):
-                safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, cur_ex | WS_EX_TRANSPARENT)
-            
-            modified_windows[hwnd_int]["passthrough"] = True
-            if mark_locked:
-                modified_windows[hwnd_int]["passthrough_locked"] = True
-        else:
-            if cur_ex & WS_EX_TRANSPARENT:
-                safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, cur_ex & (~WS_EX_TRANSPARENT))
-            
-            modified_windows[hwnd_int]["passthrough"] = False
-            modified_windows[hwnd_int]["passthrough_locked"] = False
-
-        # Re-apply alpha just in case style change reset it
-        info = modified_windows.get(hwnd_int)
-        if info:
-             user32.SetLayeredWindowAttributes(ctypes.c_void_p(hwnd_int), 0, info.get("alpha", 255), LWA_ALPHA)
-        return True
-    except:
-        return False
-
-def restore_window(hwnd_int):
-    if hwnd_int in modified_windows:
-        info = modified_windows[hwnd_int]
-        try:
-            user32.SetLayeredWindowAttributes(ctypes.c_void_p(hwnd_int), 0, 255, LWA_ALPHA)
-            safe_SetWindowLongPtr(hwnd_int, GWL_EXSTYLE, info["orig_ex"])
-            user32.SetWindowPos(ctypes.c_void_p(hwnd_int), HWND_NOTOPMOST, 0, 0, 0, 0, SWP_NOMOVE | SWP_NOSIZE | SWP_NOACTIVATE)
-        except:
-            pass
-        del modified_windows[hwnd_int]
-
-def restore_all():
-    for h in list(modified_windows.keys()):
-        restore_window(h)
-
-# Cleanup Hooks
-atexit.register(restore_all)
-def signal_handler(signum, frame):
-    restore_all()
-    sys.exit(0)
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+FANOUT_EXIT_WAIT_S = 1.0
 
 # -------------------------------------------------------------------------
-# UTILS
+# TK GLUE
 # -------------------------------------------------------------------------
 
-def get_visible_windows():
-    """Returns list of (hwnd, title) excluding system garbage."""
-    EnumWindows = user32.EnumWindows
-    EnumWindowsProc = ctypes.WINFUNCTYPE(BOOL, HWND, ctypes.c_void_p)
-    IsWindowVisible = user32.IsWindowVisible
-    GetWindowTextLength = user32.GetWindowTextLengthW
-    GetWindowText = user32.GetWindowTextW
-    
-    wins = []
-    
-    @EnumWindowsProc
-    def enum_proc(hwnd, lParam):
-        if not IsWindowVisible(hwnd): return 1
-        length = GetWindowTextLength(hwnd)
-        if length > 0:
-            buff = ctypes.create_unicode_buffer(length + 1)
-            GetWindowText(hwnd, buff, length + 1)
-            title = buff.value
-            # Filter out common junk
-            if title not in ["Program Manager", "Settings", "Microsoft Text Input Application"]:
-                 wins.append((hwnd, title))
-        return 1
-        
-    EnumWindows(enum_proc, 0)
-    return sorted(wins, key=lambda x: x[1].lower())
+class TkEventBridge:
+    """Hands events from worker threads to the Tk thread. The queue is drained by a virtual event, so nothing polls.
+
+    post() only enqueues and never waits: it runs inside the low-level keyboard hook (which Windows unhooks if it
+    stalls) and on fan-out workers the Tk thread may be joining. event_generate from a foreign thread blocks
+    until Tk services it, so one relay thread does that, once per burst of posts."""
+    def __init__(self, widget, handler, sequence="<<GhostInput>>"):
+        self.widget = widget
+        self.handler = handler
+        self.sequence = sequence
+        self.q = queue.SimpleQueue()
+        self.wake = threading.Event()
+        self.running = True
+        widget.bind(sequence, self._drain, add="+")
+        self.relay = threading.Thread(target=self._relay, name="ghost-tk-relay", daemon=True)
+        self.relay.start()
+
+    def post(self, event):
+        self.q.put(event)
+        self.wake.set()
+
+    def _relay(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if not self.running: return
+            try:
+                self.widget.event_generate(self.sequence, when="tail")
+            except Exception:
+                pass # mainloop not running yet / shutting down; drained on the next wake
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+
+    def _drain(self, _e=None):
+        # A burst (e.g. rules for windows found at startup) raises its windows in one DeferWindowPos
+        with batched_topmost():
+            while True:
+                try:
+                    event = self.q.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self.handler(event)
+                except Exception:
+                    pass
 
 # -------------------------------------------------------------------------
 # FRONTEND: MODERN UI (CustomTkinter)
 # -------------------------------------------------------------------------
 
+class StartupClock:
+    """Logs how long each startup phase took, measured from before the imports."""
+    def __init__(self, t0=STARTUP_T0):
+        self.t0 = self.last = t0
+        self.marks = {} # phase -> ms since t0
+
+    def mark(self, phase, detail=""):
+        if phase in self.marks: return # only the first time counts (e.g. list_ready)
+        now = time.perf_counter()
+        self.marks[phase] = (now - self.t0) * 1000
+        log.info("startup %-12s %8.1f ms  (+%.1f)%s", phase, self.marks[phase], (now - self.last) * 1000,
+                 f"  {detail}" if detail else "")
+        self.last = now
+
 # Set Theme
 ctk.set_appearance_mode("Dark") 
 ctk.set_default_color_theme("blue")
 
 class App(ctk.CTk):
-    def __init__(self):
+    def __init__(self, startup=None, argv=()):
         super().__init__()
+        self.startup = startup or StartupClock()
+        self.argv = list(argv) # our own command line, carried out like a forwarded one once services are up
 
         # Window Config
         self.title("GhostWindow")
@@ -177,14 +119,15 @@ class App(ctk.CTk):
         self.resizable(False, False)
         
         # State
-        self.windows_map = {} # title -> hwnd
+        self.windows_map = WindowStore() # replaced by the inventory's store once it's seeded
         self.selected_hwnd = None
-        self.poll_ms = 50
-        self.ctrl_held = False
-        self.backtick_prev = False
+        self.poll_ms = 50 # only used if the keyboard hook can't be installed
+        self.ctrl_held = False # passthrough fan-out is on
+        self.ctrl_hold = CtrlHold() # Ctrl/Alt edges -> whether that should be so
         self.programmatic_update = False # Prevent UI callbacks loop
+        self.controls_ready = False # slider, switch and buttons exist (built right after the first paint)
 
-        # --- LAYOUT ---
+        # --- LAYOUT: the shell first; the controls are built once it is on screen ---
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(2, weight=1) # Content expands
 
@@ -204,13 +147,46 @@ class App(ctk.CTk):
         
         ctk.CTkLabel(self.card_select, text="TARGET WINDOW", font=("Arial", 11, "bold"), text_color="#AAB0B5").pack(anchor="w", padx=15, pady=(15, 5))
         
+        self.search_var = ctk.StringVar(value="")
+        self.search_entry = ctk.CTkEntry(self.card_select, textvariable=self.search_var, placeholder_text="Type to filter by title or exe...")
+        self.search_entry.pack(fill="x", padx=15, pady=(0, 6))
+        self.search_entry.bind("<KeyRelease>", self.on_search)
+
         self.combo_var = ctk.StringVar(value="Select a window...")
         self.combo = ctk.CTkComboBox(self.card_select, variable=self.combo_var, command=self.on_window_select, width=300)
         self.combo.pack(fill="x", padx=15, pady=(0, 10))
         
-        self.btn_refresh = ctk.CTkButton(self.card_select, text="Refresh List", command=self.refresh_windows, height=24, fg_color="transparent", border_width=1, text_color=("gray10", "#DCE4EE"))
+        self.btn_refresh = ctk.CTkButton(self.card_select, text="Refresh List", command=self.refresh_list, state="disabled", height=24, fg_color="transparent", border_width=1, text_color=("gray10", "#DCE4EE"))
         self.btn_refresh.pack(anchor="e", padx=15, pady=(0, 15))
+        self.btn_refresh.bind("<Shift-Button-1>", lambda _e: self.refresh_list(full=True))
+
+        # 5. Status Bar
+        self.status_bar = ctk.CTkLabel(self, text="Ready.", text_color="gray", anchor="w", font=("Arial", 10))
+        self.status_bar.grid(row=4, column=0, sticky="ew", padx=20, pady=(0, 10))
+
+        # Last session's list, so there is something to pick before the first enumeration finishes
+        self.inventory = WindowInventory(on_change=self.on_inventory_change, on_window=self.on_window_appeared)
+        self.inventory_version = None
+        self.inventory_pending = False
+        self.all_display_names = []
+        self.list_saved = False
+        cached = load_window_cache()
+        self.inventory.install_cached(cached)
+        self.refresh_windows()
+        self.startup.mark("widgets", f"{len(cached)} cached windows listed" if cached else "no cached list")
+
+        # Idle callbacks run in order, so this one comes after the shell's first layout and paint
+        self.after_idle(lambda: self.after(0, self.finish_startup))
+
+    def finish_startup(self):
+        self.startup.mark("first_paint")
+        self.build_controls()
+        self.controls_ready = True
+        self.startup.mark("controls")
+        self.start_services()
+        self.startup.mark("services")
 
+    def build_controls(self):
         # 3. Controls Card
         self.card_controls = ctk.CTkFrame(self)
         self.card_controls.grid(row=2, column=0, sticky="new", padx=20, pady=10)
@@ -237,15 +213,18 @@ class App(ctk.CTk):
         self.switch_lock = ctk.CTkSwitch(self.card_controls, text="Click-Through Locked", variable=self.switch_lock_var, command=self.on_toggle_lock, font=("Arial", 13))
         self.switch_lock.pack(anchor="w", padx=15, pady=(5, 5))
         
-        lbl_hint_1 = ctk.CTkLabel(self.card_controls, text="Shortcut: Press ` (Backtick) to toggle", font=("Arial", 10), text_color="gray")
-        lbl_hint_1.pack(anchor="w", padx=54, pady=(0, 10))
+        self.lbl_hint_toggle = ctk.CTkLabel(self.card_controls, text="Shortcut: Press ` (Backtick) to toggle", font=("Arial", 10), text_color="gray")
+        self.lbl_hint_toggle.pack(anchor="w", padx=54, pady=(0, 10))
 
         # Indicator: Temp Passthrough
         self.ctrl_indicator = ctk.CTkButton(self.card_controls, text="CTRL Key: Released", state="disabled", fg_color="transparent", border_width=1, border_color="#555", text_color="#888", width=200)
         self.ctrl_indicator.pack(anchor="w", padx=15, pady=(5, 0))
         
         lbl_hint_2 = ctk.CTkLabel(self.card_controls, text="Hold CTRL to temporarily click through transparent windows.", font=("Arial", 10), text_color="gray", wraplength=400, justify="left")
-        lbl_hint_2.pack(anchor="w", padx=15, pady=(5, 20))
+        lbl_hint_2.pack(anchor="w", padx=15, pady=(5, 10))
+
+        self.btn_rule = ctk.CTkButton(self.card_controls, text="Auto-Apply to This App", command=self.save_rule_for_current, height=24, fg_color="transparent", border_width=1, text_color=("gray10", "#DCE4EE"))
+        self.btn_rule.pack(anchor="w", padx=15, pady=(0, 20))
 
         # 4. Action Buttons
         self.btn_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -257,65 +236,214 @@ class App(ctk.CTk):
         self.btn_reset_all = ctk.CTkButton(self.btn_frame, text="Reset All & Exit", fg_color="#555", hover_color="#666", command=self.exit_app)
         self.btn_reset_all.pack(side="left", expand=True, fill="x", padx=(5, 0))
 
-        # 5. Status Bar
-        self.status_bar = ctk.CTkLabel(self, text="Ready.", text_color="gray", anchor="w", font=("Arial", 10))
-        self.status_bar.grid(row=4, column=0, sticky="ew", padx=20, pady=(0, 10))
+    def start_services(self):
+        # Anything a crashed run left ghosted comes back under our control
+        recovered = open_journal()
+        if recovered: self.status(f"Recovered {len(recovered)} window(s) left modified by the last session.")
+
+        # Slider drags go through the pipeline: one apply + one label update per frame at most
+        self.alpha_pipeline = AlphaPipeline(self.after, on_commit=self.on_alpha_committed)
+        self.animator = AlphaAnimator(self.after)
+
+        # Worker threads (input hooks, WinEvents) -> queue -> Tk thread
+        self.input_events = TkEventBridge(self, self.on_input_event)
+        self.fanout = PassthroughFanout(on_report=lambda r: self.input_events.post((FANOUT, r)))
+
+        # Init Data: one enumeration on a worker thread, then the inventory follows WinEvents
+        self.rules = RuleSet.load()
+        self.inventory.start(seed=False)
+        self.refresher = BackgroundRefresher(self.after, self.inventory.collect, self.on_windows_collected,
+                                             on_idle=lambda: self.btn_refresh.configure(text="Refresh List"))
+        self.resync_windows()
+
+        # Start Input
+
+        # Lock toggle is a registered hotkey; plain backtick via the hook only if registration fails
+        self.hotkeys = HotkeyManager(self.input_events.post)
+        toggle_id = self.hotkeys.register(TOGGLE_HOTKEY, self.toggle_lock_shortcut) if self.hotkeys.start() else None
+        watched = {VK_CONTROL, VK_MENU} if toggle_id else {VK_CONTROL, VK_OEM_3}
+        if toggle_id:
+            self.lbl_hint_toggle.configure(text=f"Shortcut: Press {TOGGLE_HOTKEY} to toggle")
+
+        self.key_edges = KeyEdgeDispatcher(self.input_events.post, watched=watched)
+        # Closed windows leave modified_windows as they go; the sweep catches any destroy the hook missed
+        eviction_listeners.append(self.on_window_evicted)
+        self.window_events = watch_window_events()
+        self.after(DEAD_SWEEP_MS, self.sweep_windows)
+        self.kbd_hook = LowLevelKeyboardHook(self.key_edges.feed)
+        if not self.kbd_hook.start_and_wait():
+            # Hook refused (policy / no desktop): feed the same dispatcher by polling instead
+            self.after(self.poll_ms, self.poll_inputs)
+        self.btn_refresh.configure(state="normal")
+
+        # Later launches forward their arguments here instead of starting a second App; scripts send batches
+        # of window commands, which run on the channel's threads and never wait for Tk
+        self.control = ControlServer({"args": self.control_args, **WINDOW_COMMANDS}, on_batch=self.on_control_batch,
+                                     waits={"args"})
+        if not self.control.start(): log.warning("control channel unavailable; a second launch will wait and give up")
+        # The X and Alt+F4 take the same way out as the button (before this, closing just ends mainloop)
+        self.protocol("WM_DELETE_WINDOW", self.exit_app)
+        if self.argv: self.run_args(self.argv)
 
-        # Init Data
-        self.refresh_windows()
-        
-        # Start Poll Loop
-        self.after(self.poll_ms, self.poll_inputs)
 
     def status(self, msg):
         self.status_bar.configure(text=msg)
 
+    # --- FORWARDED LAUNCHES ---
+    def control_args(self, arg):
+        """"args" command (control thread): run a second launch's argv on the Tk thread, reply with its result."""
+        done = threading.Event()
+        job = [json.loads(arg), done, None]
+        self.input_events.post((ARGS, job))
+        if not done.wait(10): raise TimeoutError("GhostWindow is busy")
+        return json.dumps(job[2])
+
+    # --- CLOSED WINDOWS ---
+    def on_window_evicted(self, hwnd):
+        # Any thread (WinEvent, control channel, the sweep); per-window UI state is dropped on the Tk thread
+        self.input_events.post((EVICTED, hwnd))
+
+    def sweep_windows(self):
+        sweep_dead_windows()
+        self.after(DEAD_SWEEP_MS, self.sweep_windows)
+
+    def on_control_batch(self, lines):
+        """Control thread, after a batch ran: one UI refresh per batch, only if it could have changed windows."""
+        if any(not line.startswith(("args", "list")) for line in lines):
+            self.input_events.post((CONTROL, len(lines)))
+
+    def run_args(self, argv):
+        """Carry out a ghost_cli command line in this instance -> {"exit", "output", "errors"}.
+        No arguments just brings the window forward, the way relaunching an app usually does."""
+        out, errors = [], []
+        result = {"exit": 0, "output": out, "errors": errors}
+        if not argv:
+            self.deiconify()
+            self.lift()
+            self.focus_force()
+            return result
+        import ghost_cli # argparse et al., only once somebody forwards something
+        parser = ghost_cli.build_parser()
+        help_text, usage = io.StringIO(), io.StringIO()
+        try:
+            with contextlib.redirect_stdout(help_text), contextlib.redirect_stderr(usage):
+                args = parser.parse_args(argv)
+        except SystemExit as e: # --help, or a usage error
+            out.extend(help_text.getvalue().splitlines())
+            errors.extend(usage.getvalue().splitlines())
+            result["exit"] = e.code or 0
+            return result
+        problem = ghost_cli.check(args)
+        if problem:
+            errors.append(problem)
+            result["exit"] = 2
+            return result
+        result["exit"] = ghost_cli.run(args, out.append, errors.append)
+        # The list and the controls should show what the command just did
+        if self.selected_hwnd is not None: self.on_window_select(self.combo_var.get())
+        self.status(out[-1] if out else errors[-1] if errors else "Command finished.")
+        return result
+
+    def on_inventory_change(self):
+        # Event thread: coalesce bursts (e.g. an app opening ten windows) into one UI refresh
+        if not self.inventory_pending:
+            self.inventory_pending = True
+            self.input_events.post((INVENTORY, None))
+
+    def on_window_appeared(self, info):
+        # Event/worker thread: matching is a few dict probes; applying is left to the Tk thread
+        if info.hwnd in self.rules.applied: return
+        rule = self.rules.match(info.exe, info.cls, info.title)
+        if rule is not None: self.input_events.post((RULE, (info.hwnd, rule)))
+
+    def refresh_list(self, full=False):
+        # The inventory follows WinEvents, so Refresh only shows its changes. Enumerating every window again is
+        # the fallback: no hooks, or Shift+click when events may have been missed
+        if full or not self.inventory.live:
+            self.resync_windows()
+            return
+        self.refresh_windows()
+        self.status("List is up to date (Shift+click Refresh to re-scan every window).")
+
+    def resync_windows(self):
+        # The UI thread never enumerates: a hung app can only stall the worker
+        self.inventory.begin_collect()
+        self.refresher.request()
+        self.btn_refresh.configure(text="Refreshing...")
+        if not self.all_display_names:
+            self.combo.configure(values=["Loading windows..."], state="disabled")
+            self.combo_var.set("Loading windows...")
+
+    def on_windows_collected(self, records):
+        self.inventory.install(records)
+        self.refresh_windows()
+        if records is not None: self.startup.mark("list_ready", f"{len(records)} windows")
+
     def refresh_windows(self):
-        wins = get_visible_windows()
-        self.windows_map = {f"{title}": hwnd for hwnd, title in wins}
-        
-        # Create display names (Handle duplicates if necessary, simpler here)
-        display_names = list(self.windows_map.keys())
+        version, records = self.inventory.snapshot()
+        if version == self.inventory_version: return
+        self.inventory_version = version
+        self.windows_map = self.inventory.store
+        self.all_display_names = [rec.display for rec in records]
+        self.apply_filter()
+
+        # Restore selection if exists
+        display_names = self.all_display_names
+        if self.selected_hwnd:
+            name = self.windows_map.display_name(self.selected_hwnd)
+            if name is not None:
+                self.combo_var.set(name)
+            elif records:
+                self.combo_var.set(display_names[0])
+                self.on_window_select(display_names[0])
+        elif records and not self.inventory.cached:
+             self.combo_var.set(display_names[0])
+             self.on_window_select(display_names[0])
+
+    def apply_filter(self):
+        query = self.search_var.get().strip()
+        if query:
+            # Display names are unique (duplicates get "(2)", "(3)"...), so every window is selectable
+            display_names = [rec.display for rec in self.inventory.find(query, limit=200)]
+        else:
+            display_names = self.all_display_names
         
         if not display_names:
-            display_names = ["No visible windows found"]
+            display_names = ["No matching windows" if query else "No visible windows found"]
             self.combo.configure(state="disabled")
         else:
             self.combo.configure(state="normal")
             
         self.combo.configure(values=display_names)
-        
-        # Restore selection if exists
-        if self.selected_hwnd:
-            # Find title for hwnd
-            found = False
-            for title, h in self.windows_map.items():
-                if h == self.selected_hwnd:
-                    self.combo_var.set(title)
-                    found = True
-                    break
-            if not found and display_names:
-                self.combo_var.set(display_names[0])
-                self.on_window_select(display_names[0])
-        elif display_names:
-             self.combo_var.set(display_names[0])
-             self.on_window_select(display_names[0])
+        return display_names
+
+    def on_search(self, _event=None):
+        display_names = self.apply_filter()
+        query = self.search_var.get().strip()
+        # Enter picks the best match
+        if query and _event is not None and _event.keysym == "Return" and self.windows_map.hwnd_for_display(display_names[0]):
+            self.combo_var.set(display_names[0])
+            self.on_window_select(display_names[0])
 
     def on_window_select(self, choice):
-        if choice not in self.windows_map: return
-        self.selected_hwnd = self.windows_map[choice]
+        hwnd = self.windows_map.hwnd_for_display(choice)
+        if hwnd is None or not self.controls_ready: return
+        if not self.inventory.is_live(hwnd):
+            self.status("That window has closed since last session; the list is still loading.")
+            return
+        self.selected_hwnd = hwnd
         
         # Update UI to reflect window state if we already modified it
         self.programmatic_update = True
         if self.selected_hwnd in modified_windows:
+            revalidate_styles([self.selected_hwnd]) # cheap: one read, catches changes no event told us about
             info = modified_windows[self.selected_hwnd]
             # Slider
-            alpha_pct = int(info["alpha"] * 100 / 255)
+            alpha_pct = int(info.alpha * 100 / 255)
             self.slider.set(alpha_pct)
             self.slider_val_label.configure(text=f"{alpha_pct}%")
             # Lock Switch
-            is_locked = info.get("passthrough_locked", False)
-            if is_locked:
+            if info.passthrough_locked:
                 self.switch_lock.select()
             else:
                 self.switch_lock.deselect()
@@ -330,13 +458,17 @@ class App(ctk.CTk):
 
     def on_slider(self, val):
         if not self.selected_hwnd: return
-        val = int(val)
-        self.slider_val_label.configure(text=f"{val}%")
-        
-        if set_window_alpha(self.selected_hwnd, val):
-            self.status(f"Opacity set to {val}%")
-        else:
-            self.status("Failed to set opacity (System Window?)")
+        self.animator.cancel(self.selected_hwnd) # grabbing the slider wins over a fade in progress
+        self.alpha_pipeline.request(self.selected_hwnd, int(val))
+
+    def on_alpha_committed(self, results):
+        for hwnd, val, ok in results:
+            if hwnd != self.selected_hwnd: continue
+            self.slider_val_label.configure(text=f"{val}%")
+            if ok:
+                self.status(f"Opacity set to {val}%")
+            else:
+                self.status("Failed to set opacity (System Window?)")
 
     def on_toggle_lock(self):
         if self.programmatic_update: return
@@ -354,50 +486,141 @@ class App(ctk.CTk):
             set_passthrough_for_hwnd(self.selected_hwnd, enable=should_be_active, mark_locked=False)
             self.status("Click-through unlocked.")
 
+    def save_rule_for_current(self):
+        info = self.windows_map.get(self.selected_hwnd) if self.selected_hwnd else None
+        if info is None or not (info.exe or info.cls):
+            self.status("Select a window first.")
+            return
+        rule = Rule(exe=info.exe or None, cls=info.cls or None, alpha=int(self.slider.get()),
+                    passthrough=bool(self.switch_lock_var.get()))
+        self.rules.add(rule)
+        self.rules.applied.add(info.hwnd)
+        try:
+            self.rules.save()
+        except OSError as e:
+            self.status(f"Could not save rules: {e}")
+            return
+        self.status(f"Rule saved: {rule}")
+
     def restore_current(self):
         if self.selected_hwnd:
-            restore_window(self.selected_hwnd)
+            self.alpha_pipeline.cancel(self.selected_hwnd)
+            if self.selected_hwnd not in modified_windows:
+                return self.on_restored(self.selected_hwnd, True)
+            # Fade back to opaque first, then drop the styles
+            self.animator.fade(self.selected_hwnd, 100, duration_ms=RESTORE_FADE_MS, on_done=self.on_restored)
+            self.status("Restoring...")
+
+    def on_restored(self, hwnd, _ok):
+        restore_window(hwnd)
+        if hwnd == self.selected_hwnd:
             self.on_window_select(self.combo_var.get()) # Reset UI
             self.status("Restored original window state.")
 
+    def save_window_list(self):
+        # For the next start to show at once; never the previous session's list we were still showing
+        if self.list_saved or self.inventory.cached: return
+        self.list_saved = True
+        save_window_cache(self.inventory.snapshot()[1])
+
     def exit_app(self):
+        self.control.stop()
+        eviction_listeners.remove(self.on_window_evicted)
+        self.save_window_list()
+        self.alpha_pipeline.cancel()
+        self.animator.cancel()
+        self.refresher.cancel()
+        self.kbd_hook.stop()
+        self.hotkeys.stop()
+        self.inventory.stop()
+        if self.window_events: self.window_events.stop()
+        # Let in-flight style writes land before restoring over them, but don't let a hung window hold up exit.
+        # Workers report through the bridge, which never waits on this thread, so waiting here can't deadlock
+        if not self.fanout.shutdown(timeout=FANOUT_EXIT_WAIT_S): log.warning("exit: click-through writes still pending")
+        self.input_events.close()
         restore_all()
+        close_journal()
         self.destroy()
         sys.exit(0)
 
-    # --- INPUT POLLING ---
+    # --- INPUT EVENTS ---
+    def on_input_event(self, event):
+        kind, vk = event
+        # 1. CTRL (Temporary Passthrough). Alt makes it the Ctrl+Alt+` chord (or AltGr): off until both are up
+        held = self.ctrl_hold.feed(kind, vk)
+        if held is not None:
+            self.set_ctrl_held(held, started_at=self.key_edges.edge_at.get(vk)) # Ctrl's edge, or Alt's
+
+        # 2. Lock toggle: registered hotkey, or backtick rising edge as fallback
+        elif kind == HOTKEY:
+            self.hotkeys.fire(vk)
+        elif vk == VK_OEM_3 and kind == KEY_DOWN:
+            self.toggle_lock_shortcut()
+
+        # 3. Window list changed
+        elif kind == INVENTORY:
+            self.inventory_pending = False
+            self.refresh_windows()
+
+        # 4. Auto-apply rule matched a new window
+        elif kind == RULE:
+            hwnd, rule = vk
+            if hwnd in self.rules.applied: return
+            ok = self.rules.apply(hwnd, rule)
+            if hwnd == self.selected_hwnd: self.on_window_select(self.combo_var.get()) # show the new state
+            info = self.windows_map.get(hwnd)
+            name = info.display if info is not None else hex(hwnd)
+            self.status(f"Rule applied to {name}: {rule}" if ok else f"Rule failed on {name} (System Window?)")
+
+        # 5. CTRL fan-out finished (vk slot carries the report)
+        elif kind == FANOUT and vk.windows:
+            state = "on" if vk.enable else "off"
+            failed = f", {vk.failed} failed" if vk.failed else ""
+            self.status(f"Click-through {state} for {vk.windows} windows in {vk.latency_ms:.1f} ms{failed}")
+
+        # 6. A script changed windows over the control channel (vk slot: command count)
+        elif kind == CONTROL:
+            if self.selected_hwnd is not None: self.on_window_select(self.combo_var.get())
+            self.status(f"Control channel: {vk} command(s) applied")
+
+        # 7. A tracked window closed, or its handle now names another process's window (vk slot: hwnd)
+        elif kind == EVICTED:
+            self.alpha_pipeline.cancel(vk)
+            self.animator.cancel(vk)
+            self.fanout.forget(vk)
+            self.rules.applied.discard(vk) # a reused handle is a new window, due its own rule
+            if vk == self.selected_hwnd: self.status("The selected window has closed.")
+
+        # 8. Another launch forwarded its command line (vk slot: [argv, done, result])
+        elif kind == ARGS:
+            argv, done, _ = vk
+            try:
+                vk[2] = self.run_args(argv)
+            except Exception as e:
+                vk[2] = {"exit": 1, "output": [], "errors": [f"GhostWindow: {e}"]}
+            done.set()
+
+    def toggle_lock_shortcut(self):
+        if self.selected_hwnd:
+            # Toggle the UI switch, which triggers the logic via command
+            self.switch_lock.toggle()
+
+    def set_ctrl_held(self, ctrl_down, started_at=None):
+        if ctrl_down == self.ctrl_held: return
+        self.ctrl_held = ctrl_down
+
+        # Apply temporary passthrough to all modified windows that AREN'T locked, before touching any widgets
+        self.fanout.apply(ctrl_down, started_at=started_at)
+        self.update_ctrl_ui(ctrl_down)
+
     def poll_inputs(self):
-        # 1. Check CTRL (Temporary Passthrough)
-        try:
-            vk_ctrl = 0x11
-            # high-order bit set if down
-            ctrl_down = bool(user32.GetAsyncKeyState(vk_ctrl) & 0x8000)
-            
-            if ctrl_down != self.ctrl_held:
-                self.ctrl_held = ctrl_down
-                self.update_ctrl_ui(ctrl_down)
-                
-                # Apply temporary passthrough to all modified windows that AREN'T locked
-                for h, info in list(modified_windows.items()):
-                    if not info.get("passthrough_locked"):
-                        set_passthrough_for_hwnd(h, enable=ctrl_down)
-        except:
-            pass
-
-        # 2. Check Backtick (Toggle Lock for Selection)
-        try:
-            vk_tick = 0xC0 # ` key
-            tick_down = bool(user32.GetAsyncKeyState(vk_tick) & 0x8000)
-            
-            # Detect Rising Edge (Pressed now, wasn't before)
-            if tick_down and not self.backtick_prev:
-                if self.selected_hwnd:
-                    # Toggle the UI switch, which triggers the logic via command
-                    self.switch_lock.toggle() 
-            
-            self.backtick_prev = tick_down
-        except:
-            pass
+        # Fallback only: sample the keys and let the dispatcher produce the same edges as the hook
+        for vk in self.key_edges.watched:
+            try:
+                # high-order bit set if down
+                self.key_edges.feed(vk, bool(ghost_core.backend.get_async_key_state(vk) & 0x8000))
+            except:
+                pass
 
         self.after(self.poll_ms, self.poll_inputs)
 
@@ -408,8 +631,16 @@ class App(ctk.CTk):
             self.ctrl_indicator.configure(text="CTRL Key: Released", fg_color="transparent", text_color="#888", border_color="#555")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("GHOST_LOG", "INFO").upper(), format="%(asctime)s %(name)s: %(message)s")
+    install_exit_hooks()
+    startup = StartupClock()
+    startup.mark("imports")
+    app = None
     try:
-        app = App()
+        app = App(startup, sys.argv[1:])
         app.mainloop()
     finally:
+        # Closed by the window manager, SIGTERM (signal_handler's SystemExit) or an error: still keep the list
+        if app is not None: app.save_window_list()
         restore_all()
+        INSTANCE.release()
@@ -0,0 +1,73 @@
+"""Control channel against the simulated desktop, over a Unix socket.
+
+    python -m unittest discover -s tests    # from the repo root
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import ghost_core as ghost
+from ghost_core import ControlClient, ControlServer, WINDOW_COMMANDS
+
+@unittest.skipIf(sys.platform == "win32", "uses a Unix socket address")
+class ControlServerTest(unittest.TestCase):
+    def setUp(self):
+        ghost.restore_all()
+        self.sim = ghost.set_backend(ghost.SimulatedDesktop(count=20))
+        self.hwnds = [h for h, w in self.sim.windows.items() if w.visible and w.title][:3]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp.name, "control.sock")
+        self.entered, self.release = threading.Event(), threading.Event()
+        self.server = ControlServer({"args": self.args, **WINDOW_COMMANDS}, address=self.address, waits={"args"})
+        self.assertTrue(self.server.start())
+
+    def tearDown(self):
+        self.release.set()
+        self.server.stop()
+        self.tmp.cleanup()
+        ghost.restore_all()
+
+    def args(self, arg):
+        # Stands in for App.control_args: hand off to the UI thread and wait for it
+        self.entered.set()
+        if not self.release.wait(5): raise TimeoutError("GhostWindow is busy")
+        return arg
+
+    def test_waiting_command_does_not_hold_up_other_clients(self):
+        slow = []
+        def forwarded_launch():
+            with ControlClient(self.address) as client:
+                slow.append(client.batch(["args []"]))
+        launcher = threading.Thread(target=forwarded_launch)
+        launcher.start()
+        self.assertTrue(self.entered.wait(5))
+        t0 = time.perf_counter()
+        with ControlClient(self.address) as client:
+            self.assertEqual(client.batch([f"set_alpha {self.hwnds[0]:#x} 50"]), ["ok"])
+        self.assertLess(time.perf_counter() - t0, 1.0)
+        self.assertEqual(slow, []) # still waiting
+        self.release.set()
+        launcher.join(5)
+        self.assertEqual(slow, [["ok []"]])
+
+    def test_mixed_batch_replies_in_order(self):
+        self.release.set()
+        h1, h2 = self.hwnds[:2]
+        with ControlClient(self.address) as client:
+            replies = client.batch([f"set_alpha {h1:#x} 40", "args [1]", f"set_alpha {h2:#x} 40", "nope"])
+        self.assertEqual(replies, ["ok", "ok [1]", "ok", "err unknown command 'nope'"])
+        self.assertEqual([self.sim.windows[h].alpha for h in (h1, h2)], [ghost.alpha_byte(40)] * 2)
+
+    def test_reply_follows_the_batched_z_order(self):
+        with ControlClient(self.address) as client:
+            replies = client.batch([f"set_alpha {h:#x} 60" for h in self.hwnds])
+            # Read as soon as the reply arrives: the DeferWindowPos must already have run
+            raised = [self.sim.windows[h].topmost for h in self.hwnds]
+        self.assertEqual(replies, ["ok"] * len(self.hwnds))
+        self.assertEqual(raised, [True] * len(self.hwnds))
+
+if __name__ == "__main__":
+    unittest.main()
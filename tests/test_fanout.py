@@ -0,0 +1,100 @@
+"""CTRL click-through fan-out against the simulated desktop.
+
+    python -m unittest discover -s tests    # from the repo root
+"""
+import time
+import unittest
+from concurrent.futures import Future
+
+import ghost_core as ghost
+from ghost_core import PassthroughFanout, WS_EX_TRANSPARENT
+
+class HeldPool:
+    """Executor whose jobs wait for run(): the plan is made, the writes haven't gone out yet."""
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        fut = Future()
+        self.jobs.append((fut, fn, args))
+        return fut
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fut, fn, args in jobs:
+            fut.set_result(fn(*args))
+
+    def shutdown(self, wait=True):
+        self.run()
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self):
+        ghost.restore_all()
+        self.sim = ghost.set_backend(ghost.SimulatedDesktop(count=20, hang_s=0.3))
+        self.hwnds = [h for h, w in self.sim.windows.items() if w.visible and w.title][:3]
+        for h in self.hwnds: ghost.set_window_alpha(h, 50)
+        self.fanout = PassthroughFanout()
+
+    def tearDown(self):
+        self.fanout.shutdown(timeout=5)
+        ghost.restore_all()
+
+    def transparent(self, h):
+        return bool(self.sim.windows[h].ex_style & WS_EX_TRANSPARENT)
+
+    def test_hold_and_release(self):
+        self.fanout.apply(True)
+        self.assertTrue(self.fanout.shutdown(timeout=5))
+        self.assertTrue(all(self.transparent(h) for h in self.hwnds))
+        self.assertEqual(self.fanout.last_report.writes, len(self.hwnds))
+
+    def test_window_restored_before_its_write_is_not_tracked_again(self):
+        h = self.hwnds[0]
+        self.fanout.pool = pool = HeldPool()
+        self.fanout.apply(True)
+        ghost.restore_window(h)
+        pool.run()
+        self.assertNotIn(h, ghost.modified_windows)
+        self.assertFalse(self.transparent(h))
+
+    def test_window_ghosted_again_before_its_write_is_left_alone(self):
+        h = self.hwnds[0]
+        self.fanout.pool = pool = HeldPool()
+        self.fanout.apply(True)
+        ghost.restore_window(h)
+        ghost.set_window_alpha(h, 70) # a new entry: the plan was made for the old one
+        pool.run()
+        self.assertIn(h, ghost.modified_windows)
+        self.assertFalse(self.transparent(h))
+
+    def test_window_locked_before_its_write_is_left_alone(self):
+        h = self.hwnds[0]
+        self.fanout.apply(True)
+        self.fanout.shutdown(timeout=5)
+        self.fanout = PassthroughFanout()
+        self.fanout.pool = pool = HeldPool()
+        self.fanout.apply(False)
+        ghost.set_passthrough_for_hwnd(h, True, mark_locked=True)
+        pool.run()
+        self.assertTrue(self.transparent(h)) # the lock wins over the CTRL release
+        self.assertFalse(any(self.transparent(other) for other in self.hwnds[1:]))
+
+    def test_single_window_is_written_off_the_caller_thread(self):
+        h = self.hwnds[0]
+        for other in self.hwnds[1:]: ghost.restore_window(other)
+        self.sim.windows[h].hung = True
+        t0 = time.perf_counter()
+        self.fanout.apply(True)
+        self.assertLess(time.perf_counter() - t0, self.sim.hang_s / 2)
+        self.assertTrue(self.fanout.shutdown(timeout=5))
+        self.assertTrue(self.transparent(h))
+        self.assertEqual(self.fanout.last_report.writes, 1)
+
+    def test_latency_counts_from_the_given_edge(self):
+        edge = time.perf_counter() - 0.5
+        self.fanout.apply(True, started_at=edge)
+        self.assertTrue(self.fanout.shutdown(timeout=5))
+        self.assertGreaterEqual(self.fanout.last_report.latency_ms, 500)
+
+if __name__ == "__main__":
+    unittest.main()
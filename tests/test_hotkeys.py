@@ -0,0 +1,135 @@
+"""Global hotkeys without Windows: FakeHotkeyPump stands in for the OS posting WM_HOTKEY.
+
+    python -m unittest discover -s tests    # from the repo root
+"""
+import unittest
+
+from ghost_core import (CtrlHold, FakeHotkeyPump, HotkeyManager, KeyEdgeDispatcher,
+                        HOTKEY, MOD_ALT, MOD_CONTROL, TOGGLE_HOTKEY, VK_CONTROL, VK_LCONTROL, VK_LMENU, VK_MENU,
+                        VK_OEM_3, VK_RMENU)
+
+class HotkeyManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.delivered = []
+        self.pump = FakeHotkeyPump()
+        self.hotkeys = HotkeyManager(self.delivered.append, pump=self.pump)
+        self.assertTrue(self.hotkeys.start())
+
+    def press(self, combo):
+        """The OS posts WM_HOTKEY, the pump delivers it, the UI thread fires it."""
+        pressed = self.pump.press(combo)
+        for kind, hotkey_id in self.delivered:
+            self.assertEqual(kind, HOTKEY)
+            self.hotkeys.fire(hotkey_id)
+        self.delivered.clear()
+        return pressed
+
+    def test_register_and_fire(self):
+        fired = []
+        hotkey_id = self.hotkeys.register(TOGGLE_HOTKEY, lambda: fired.append("toggle"))
+        self.assertIsNotNone(hotkey_id)
+        self.assertEqual(self.pump.registered[hotkey_id], (MOD_CONTROL | MOD_ALT, VK_OEM_3))
+        self.assertTrue(self.press("Alt+Ctrl+`"))
+        self.assertEqual(fired, ["toggle"])
+
+    def test_unpressed_and_unknown_combos_do_nothing(self):
+        fired = []
+        self.hotkeys.register(TOGGLE_HOTKEY, lambda: fired.append("toggle"))
+        self.assertFalse(self.press("Ctrl+`"))
+        self.assertFalse(self.press("Ctrl+Alt+Shift+`"))
+        self.assertEqual(fired, [])
+
+    def test_combo_taken(self):
+        first = self.hotkeys.register(TOGGLE_HOTKEY, lambda: None)
+        self.assertIsNone(self.hotkeys.register("Alt+Ctrl+`", lambda: None))
+        self.assertEqual(list(self.hotkeys.bindings), [first])
+
+    def test_unregister_by_combo_and_by_id(self):
+        fired = []
+        by_combo = self.hotkeys.register(TOGGLE_HOTKEY, lambda: fired.append("toggle"))
+        by_id = self.hotkeys.register("Ctrl+Shift+F9", lambda: fired.append("f9"))
+        self.assertTrue(self.hotkeys.unregister(TOGGLE_HOTKEY))
+        self.assertTrue(self.hotkeys.unregister(by_id))
+        self.assertFalse(self.hotkeys.unregister(by_combo))
+        self.assertEqual(self.pump.registered, {})
+        self.assertFalse(self.press(TOGGLE_HOTKEY))
+        self.assertFalse(self.press("Ctrl+Shift+F9"))
+        self.assertEqual(fired, [])
+
+    def test_fire_after_unregister_is_dropped(self):
+        # A press already on its way to the UI thread when the binding goes
+        fired = []
+        hotkey_id = self.hotkeys.register(TOGGLE_HOTKEY, lambda: fired.append("toggle"))
+        self.pump.press(TOGGLE_HOTKEY)
+        self.hotkeys.unregister(hotkey_id)
+        for _kind, pending in self.delivered: self.hotkeys.fire(pending)
+        self.assertEqual(fired, [])
+
+    def test_register_needs_a_running_pump(self):
+        self.hotkeys.stop()
+        self.assertFalse(self.hotkeys.active)
+        self.assertIsNone(self.hotkeys.register(TOGGLE_HOTKEY, lambda: None))
+        self.assertEqual(self.pump.registered, {})
+
+class ToggleChordTest(unittest.TestCase):
+    """Ctrl+Alt+` toggles the lock; it must not leave the Ctrl passthrough hold on."""
+    def setUp(self):
+        self.hold = CtrlHold()
+        self.states = [] # every hold state the edges produced
+        self.toggles = 0
+        self.edges = KeyEdgeDispatcher(self.on_edge, watched={VK_CONTROL, VK_MENU})
+        self.pump = FakeHotkeyPump()
+        self.hotkeys = HotkeyManager(self.on_edge, pump=self.pump)
+        self.hotkeys.start()
+        self.hotkeys.register(TOGGLE_HOTKEY, self.toggle)
+
+    def toggle(self):
+        self.toggles += 1
+
+    def on_edge(self, event):
+        kind, vk = event
+        if kind == HOTKEY:
+            self.hotkeys.fire(vk)
+            return
+        held = self.hold.feed(kind, vk)
+        if held is not None: self.states.append(held)
+
+    def keys(self, *steps):
+        for vk, is_down in steps:
+            self.edges.feed(vk, is_down)
+
+    def test_plain_ctrl_is_a_hold(self):
+        self.keys((VK_LCONTROL, True), (VK_LCONTROL, True), (VK_LCONTROL, False))
+        self.assertEqual(self.states, [True, False])
+
+    def test_ctrl_then_alt_toggles_and_reverts_the_hold(self):
+        self.keys((VK_LCONTROL, True), (VK_LMENU, True))
+        self.pump.press(TOGGLE_HOTKEY)
+        self.keys((VK_LMENU, False), (VK_LCONTROL, False))
+        self.assertEqual(self.toggles, 1)
+        self.assertEqual(self.states, [True, False, False, False])
+
+    def test_alt_released_first_keeps_the_hold_off(self):
+        self.keys((VK_LCONTROL, True), (VK_LMENU, True))
+        self.pump.press(TOGGLE_HOTKEY)
+        self.keys((VK_LMENU, False), (VK_LCONTROL, True), (VK_LCONTROL, False))
+        self.assertFalse(any(self.states[1:]))
+        # The next Ctrl press on its own is a hold again
+        self.keys((VK_LCONTROL, True))
+        self.assertEqual(self.states[-1], True)
+
+    def test_alt_then_ctrl_never_holds(self):
+        self.keys((VK_LMENU, True), (VK_LCONTROL, True))
+        self.pump.press(TOGGLE_HOTKEY)
+        self.keys((VK_LCONTROL, False), (VK_LMENU, False))
+        self.assertEqual(self.toggles, 1)
+        self.assertFalse(any(self.states))
+
+    def test_altgr_never_holds(self):
+        # AltGr arrives as LCtrl + RAlt
+        self.keys((VK_LCONTROL, True), (VK_RMENU, True), (VK_RMENU, False), (VK_LCONTROL, False))
+        self.assertEqual(self.states[1:], [False, False, False])
+        self.assertEqual(self.toggles, 0)
+
+if __name__ == "__main__":
+    unittest.main()
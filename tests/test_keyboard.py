@@ -0,0 +1,85 @@
+"""Key edges without Windows: SyntheticKeyboardHook pushes keys where the WH_KEYBOARD_LL hook would.
+
+    python -m unittest discover -s tests    # from the repo root
+"""
+import unittest
+
+from ghost_core import (KeyEdgeDispatcher, SyntheticKeyboardHook,
+                        KEY_DOWN, KEY_UP, MOD_DOWN, MOD_UP, VK_CONTROL, VK_LCONTROL, VK_LMENU, VK_MENU, VK_OEM_3,
+                        VK_RCONTROL)
+
+VK_A = 0x41
+
+class KeyEdgeTest(unittest.TestCase):
+    def setUp(self):
+        self.edges = []
+        self.dispatcher = KeyEdgeDispatcher(self.edges.append)
+        self.hook = SyntheticKeyboardHook(self.dispatcher.feed)
+        self.assertTrue(self.hook.start_and_wait())
+
+    def tearDown(self):
+        self.hook.stop()
+        self.assertFalse(self.hook.ok)
+
+    def test_down_and_up(self):
+        self.hook.tap(VK_OEM_3)
+        self.assertEqual(self.edges, [(KEY_DOWN, VK_OEM_3), (KEY_UP, VK_OEM_3)])
+
+    def test_auto_repeat_is_one_edge(self):
+        for _ in range(5): self.hook.press(VK_LCONTROL)
+        self.hook.release(VK_LCONTROL)
+        self.assertEqual(self.edges, [(MOD_DOWN, VK_CONTROL), (MOD_UP, VK_CONTROL)])
+
+    def test_release_of_a_key_never_pressed(self):
+        # The hook started while the key was already down
+        self.hook.release(VK_A)
+        self.assertEqual(self.edges, [])
+
+    def test_left_and_right_are_one_modifier(self):
+        self.hook.press(VK_LCONTROL)
+        self.hook.press(VK_RCONTROL)
+        self.hook.release(VK_LCONTROL) # still held on the right
+        self.assertEqual(self.edges, [(MOD_DOWN, VK_CONTROL)])
+        self.hook.release(VK_RCONTROL)
+        self.assertEqual(self.edges, [(MOD_DOWN, VK_CONTROL), (MOD_UP, VK_CONTROL)])
+
+    def test_polled_generic_code_matches_the_hook(self):
+        # poll_inputs feeds VK_CONTROL where the hook reports VK_LCONTROL
+        self.dispatcher.feed(VK_CONTROL, True)
+        self.dispatcher.feed(VK_CONTROL, True)
+        self.dispatcher.feed(VK_CONTROL, False)
+        self.assertEqual(self.edges, [(MOD_DOWN, VK_CONTROL), (MOD_UP, VK_CONTROL)])
+
+    def test_ctrl_alt_chord(self):
+        self.hook.press(VK_LCONTROL)
+        self.hook.press(VK_LMENU)
+        self.hook.press(VK_LMENU) # auto-repeat while both are down
+        self.hook.tap(VK_OEM_3)
+        self.hook.release(VK_LMENU)
+        self.hook.release(VK_LCONTROL)
+        self.assertEqual(self.edges, [(MOD_DOWN, VK_CONTROL), (MOD_DOWN, VK_MENU),
+                                      (KEY_DOWN, VK_OEM_3), (KEY_UP, VK_OEM_3),
+                                      (MOD_UP, VK_MENU), (MOD_UP, VK_CONTROL)])
+
+    def test_edges_are_timestamped(self):
+        self.hook.press(VK_LCONTROL)
+        pressed = self.dispatcher.edge_at[VK_CONTROL]
+        self.hook.press(VK_LCONTROL)
+        self.assertEqual(self.dispatcher.edge_at[VK_CONTROL], pressed) # repeats don't move it
+        self.hook.press(VK_LMENU)
+        self.assertGreaterEqual(self.dispatcher.edge_at[VK_MENU], pressed)
+
+class WatchedKeysTest(unittest.TestCase):
+    def test_only_watched_keys_reach_the_sink(self):
+        edges = []
+        hook = SyntheticKeyboardHook(KeyEdgeDispatcher(edges.append, watched={VK_CONTROL, VK_MENU}).feed)
+        hook.tap(VK_A)
+        hook.tap(VK_OEM_3)
+        hook.press(VK_RCONTROL)
+        hook.tap(VK_LMENU)
+        hook.release(VK_RCONTROL)
+        self.assertEqual(edges, [(MOD_DOWN, VK_CONTROL), (MOD_DOWN, VK_MENU), (MOD_UP, VK_MENU),
+                                 (MOD_UP, VK_CONTROL)])
+
+if __name__ == "__main__":
+    unittest.main()